@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+import struct
+
+from parallel_gzip import ParallelGzipWriter, BgzfWriter, compress_bgzf
+
+
+#
+# Indexes of BGZF output files, built from their lines as they are
+# written by a BgzfWriter (parallel_gzip.py), in the formats of htslib:
+#
+#   TabixIndex  <file>.tbi or <file>.csi, for the features of a
+#               sorted GFF3 file, as built by tabix -p gff [-C]
+#   FastaIndex  <file>.fai and <file>.gzi, for a FASTA file,
+#               as built by samtools faidx
+#
+# Positions are recorded as offsets in the text while the file is
+# written and turned into BGZF virtual offsets when the index is saved,
+# as only then have all of the blocks been compressed.
+#
+
+# Indexes of BGZF GFF3 output
+GFF_INDEX_FORMATS = ['tbi', 'csi']
+
+# Tabix binning: 16 kb windows, with bins 8 times larger at each level up
+TABIX_MIN_SHIFT = 14
+TBI_DEPTH = 5
+# A CSI index covers sequences up to 2^32 bases, as tabix -C does
+CSI_DEPTH = 6
+
+# Tabix configuration for GFF3: generic format, 1-based seqid, start
+# and end columns, '#' comment lines and no header lines to skip
+TABIX_GFF_CONF = (0, 1, 4, 5, ord('#'), 0)
+
+
+#
+# The bin of a 0-based, half-open interval in a binning
+# scheme of the given depth, as reg2bin in the SAM specification.
+#
+def region_bin(beg, end, min_shift=TABIX_MIN_SHIFT, depth=TBI_DEPTH):
+
+	end = end - 1
+	shift = min_shift
+	first = ((1 << depth * 3) - 1) // 7
+
+	for level in range(depth, 0, -1):
+		if beg >> shift == end >> shift:
+			return first + (beg >> shift)
+		shift = shift + 3
+		first = first - (1 << (level - 1) * 3)
+
+	return 0
+
+
+#
+# The first window of the linear index in the range of a bin.
+#
+def bin_first_window(bin, depth):
+
+	level = 0
+	parent = bin
+	while parent > 0:
+		level = level + 1
+		parent = (parent - 1) >> 3
+
+	return (bin - ((1 << level * 3) - 1) // 7) << (depth - level) * 3
+
+
+#
+# The features of one sequence: the chunks of file of each bin, and the
+# first feature in each window of the linear index, as text offsets.
+#
+class TabixSequence:
+
+	def __init__(self, name):
+		self.name = name
+		# bin -> [[start, end]] in file order
+		self.bins = {}
+		# window -> offset of the first feature overlapping it
+		self.windows = {}
+		self.last_beg = 0
+
+	def add(self, bin, beg, end, start, stop):
+
+		chunks = self.bins.setdefault(bin, [])
+		if len(chunks) > 0 and chunks[-1][1] == start:
+			chunks[-1][1] = stop
+		else:
+			chunks.append([start, stop])
+
+		for window in range(beg >> TABIX_MIN_SHIFT, ((end - 1) >> TABIX_MIN_SHIFT) + 1):
+			if window not in self.windows:
+				self.windows[window] = start
+
+		self.last_beg = beg
+
+	#
+	# The linear index, with each window that no feature overlaps
+	# given the offset of the window before it.
+	#
+	def linear_index(self):
+
+		size = max(self.windows) + 1 if len(self.windows) > 0 else 0
+		offsets = []
+		last = min(self.windows.values()) if len(self.windows) > 0 else 0
+
+		for window in range(size):
+			last = self.windows.get(window, last)
+			offsets.append(last)
+
+		return offsets
+
+
+#
+# Tabix index of the features of a GFF3 file, sorted by sequence and
+# start. Comment and pragma lines are skipped, and indexing stops at
+# the ##FASTA section of a file with embedded sequences. A TBI index
+# only covers sequences up to 2^29 bases; a CSI index covers longer ones.
+#
+class TabixIndex:
+
+	def __init__(self, csi=False):
+		self.csi = csi
+		self.depth = CSI_DEPTH if csi else TBI_DEPTH
+		self.sequences = []
+		self.names = {}
+		self.fasta = False
+
+	def suffix(self):
+
+		return ".csi" if self.csi else ".tbi"
+
+	def add_line(self, line, start, end):
+
+		if self.fasta or len(line) == 0:
+			return
+
+		if line.startswith(b'#'):
+			self.fasta = line.startswith(b'##FASTA')
+			return
+
+		cols = line.split(b'\t', 5)
+		if len(cols) < 5:
+			raise ValueError('Not a GFF3 feature line: %s' % line[:80].decode('utf-8', 'replace'))
+
+		name = cols[0].decode('utf-8')
+		beg = int(cols[3]) - 1
+		stop = max(int(cols[4]), beg + 1)
+
+		if beg < 0:
+			raise ValueError('Feature on %s starts before the sequence' % name)
+		if not self.csi and stop > 1 << (TABIX_MIN_SHIFT + 3 * TBI_DEPTH):
+			raise ValueError('Feature on %s ends beyond the 512 Mb limit of a tbi index, use a csi index' % name)
+
+		if len(self.sequences) == 0 or self.sequences[-1].name != name:
+			if name in self.names:
+				raise ValueError('Features on %s are not together in the file' % name)
+			self.names[name] = len(self.sequences)
+			self.sequences.append(TabixSequence(name))
+
+		sequence = self.sequences[-1]
+		if beg < sequence.last_beg:
+			raise ValueError('Features on %s are not sorted by start' % name)
+
+		sequence.add(region_bin(beg, stop, TABIX_MIN_SHIFT, self.depth), beg, stop, start, end)
+
+	#
+	# The tabix header: the configuration and the sequence names.
+	#
+	def header(self):
+
+		names = b''.join(sequence.name.encode('utf-8') + b'\0' for sequence in self.sequences)
+
+		return struct.pack('<6ii', *(TABIX_GFF_CONF + (len(names),))) + names
+
+	#
+	# The chunks of a bin in virtual offsets.
+	#
+	@staticmethod
+	def chunk_data(chunks, writer):
+
+		data = struct.pack('<i', len(chunks))
+		for (start, end) in chunks:
+			data = data + struct.pack('<QQ', writer.virtual_offset(start), writer.virtual_offset(end))
+
+		return data
+
+	#
+	# Save the index beside the file that the writer wrote.
+	#
+	def save(self, path, writer):
+
+		if self.csi:
+			header = self.header()
+			parts = [b'CSI\1', struct.pack('<iii', TABIX_MIN_SHIFT, self.depth, len(header)), header, struct.pack('<i', len(self.sequences))]
+		else:
+			parts = [b'TBI\1', struct.pack('<i', len(self.sequences)), self.header()]
+
+		for sequence in self.sequences:
+			linear = sequence.linear_index()
+			parts.append(struct.pack('<i', len(sequence.bins)))
+
+			for (bin, chunks) in sorted(sequence.bins.items()):
+				if self.csi:
+					# CSI keeps the linear index as the offset of each bin's first window
+					window = bin_first_window(bin, self.depth)
+					loff = writer.virtual_offset(linear[window]) if window < len(linear) else 0
+					parts.append(struct.pack('<IQ', bin, loff))
+				else:
+					parts.append(struct.pack('<I', bin))
+				parts.append(self.chunk_data(chunks, writer))
+
+			if not self.csi:
+				parts.append(struct.pack('<i', len(linear)))
+				parts.append(b''.join(struct.pack('<Q', writer.virtual_offset(offset)) for offset in linear))
+
+		# No features without coordinates
+		parts.append(struct.pack('<Q', 0))
+
+		with open(path + self.suffix(), "wb") as f:
+			f.write(compress_bgzf(b''.join(parts)))
+
+
+#
+# faidx index of a FASTA file, in which every sequence line of a record
+# but the last must be of the same length. The gzi index of the BGZF
+# blocks, which samtools needs to read a compressed FASTA file, is
+# saved with it.
+#
+class FastaIndex:
+
+	def __init__(self):
+		# [name, length, offset, line bases, line width] of each record
+		self.records = []
+		self.names = set()
+		# Has the current record had a line shorter than the others?
+		self.short_line = False
+
+	def add_line(self, line, start, end):
+
+		if line.startswith(b'>'):
+			name = (line[1:].split(None, 1) + [b''])[0].decode('utf-8')
+			if name in self.names:
+				raise ValueError('Duplicate FASTA record name: %s' % name)
+			self.names.add(name)
+			self.records.append([name, 0, end, 0, 0])
+			self.short_line = False
+			return
+
+		if len(self.records) == 0:
+			if len(line.strip()) == 0:
+				return
+			raise ValueError('FASTA sequence before the first record name')
+
+		record = self.records[-1]
+		bases = len(line.rstrip(b'\r'))
+
+		if record[1] == 0:
+			(record[3], record[4]) = (bases, end - start)
+		elif self.short_line or bases > record[3] or (bases == record[3] and end - start != record[4]):
+			raise ValueError('FASTA record %s has lines of different lengths' % record[0])
+		elif bases < record[3]:
+			self.short_line = True
+
+		record[1] = record[1] + bases
+
+	def save(self, path, writer):
+
+		with open(path + ".fai", "w") as f:
+			for record in self.records:
+				f.write("%s\t%d\t%d\t%d\t%d\n" % tuple(record))
+
+		writer.save_gzi(path + ".gzi")
+
+
+#
+# Open a GFF3 output file: plain parallel gzip, or BGZF indexed
+# as bgzf, 'tbi' or 'csi', if that is given.
+#
+def open_gff_writer(path, level, threads=1, pool=None, bgzf=None):
+
+	if bgzf is None:
+		return ParallelGzipWriter(path, level, threads, pool)
+
+	return BgzfWriter(path, level, threads, pool, TabixIndex(bgzf == 'csi'))
+
+
+#
+# Open a FASTA output file: plain parallel gzip,
+# or BGZF with faidx and gzi indexes if bgzf is given.
+#
+def open_fasta_writer(path, level, threads=1, pool=None, bgzf=None):
+
+	if bgzf is None:
+		return ParallelGzipWriter(path, level, threads, pool)
+
+	return BgzfWriter(path, level, threads, pool, FastaIndex())
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import codecs
+import sqlite3
+import psycopg2.extensions
+
+from chado_db import RESIDUE_CHUNK_SIZE
+
+
+#
+# Local cache of the Chado tables read by the native writer.
+#
+# The features, properties, relationships, cross-references and
+# residues of the sequences to export are streamed out of Chado with
+# COPY (SELECT ...) TO STDOUT, one bulk read per table, into an SQLite
+# file. The writer then formats GFF3 from the cache without touching the
+# database, so the database is only busy for the short extraction.
+#
+# Rows are copied in the writer's sort order and stored in that order,
+# so reading them back by rowid reproduces the Chado query results
+# exactly, whatever the collations of the two databases.
+#
+
+CACHE_SUFFIX = ".cache.sqlite"
+
+# Rows inserted per batch while copying
+COPY_BATCH_SIZE = 10000
+
+CACHE_SCHEMA = [
+	"create table organism (organism_id integer, common_name text)",
+	"create table sequence (feature_id integer, uniquename text, seqlen integer, type text)",
+	"create table feature (srcfeature_id integer, feature_id integer, uniquename text, name text, type text, " +
+	"fmin integer, fmax integer, strand integer, phase integer)",
+	"create table featureprop (srcfeature_id integer, fmin integer, fmax integer, feature_id integer, type text, value text)",
+	"create table relationship (srcfeature_id integer, fmin integer, fmax integer, feature_id integer, type text, object text)",
+	"create table dbxref (srcfeature_id integer, fmin integer, fmax integer, feature_id integer, db text, accession text)",
+	"create table residues (feature_id integer, start integer, chunk text)"
+]
+
+# Indexes are built once the tables are loaded
+CACHE_INDEXES = [
+	"create index feature_src on feature (srcfeature_id)",
+	"create index featureprop_src on featureprop (srcfeature_id)",
+	"create index relationship_src on relationship (srcfeature_id)",
+	"create index dbxref_src on dbxref (srcfeature_id)",
+	"create index residues_feature on residues (feature_id)"
+]
+
+# (table, columns, query) copying the rows for a list of top-level sequences.
+# Filters and ordering are those of the writer's ChadoFeatureSource.
+COPY_QUERIES = [
+	("feature", 9,
+	 "select fl.srcfeature_id, f.feature_id, f.uniquename, f.name, cvt.name, fl.fmin, fl.fmax, fl.strand, fl.phase " +
+	 "from featureloc fl " +
+	 "join feature f on f.feature_id = fl.feature_id " +
+	 "join cvterm cvt on cvt.cvterm_id = f.type_id " +
+	 "where fl.srcfeature_id = any(%s) and fl.locgroup = 0 and fl.rank = 0 and not f.is_obsolete " +
+	 "and fl.fmin is not null and fl.fmax is not null " +
+	 "order by fl.srcfeature_id, fl.fmin, fl.fmax desc, f.feature_id"),
+	("featureprop", 6,
+	 "select fl.srcfeature_id, fl.fmin, fl.fmax, fl.feature_id, cvt.name, fp.value " +
+	 "from featureloc fl " +
+	 "join featureprop fp on fp.feature_id = fl.feature_id " +
+	 "join cvterm cvt on cvt.cvterm_id = fp.type_id " +
+	 "where fl.srcfeature_id = any(%s) and fl.locgroup = 0 and fl.rank = 0 " +
+	 "and fl.fmin is not null and fl.fmax is not null " +
+	 "order by fl.srcfeature_id, fl.fmin, fl.fmax desc, fl.feature_id, fp.rank, fp.featureprop_id"),
+	("relationship", 6,
+	 "select fl.srcfeature_id, fl.fmin, fl.fmax, fl.feature_id, cvt.name, o.uniquename " +
+	 "from featureloc fl " +
+	 "join feature_relationship fr on fr.subject_id = fl.feature_id " +
+	 "join feature o on o.feature_id = fr.object_id " +
+	 "join cvterm cvt on cvt.cvterm_id = fr.type_id " +
+	 "where fl.srcfeature_id = any(%s) and fl.locgroup = 0 and fl.rank = 0 " +
+	 "and fl.fmin is not null and fl.fmax is not null " +
+	 "and cvt.name in ('part_of', 'derives_from') " +
+	 "order by fl.srcfeature_id, fl.fmin, fl.fmax desc, fl.feature_id, fr.rank, o.uniquename"),
+	("dbxref", 6,
+	 "select fl.srcfeature_id, fl.fmin, fl.fmax, fl.feature_id, db.name, dx.accession " +
+	 "from featureloc fl " +
+	 "join feature_dbxref fd on fd.feature_id = fl.feature_id " +
+	 "join dbxref dx on dx.dbxref_id = fd.dbxref_id " +
+	 "join db on db.db_id = dx.db_id " +
+	 "where fl.srcfeature_id = any(%s) and fl.locgroup = 0 and fl.rank = 0 and fd.is_current " +
+	 "and fl.fmin is not null and fl.fmax is not null " +
+	 "order by fl.srcfeature_id, fl.fmin, fl.fmax desc, fl.feature_id, db.name, dx.accession"),
+	# Residues are cut into chunks on the server, so that no row holds a whole chromosome
+	("residues", 3,
+	 "select f.feature_id, c.start, substr(f.residues, c.start, " + str(RESIDUE_CHUNK_SIZE) + ") " +
+	 "from feature f " +
+	 "cross join lateral generate_series(1, length(f.residues), " + str(RESIDUE_CHUNK_SIZE) + ") as c(start) " +
+	 "where f.feature_id = any(%s) " +
+	 "order by f.feature_id, c.start")
+]
+
+# Backslash escapes of the COPY text format
+COPY_ESCAPE = re.compile(r'\\(.)')
+COPY_ESCAPES = { 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v' }
+
+
+#
+# Name of the cache file of an organism, or of one of its shards.
+#
+def cache_file_name(organism, shard=1, shard_count=1):
+
+	if shard_count > 1:
+		return "%s.shard%d%s" % (organism, shard, CACHE_SUFFIX)
+
+	return organism + CACHE_SUFFIX
+
+
+#
+# Decode one field of a COPY text format row.
+#
+def copy_field(text):
+
+	if text == '\\N':
+		return None
+
+	if '\\' not in text:
+		return text
+
+	return COPY_ESCAPE.sub(lambda match: COPY_ESCAPES.get(match.group(1), match.group(1)), text)
+
+
+#
+# Write-only file object receiving COPY ... TO STDOUT output, which
+# inserts the rows into a cache table in batches as they arrive.
+#
+class CopyTableSink:
+
+	def __init__(self, cache, table, columns, encoding='utf-8'):
+		self.cache = cache
+		self.insert = "insert into " + table + " values (" + ", ".join(["?"] * columns) + ")"
+		self.decoder = codecs.getincrementaldecoder(encoding)()
+		self.pending = ''
+		self.rows = []
+		self.count = 0
+
+	def write(self, data):
+
+		if isinstance(data, bytes):
+			data = self.decoder.decode(data)
+
+		lines = (self.pending + data).split('\n')
+		self.pending = lines.pop()
+
+		for line in lines:
+			self.rows.append([copy_field(field) for field in line.split('\t')])
+
+		if len(self.rows) >= COPY_BATCH_SIZE:
+			self.flush()
+
+		return len(data)
+
+	def flush(self):
+
+		if len(self.rows) > 0:
+			self.cache.executemany(self.insert, self.rows)
+			self.count = self.count + len(self.rows)
+			self.rows = []
+
+
+#
+# Copy the data of the given top-level sequences of an organism into a
+# new cache file. sequences are (feature_id, uniquename, seqlen, type)
+# tuples. The file is written under a temporary name and renamed once
+# complete. Returns the number of rows copied per table.
+#
+def extract_sequences(conn, organism_id, common_name, sequences, cachefile):
+
+	tmpfile = cachefile + ".part"
+	if os.path.exists(tmpfile):
+		os.unlink(tmpfile)
+
+	encoding = psycopg2.extensions.encodings.get(conn.encoding, 'utf-8')
+	feature_ids = [sequence[0] for sequence in sequences]
+	counts = {}
+
+	cache = sqlite3.connect(tmpfile)
+
+	try:
+		# A cache is rebuilt rather than recovered, so durability is not needed
+		cache.execute("pragma journal_mode = off")
+		cache.execute("pragma synchronous = off")
+		for statement in CACHE_SCHEMA:
+			cache.execute(statement)
+
+		cache.execute("insert into organism values (?, ?)", (organism_id, common_name))
+		cache.executemany("insert into sequence values (?, ?, ?, ?)", sequences)
+
+		cur = conn.cursor()
+		try:
+			for (table, columns, sql) in COPY_QUERIES:
+				sink = CopyTableSink(cache, table, columns, encoding)
+				cur.copy_expert("copy (" + cur.mogrify(sql, (feature_ids,)).decode(encoding) + ") to stdout", sink)
+				sink.flush()
+				counts[table] = sink.count
+		finally:
+			cur.close()
+
+		for statement in CACHE_INDEXES:
+			cache.execute(statement)
+		cache.commit()
+
+	except Exception:
+		cache.close()
+		os.unlink(tmpfile)
+		raise
+
+	cache.close()
+	os.rename(tmpfile, cachefile)
+
+	return counts
+
+
+#
+# Reads organism data from a cache file, with the same
+# interface and results as the writer's ChadoFeatureSource.
+#
+class CachedFeatureSource:
+
+	def __init__(self, cachefile):
+		self.cache = sqlite3.connect(cachefile)
+
+	def close(self):
+		self.cache.close()
+
+	def query(self, sql, params):
+
+		return self.cache.execute(sql, params)
+
+	def get_organism_id(self, common_name):
+
+		for row in self.query("select organism_id from organism where common_name = ?;", (common_name,)):
+			return row[0]
+
+		return None
+
+	def get_top_level_sequences(self, organism_id):
+
+		# A cache holds a single organism
+		return self.query("select feature_id, uniquename, seqlen, type from sequence order by rowid;", ())
+
+	def get_features(self, srcfeature_id):
+
+		return self.query("select feature_id, uniquename, name, type, fmin, fmax, strand, phase " +
+		                  "from feature where srcfeature_id = ? order by rowid;", (srcfeature_id,))
+
+	def get_feature_properties(self, srcfeature_id):
+
+		return self.query("select fmin, fmax, feature_id, type, value " +
+		                  "from featureprop where srcfeature_id = ? order by rowid;", (srcfeature_id,))
+
+	def get_feature_relationships(self, srcfeature_id):
+
+		return self.query("select fmin, fmax, feature_id, type, object " +
+		                  "from relationship where srcfeature_id = ? order by rowid;", (srcfeature_id,))
+
+	def get_feature_dbxrefs(self, srcfeature_id):
+
+		return self.query("select fmin, fmax, feature_id, db, accession " +
+		                  "from dbxref where srcfeature_id = ? order by rowid;", (srcfeature_id,))
+
+	def get_residues(self, feature_id):
+
+		for (chunk,) in self.query("select chunk from residues where feature_id = ? order by start;", (feature_id,)):
+			yield chunk
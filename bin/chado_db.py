@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+import re
+import weakref
+import itertools
+import contextlib
+import psycopg2
+import psycopg2.pool
+import psycopg2.extensions
+
+
+#
+# Shared Chado database access helpers.
+#
+# All reads go through psycopg2 named (server-side) cursors
+# so that result sets are fetched in batches of itersize rows
+# and client memory stays flat however large the genome.
+#
+# Connections are taken from a pool shared by all stages of a process,
+# and small queries repeated per organism or per sequence are prepared
+# once per connection. Prepared statements last for a database session,
+# so they must be turned off (prepared_statements = False) when Chado is
+# reached through pgbouncer in transaction pooling mode.
+#
+
+DEFAULT_ITERSIZE = 2000
+DEFAULT_POOL_SIZE = 4
+
+# Residues are read in chunks so that large chromosomes are never held in memory as a whole
+RESIDUE_CHUNK_SIZE = 1048576
+
+_cursor_ids = itertools.count(1)
+
+# Names of the statements prepared on each connection
+_prepared_statements = weakref.WeakKeyDictionary()
+
+
+#
+# Read the fetch batch size from the [Connection] section,
+# falling back to the default.
+#
+def get_itersize(config):
+
+	try:
+		return int(config.get('Connection', 'itersize').strip())
+	except ValueError:
+		raise Exception('The property itersize is not a valid integer. Please correct the value before restarting.')
+	except Exception:
+		return DEFAULT_ITERSIZE
+
+
+#
+# Whether repeated small queries are run as prepared statements,
+# from the [Connection] section. On by default.
+#
+def get_prepared_statements(config):
+
+	try:
+		return config.get('Connection', 'prepared_statements').strip() != "False"
+	except Exception:
+		return True
+
+
+#
+# Keyword connection parameters from the [Connection] section of the
+# exporter configuration file. Keywords are quoted by libpq itself, so
+# values containing spaces or quotes need no escaping.
+#
+def connection_parameters(config):
+
+	return { 'dbname': config.get('Connection', 'database'),
+	         'user': config.get('Connection', 'user'),
+	         'host': config.get('Connection', 'host'),
+	         'password': config.get('Connection', 'password'),
+	         'port': config.get('Connection', 'port') }
+
+
+#
+# Named cursors need a transaction, so connections
+# are read-only rather than in autocommit mode.
+#
+def configure_session(conn):
+
+	if conn.readonly is not True or conn.autocommit:
+		conn.set_session(readonly=True, autocommit=False)
+
+
+#
+# Connect to the Chado database described by the
+# [Connection] section of the exporter configuration file.
+#
+def open_connection(config):
+
+	conn = psycopg2.connect(**connection_parameters(config))
+	configure_session(conn)
+
+	return conn
+
+
+#
+# Begin a REPEATABLE READ transaction on the connection and export its
+# snapshot. Other sessions can attach to the snapshot for as long as
+# this transaction stays open. Returns the snapshot ID.
+#
+def export_snapshot(conn):
+
+	conn.rollback()
+	conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
+
+	cur = conn.cursor()
+	try:
+		cur.execute("select pg_export_snapshot();")
+		return cur.fetchone()[0]
+	finally:
+		cur.close()
+
+
+#
+# Begin a REPEATABLE READ transaction on the connection that sees
+# the database exactly as the exported snapshot does.
+#
+def attach_snapshot(conn, snapshot):
+
+	conn.rollback()
+	conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
+
+	cur = conn.cursor()
+	try:
+		cur.execute("set transaction snapshot %s;", (snapshot,))
+	finally:
+		cur.close()
+
+
+#
+# A thread-safe pool of read-only Chado connections.
+# Connections are opened when first needed, kept open between uses
+# and ended with a rollback on their return to the pool, so every
+# checkout starts a fresh read transaction.
+#
+class ChadoConnectionPool:
+
+	def __init__(self, config, maxconn=DEFAULT_POOL_SIZE):
+		self.prepare = get_prepared_statements(config)
+		self.pool = psycopg2.pool.ThreadedConnectionPool(0, maxconn, **connection_parameters(config))
+		# None are opened up front, but up to maxconn are kept once opened
+		self.pool.minconn = maxconn
+
+	def getconn(self):
+
+		conn = self.pool.getconn()
+		try:
+			configure_session(conn)
+		except Exception:
+			self.pool.putconn(conn, close=True)
+			raise
+
+		return conn
+
+	def putconn(self, conn):
+
+		self.pool.putconn(conn, close=conn.closed != 0)
+
+	#
+	# Check out a connection for the duration of a with block.
+	#
+	@contextlib.contextmanager
+	def connection(self):
+
+		conn = self.getconn()
+		try:
+			yield conn
+		finally:
+			self.putconn(conn)
+
+	def close(self):
+
+		if not self.pool.closed:
+			self.pool.closeall()
+
+
+#
+# Run a query on a server-side cursor and yield the rows,
+# fetching itersize rows per round trip.
+# The cursor is closed when the generator is exhausted or discarded.
+#
+def iter_query(conn, sql, params=None, itersize=DEFAULT_ITERSIZE):
+
+	cur = conn.cursor(name="chado_export_cursor_%d" % next(_cursor_ids))
+	cur.itersize = itersize
+
+	try:
+		cur.execute(sql, params)
+		for row in cur:
+			yield row
+	finally:
+		cur.close()
+
+
+#
+# Run a small query as a prepared statement and return all its rows.
+# The statement is prepared the first time it is used on a connection,
+# with %s placeholders numbered as $1, $2... For result sets of any
+# size use iter_query instead, as a prepared statement cannot be run
+# on a server-side cursor.
+#
+def query_prepared(conn, name, sql, params, prepare=True):
+
+	cur = conn.cursor()
+
+	try:
+		if not prepare:
+			cur.execute(sql, params)
+			return cur.fetchall()
+
+		prepared = _prepared_statements.setdefault(conn, set())
+		if name not in prepared:
+			placeholders = itertools.count(1)
+			cur.execute("prepare " + name + " as " + re.sub(r'%s', lambda match: "$%d" % next(placeholders), sql))
+			prepared.add(name)
+
+		cur.execute("execute " + name + " (" + ", ".join(["%s"] * len(params)) + ");", params)
+		return cur.fetchall()
+	finally:
+		cur.close()
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import time
+import subprocess
+import concurrent.futures
+
+
+#
+# Job execution backends for the export job scripts.
+#
+# LsfExecutor submits each script to LSF with bsub, recording the job
+# IDs, and can wait for the jobs with an LsfJobMonitor. It can instead
+# submit the jobs of a run as a few job arrays, each run by a dispatcher
+# script that starts the job script of its element. LocalExecutor
+# runs the scripts on this machine in a pool of worker processes.
+# Both collect each job's exit code, run time and peak memory when
+# waiting for their jobs. chado_orchestrator.py adds AsyncExecutor,
+# which runs jobs on either backend within concurrency limits.
+#
+
+
+#
+# Run a bash shell process.
+#
+def run_bash(cmd):
+	subprocess.Popen(cmd, shell=True, executable='/bin/bash')
+
+
+#
+# Run a bash shell process to completion, returning its standard output.
+#
+def run_bash_output(cmd):
+
+	return subprocess.run(cmd, shell=True, executable='/bin/bash', stdout=subprocess.PIPE,
+	                      stderr=subprocess.DEVNULL, universal_newlines=True).stdout
+
+
+#
+# The job ID in bsub output, "Job <1234> is submitted to queue <normal>.", or None.
+#
+def parse_bsub_job_id(output):
+
+	match = re.search(r'Job <(\d+)>', output or '')
+
+	return match.group(1) if match else None
+
+
+#
+# Job ID of an element of a job array, e.g. "1234[3]".
+#
+def array_element_id(job_id, index):
+
+	return "%s[%d]" % (job_id, index)
+
+
+#
+# Sort key of job IDs, in order of submission and array index.
+#
+def job_id_sort_key(job_id):
+
+	match = re.match(r'(\d+)(?:\[(\d+)\])?$', job_id)
+
+	return (int(match.group(1)), int(match.group(2) or 0))
+
+
+#
+# An export job: a generated script plus its resource requests and logs,
+# the names of any jobs that must have ended before it starts and the
+# class of resource that it mostly uses, e.g. 'db' or 'io'.
+# organisms are those whose export the job script covers, if any.
+#
+class JobSpec:
+
+	def __init__(self, name, script, memory, cores, outlog, errlog, depends=None, resource=None):
+		self.name = name
+		self.script = script
+		self.memory = memory
+		self.cores = cores
+		self.outlog = outlog
+		self.errlog = errlog
+		self.depends = depends
+		self.resource = resource
+		self.organisms = []
+
+
+#
+# Outcome of a job that was run to completion, with the reason LSF
+# gives for ending it, if any, and any earlier attempts that failed.
+#
+class JobResult:
+
+	def __init__(self, name, exit_code, start_time, end_time, job_id=None, max_memory_mb=None, exit_reason=None):
+		self.name = name
+		self.exit_code = exit_code
+		self.start_time = start_time
+		self.end_time = end_time
+		self.job_id = job_id
+		self.max_memory_mb = max_memory_mb
+		self.exit_reason = exit_reason
+		# [(cause, memory MB, cores)] of each attempt that failed and was retried
+		self.retries = []
+
+	@property
+	def elapsed_secs(self):
+		return self.end_time - self.start_time
+
+
+#
+# Run a job script with its output going to the job log files.
+# Module level so that it can be dispatched to a worker process.
+# The peak memory is that of the largest process in the job.
+#
+def run_job_script(job):
+
+	start_time = time.time()
+
+	with open(job.outlog, "w") as out, open(job.errlog, "w") as err:
+		process = subprocess.Popen(['/bin/bash', job.script], stdout=out, stderr=err)
+		(pid, status, rusage) = os.wait4(process.pid, 0)
+		# A negative return code is the signal that killed the job, as with Popen
+		process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+
+	# ru_maxrss is in KB on Linux
+	return JobResult(job.name, process.returncode, start_time, time.time(), None, rusage.ru_maxrss // 1024)
+
+
+#
+# Submits jobs to LSF.
+#
+# With job_arrays, the jobs are held back until the checker is submitted
+# or the executor finishes. Those that depend on no others are then
+# submitted as one job array per memory and cores request, of which at
+# most max_running elements run at once (0 = no limit), and the others
+# on their own, depending on elements of the arrays.
+#
+class LsfExecutor:
+
+	def __init__(self, queue, logpath, jobtitle, checkerjobstartdelay=10, run_jobs=True, monitor=None, job_arrays=False, max_running=0):
+		self.queue = queue
+		self.logpath = logpath
+		self.jobtitle = jobtitle
+		self.checkerjobstartdelay = checkerjobstartdelay
+		self.run_jobs = run_jobs
+		self.monitor = monitor
+		self.job_arrays = job_arrays
+		self.max_running = max_running
+		# job ID -> job name of the submitted jobs, including array elements
+		self.job_ids = {}
+		self.missing_job_ids = False
+		# Jobs held back to be submitted as job arrays, and the IDs of the arrays
+		self.pending = []
+		self.array_ids = []
+		self.arrays = 0
+
+	#
+	# The bsub command line for an export job.
+	#
+	def job_cmd(self, job):
+
+		mem = str(job.memory)
+
+		cmd = "source /etc/bashrc; bsub -J " + job.name + " -q " + self.queue + " -n" + str(job.cores) + "  " + \
+		          "-R 'select[mem>" + mem + "] rusage[mem=" + mem + "] span[hosts=1]' -M " + mem + " " + \
+		          "-o " + job.outlog + " " + \
+		          "-e " + job.errlog + " "
+
+		if job.depends:
+			cmd = cmd + "-w '" + self.dependency_condition(job.depends) + "' "
+
+		return cmd + job.script
+
+	#
+	# LSF dependency expression for jobs to have ended,
+	# by job ID where known, otherwise by job name.
+	#
+	def dependency_condition(self, names):
+
+		ids = dict((name, job_id) for (job_id, name) in self.job_ids.items())
+
+		return " && ".join("ended(" + ids.get(name, name) + ")" for name in names)
+
+	#
+	# The bsub command line for a job array running the given jobs,
+	# each element through the dispatcher script.
+	#
+	def array_cmd(self, name, jobs, dispatcher):
+
+		mem = str(jobs[0].memory)
+		limit = "%" + str(self.max_running) if self.max_running > 0 else ""
+
+		cmd = "source /etc/bashrc; bsub -J '" + name + "[1-" + str(len(jobs)) + "]" + limit + "' -q " + self.queue + " -n" + str(jobs[0].cores) + "  " + \
+		          "-R 'select[mem>" + mem + "] rusage[mem=" + mem + "] span[hosts=1]' -M " + mem + " " + \
+		          "-o " + self.logpath + "/" + name + ".%I.o " + \
+		          "-e " + self.logpath + "/" + name + ".%I.e "
+
+		return cmd + dispatcher
+
+	#
+	# Write the dispatcher script of a job array, which runs the job
+	# script of the element's LSB_JOBINDEX with output to the job's logs.
+	#
+	def write_array_dispatcher(self, name, jobs):
+
+		path = os.path.join(os.path.dirname(jobs[0].script), name + ".dispatch")
+
+		with open(path, "w") as f:
+			f.write("#!/bin/bash\n")
+			f.write("case \"$LSB_JOBINDEX\" in\n")
+			for (i, job) in enumerate(jobs):
+				f.write("\t" + str(i + 1) + ") exec /bin/bash \"" + job.script + "\" > \"" + job.outlog + "\" 2> \"" + job.errlog + "\" ;;\n")
+			f.write("esac\n")
+			f.write("echo \"ERROR: No job for element $LSB_JOBINDEX of job array " + name + "\" 1>&2\n")
+			f.write("exit 1\n")
+
+		os.chmod(path, 0o775)
+
+		return path
+
+	#
+	# The bsub command line for the completion checker job.
+	# Depends on the given job IDs, or uses a wildcard to match job names.
+	#
+	def checker_cmd(self, jobscriptpath, name, job_ids=None):
+
+		if job_ids:
+			condition = " && ".join("ended(" + job_id + ")" for job_id in job_ids)
+		else:
+			condition = "ended(" + self.jobtitle + "*)"
+
+		cmd = "source /etc/bashrc; bsub -J " + name + " -q " + self.queue + \
+		         " -R 'select[mem>3500] rusage[mem=3500] span[hosts=1]' -M 3500 " + \
+		          "-o " + self.logpath + "/" + name  + ".o " + \
+		          "-e " + self.logpath + "/" + name + ".e " + \
+		          "-w \'" + condition + "' " + \
+		          str(jobscriptpath)
+
+		return cmd
+
+	#
+	# Submit a job, or hold it back to be submitted in a job array.
+	#
+	def submit(self, job):
+
+		if not self.run_jobs:
+			return
+
+		if self.job_arrays:
+			self.pending.append(job)
+			return
+
+		self.submit_job(job)
+
+	#
+	# Submit a job on its own, recording the job ID that bsub reports.
+	#
+	def submit_job(self, job):
+
+		print("starting job %s -- %s" % (job.name, os.path.basename(job.script)))
+		job_id = parse_bsub_job_id(run_bash_output(self.job_cmd(job)))
+
+		if job_id is None:
+			print("WARNING: No job ID reported by bsub for job %s" % job.name)
+			self.missing_job_ids = True
+		else:
+			self.job_ids[job_id] = job.name
+
+	#
+	# Submit a job array, recording the job ID of each element.
+	#
+	def submit_array(self, jobs):
+
+		self.arrays = self.arrays + 1
+		name = "%s_array%d" % (self.jobtitle, self.arrays)
+		dispatcher = self.write_array_dispatcher(name, jobs)
+
+		print("starting job array %s of %d jobs -- %s" % (name, len(jobs), os.path.basename(dispatcher)))
+		job_id = parse_bsub_job_id(run_bash_output(self.array_cmd(name, jobs, dispatcher)))
+
+		if job_id is None:
+			print("WARNING: No job ID reported by bsub for job array %s" % name)
+			self.missing_job_ids = True
+			return
+
+		self.array_ids.append(job_id)
+		for (i, job) in enumerate(jobs):
+			self.job_ids[array_element_id(job_id, i + 1)] = job.name
+
+	#
+	# Submit the held back jobs: those that depend on no others as job
+	# arrays, then the others on their own, as they depend on elements of
+	# the arrays. A group of one job is submitted as a plain job.
+	#
+	def submit_pending(self):
+
+		# (memory, cores) -> jobs, in order of submission
+		groups = {}
+		dependent = []
+
+		for job in self.pending:
+			if job.depends:
+				dependent.append(job)
+			else:
+				groups.setdefault((job.memory, job.cores), []).append(job)
+
+		self.pending = []
+
+		for jobs in groups.values():
+			if len(jobs) == 1:
+				self.submit_job(jobs[0])
+			else:
+				self.submit_array(jobs)
+
+		for job in dependent:
+			self.submit_job(job)
+
+	#
+	# Submit the dependent completion checker job.
+	# It depends on the IDs of the submitted jobs. If any ID is unknown
+	# we fall back to matching job names, after a small delay as it's
+	# possible for the checker to sometimes get scheduled before export
+	# jobs and consequently exit immediately (race condition).
+	# Job arrays are depended on as a whole.
+	#
+	def submit_checker(self, jobscriptpath, name):
+
+		if not self.run_jobs:
+			return
+
+		self.submit_pending()
+
+		job_ids = self.array_ids + [job_id for job_id in self.job_ids if '[' not in job_id]
+
+		if len(job_ids) > 0 and not self.missing_job_ids:
+			print("starting chado export completion checker job")
+			run_bash(self.checker_cmd(jobscriptpath, name, sorted(job_ids, key=int)))
+		else:
+			print("waiting to start chado export completion checker job...")
+			time.sleep(self.checkerjobstartdelay)
+			print("starting chado export completion checker job")
+			run_bash(self.checker_cmd(jobscriptpath, name))
+
+	#
+	# Wait for the submitted jobs with the monitor, if there is one,
+	# and return their results. Without a monitor LSF jobs run
+	# asynchronously, so there are no results to collect.
+	#
+	def finish(self):
+
+		self.submit_pending()
+
+		if self.monitor is None or len(self.job_ids) == 0:
+			return []
+
+		return self.monitor.wait(self.job_ids)
+
+
+#
+# Runs jobs on the local machine with a pool of worker processes.
+#
+class LocalExecutor:
+
+	def __init__(self, workers=None, run_jobs=True):
+		self.workers = workers if workers else os.cpu_count()
+		self.run_jobs = run_jobs
+		self.pool = None
+		self.futures = []
+		self.deferred = []
+		self.checker = None
+
+	#
+	# Start a job. Jobs that depend on others are held
+	# back until all of the independent jobs have finished.
+	#
+	def submit(self, job):
+
+		if not self.run_jobs:
+			return
+
+		if job.depends:
+			self.deferred.append(job)
+			return
+
+		self.start(job)
+
+	def start(self, job):
+
+		if self.pool is None:
+			self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+
+		print("starting job %s -- %s" % (job.name, os.path.basename(job.script)))
+		self.futures.append(self.pool.submit(run_job_script, job))
+
+	#
+	# The checker runs locally once all jobs have finished.
+	#
+	def submit_checker(self, jobscriptpath, name):
+
+		if self.run_jobs:
+			self.checker = JobSpec(name, jobscriptpath, 0, 1, os.devnull, os.devnull)
+
+	#
+	# Wait for all jobs, report and return their results.
+	#
+	def finish(self):
+
+		results = []
+
+		try:
+			results.extend(self.wait())
+			for job in self.deferred:
+				self.start(job)
+			results.extend(self.wait())
+		finally:
+			if self.pool is not None:
+				self.pool.shutdown()
+				self.pool = None
+			self.futures = []
+			self.deferred = []
+
+		if self.checker is not None:
+			print("running chado export completion checker job")
+			run_job_script(self.checker)
+			self.checker = None
+
+		return results
+
+	#
+	# Wait for the started jobs and report their results.
+	#
+	def wait(self):
+
+		results = []
+		for future in self.futures:
+			result = future.result()
+			print("job %s finished with exit code %d in %.1f secs using %d MB" % (result.name, result.exit_code, result.elapsed_secs, result.max_memory_mb))
+			results.append(result)
+		self.futures = []
+
+		return results
@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import shutil
+import signal
+import socket
+import tempfile
+import argparse
+import configparser
+import concurrent.futures
+
+from chado_db import ChadoConnectionPool, get_itersize
+from chado_gff_writer import export_organism
+from gff3_derived import write_derived_files, OUTPUT_SUFFIXES
+from chado_run_manifest import update_states, EXPORTING, MERGED, DERIVED, PUBLISHED
+from chado_stage_metrics import run_callable_stage, append_metrics
+from chado_job_planner import query_organism_sizes, organism_memory_mb, organism_output_bytes
+from parallel_gzip import DEFAULT_COMPRESSION_LEVEL, INDEX_SUFFIXES
+
+
+#
+# Export worker: runs the pipeline of one export job in a single
+# Python process, in place of a generated bash script.
+#
+# The job is described by a slice manifest, a JSON file written by
+# generate_gff_from_chado.py. The worker exports each of its organisms
+# with the native writer on one Chado connection, kept open for the
+# whole slice, and then, unless the organism steps are separate jobs,
+# writes the derived files with gff3_derived.py, in-process, and
+# records the fingerprint and run state of the organism.
+#
+# The worker stops at the first failure: the organism that failed, and
+# those after it, are left exporting in the run manifest for a retry
+# or a resumed run to pick up.
+#
+# With a concurrency above 1, up to that many organisms are processed
+# at once, each by a pool process with a connection of its own, and
+# the job's cores shared between them for compression. An organism is
+# only started while the estimated memory of those running, from their
+# sizes in Chado, fits in the job's memory, so that two large genomes
+# do not run together. One organism always runs, whatever its size.
+#
+# With scratch staging, each organism is written and its derived files
+# made in a directory of its own on node-local scratch ($TMPDIR unless
+# a path is given), and only the finished files are published to the
+# results directory, each copied in under a temporary name and renamed.
+# An organism is staged only if the scratch file system has room for
+# it, going by its estimated output, and its directory is removed
+# however the organism ends, including when the job is killed with SIGTERM.
+#
+# Run as: generate_gff_from_chado.py worker --manifest <slice.json>
+#
+
+# Exit codes
+EXIT_OK = 0
+EXIT_STAGE_FAILED = 1
+EXIT_BAD_MANIFEST = 2
+EXIT_NO_DATABASE = 3
+
+# Room needed on scratch for an organism, as a multiple of its estimated output
+SCRATCH_SPACE_FACTOR = 3
+
+
+#
+# The scratch directory of a slice manifest: its scratch path, or else
+# the job's $TMPDIR. None if the slice is not staged on scratch.
+#
+def scratch_base(manifest):
+
+	if manifest.get('scratch') is None:
+		return None
+
+	return manifest['scratch'] or os.environ.get('TMPDIR') or tempfile.gettempdir()
+
+
+#
+# Publish a finished file to its destination, which may be on another
+# file system: copied in under a temporary name beside it, then renamed,
+# so that readers never see a partial file. Its index files, if it has
+# any, are published first.
+#
+def publish_file(src, dest, mode=0o777):
+
+	if os.path.abspath(src) == os.path.abspath(dest):
+		os.chmod(dest, mode)
+		return
+
+	for suffix in INDEX_SUFFIXES:
+		if os.path.exists(src + suffix):
+			publish_file(src + suffix, dest + suffix, mode)
+		elif os.path.exists(dest + suffix):
+			os.unlink(dest + suffix)
+
+	partfile = dest + ".part"
+
+	try:
+		shutil.copyfile(src, partfile)
+		os.chmod(partfile, mode)
+		os.rename(partfile, dest)
+	finally:
+		if os.path.exists(partfile):
+			os.unlink(partfile)
+
+	os.unlink(src)
+
+
+#
+# End the worker on SIGTERM (as sent by bkill, or LSF at a run limit)
+# as on an error, so that its scratch directories are removed.
+#
+def exit_on_sigterm(signum, frame):
+
+	sys.exit(128 + signum)
+
+
+#
+# Read a slice manifest. Returns None, after reporting why, if it is unusable.
+#
+def read_slice_manifest(path):
+
+	try:
+		with open(path, "r") as f:
+			manifest = json.load(f)
+	except (IOError, ValueError) as err:
+		print("ERROR: Unable to read the slice manifest %s: %s" % (path, str(err)), file=sys.stderr)
+		return None
+
+	for key in ['configfile', 'organisms', 'outputdir']:
+		if key not in manifest:
+			print("ERROR: The slice manifest %s has no %s" % (path, key), file=sys.stderr)
+			return None
+
+	return manifest
+
+
+#
+# Runs the stages of a slice, recording the metrics of each
+# stage when the slice manifest names a metrics file.
+#
+class ExportWorker:
+
+	def __init__(self, manifest, conn, itersize, prepare=True, threads=None, sizes=None):
+		self.manifest = manifest
+		self.conn = conn
+		self.itersize = itersize
+		self.prepare = prepare
+		self.outputdir = manifest['outputdir']
+		self.level = manifest.get('level', DEFAULT_COMPRESSION_LEVEL)
+		self.threads = threads if threads else manifest.get('threads', 1)
+		self.bgzf = manifest.get('bgzf')
+		self.runmanifest = manifest.get('runmanifest')
+		self.metricsfile = manifest.get('stagemetrics')
+		self.scratch = scratch_base(manifest)
+		# organism -> (features, residues), for the scratch space check
+		self.sizes = sizes if sizes else {}
+
+	#
+	# Run a stage of an organism. Returns the stage's result,
+	# or raises the exception that ended it.
+	#
+	def run_stage(self, stage, org, func, inputs=None, outputs=None):
+
+		(result, error, metrics) = run_callable_stage(func, inputs, outputs)
+
+		if self.metricsfile:
+			metrics.update({ 'stage': stage, 'jobtitle': self.manifest.get('jobtitle'), 'organisms': [org], 'host': socket.gethostname() })
+			try:
+				append_metrics(self.metricsfile, metrics)
+			except IOError as err:
+				print("WARNING: Unable to record stage metrics: %s" % str(err))
+
+		if error is not None:
+			raise error
+
+		return result
+
+	def set_state(self, organisms, state):
+
+		if self.runmanifest:
+			update_states(self.runmanifest, organisms, state)
+
+	def result_file(self, org):
+
+		return os.path.join(self.outputdir, org + ".gff3.gz")
+
+	#
+	# The directory in which to write an organism: a new one on scratch
+	# if the slice is staged there and it has room, else the results directory.
+	#
+	def stage_dir(self, org):
+
+		if self.scratch is None:
+			return self.outputdir
+
+		need = SCRATCH_SPACE_FACTOR * organism_output_bytes(*self.sizes.get(org, (0, 0)))
+
+		try:
+			free = shutil.disk_usage(self.scratch).free
+			if free < need:
+				print("WARNING: Only %d MB free on scratch %s, writing %s to the results directory" % (free // 1048576, self.scratch, org))
+				return self.outputdir
+			return tempfile.mkdtemp(prefix=org + ".", dir=self.scratch)
+		except OSError as err:
+			print("WARNING: Unable to use scratch %s, writing %s to the results directory: %s" % (self.scratch, org, str(err)))
+			return self.outputdir
+
+	#
+	# Record the start of the export of the slice's organisms, against
+	# which their results are checked, as the job scripts do.
+	#
+	def start(self):
+
+		for marker in self.manifest.get('markers', {}).values():
+			with open(marker, "a"):
+				os.utime(marker)
+
+		self.set_state(self.manifest['organisms'], EXPORTING)
+
+	#
+	# Export an organism, then run its steps if the slice includes them.
+	#
+	def run_organism(self, org):
+
+		workdir = self.stage_dir(org)
+
+		try:
+			self.run_organism_in(org, workdir)
+		finally:
+			if workdir != self.outputdir:
+				shutil.rmtree(workdir, ignore_errors=True)
+
+	#
+	# Export an organism and run its steps in the given directory,
+	# publishing each finished file to the results directory.
+	#
+	def run_organism_in(self, org, workdir):
+
+		stagedfile = os.path.join(workdir, org + ".gff3.gz")
+		resultfile = self.result_file(org)
+
+		count = self.run_stage('export', org, lambda: export_organism(self.conn, org, workdir, self.itersize, self.level, self.threads,
+		                       prepare=self.prepare, cachedir=self.manifest.get('cachedir'), snapshot=self.manifest.get('snapshot'), bgzf=self.bgzf),
+		                       None, [stagedfile])
+		print("exported %d features for organism %s" % (count, org))
+
+		if os.path.getsize(stagedfile) == 0:
+			raise Exception('No result was exported for ' + org)
+
+		if not self.manifest.get('steps', True):
+			self.run_stage('publish', org, lambda: publish_file(stagedfile, resultfile), [stagedfile], [resultfile])
+			return
+
+		prefix = os.path.join(workdir, org)
+		staged = [prefix + suffix for suffix in OUTPUT_SUFFIXES]
+		self.run_stage('derived', org, lambda: write_derived_files(stagedfile, prefix, self.level, self.threads, self.bgzf), [stagedfile], staged)
+
+		outputs = [self.result_file(org)] + [os.path.join(self.outputdir, org + suffix) for suffix in OUTPUT_SUFFIXES]
+		self.run_stage('publish', org, lambda: [publish_file(src, dest) for (src, dest) in zip([stagedfile] + staged, outputs)],
+		               [stagedfile] + staged, outputs)
+		self.set_state([org], MERGED)
+		self.set_state([org], DERIVED)
+
+		# Record the fingerprint of the exported organism
+		(pending, stored) = self.manifest.get('fingerprints', {}).get(org, (None, None))
+		if pending is not None and os.path.exists(pending):
+			os.rename(pending, stored)
+
+		self.set_state([org], PUBLISHED)
+
+	#
+	# Run the whole slice, stopping at the first failure. Returns the exit code.
+	#
+	def run(self):
+
+		self.start()
+
+		for org in self.manifest['organisms']:
+			try:
+				self.run_organism(org)
+			except Exception as err:
+				print("ERROR: Export of organism %s failed: %s" % (org, str(err)), file=sys.stderr)
+				return EXIT_STAGE_FAILED
+
+		return EXIT_OK
+
+
+#
+# Estimated memory (MB) in use by the organisms running in a job,
+# out of the job's memory budget (0 = unlimited).
+#
+class MemoryBudget:
+
+	def __init__(self, budget_mb):
+		self.budget_mb = budget_mb
+		self.used_mb = 0
+		self.running = 0
+
+	#
+	# Can an organism needing the given memory start now?
+	# When nothing is running it can, as it would have to run alone anyway.
+	# The estimates are not whole MB, so once every organism has been
+	# released the memory in use may not be quite 0: the count is used.
+	#
+	def fits(self, need_mb):
+
+		return self.budget_mb <= 0 or self.running == 0 or self.used_mb + need_mb <= self.budget_mb
+
+	def reserve(self, need_mb):
+		self.used_mb = self.used_mb + need_mb
+		self.running = self.running + 1
+
+	def release(self, need_mb):
+		self.used_mb = self.used_mb - need_mb
+		self.running = self.running - 1
+
+
+#
+# The first of the pending organisms that fits in the memory budget, or None.
+#
+def next_organism(pending, needs, budget):
+
+	for org in pending:
+		if budget.fits(needs[org]):
+			return org
+
+	return None
+
+
+# Connection of a pool process, kept open for every organism that it runs
+process_connection = None
+
+
+#
+# Open the connection of a pool process on its first organism, as the
+# initializer of a ProcessPoolExecutor needs Python 3.7.
+#
+def open_process_connection(configfile):
+
+	global process_connection
+
+	if process_connection is None:
+		config = configparser.ConfigParser()
+		config.read(configfile)
+		pool = ChadoConnectionPool(config, 1)
+		process_connection = (pool, pool.getconn(), get_itersize(config))
+
+	return process_connection
+
+
+#
+# Run an organism in a pool process. Returns None, or the error that ended it.
+#
+def run_organism_process(manifest, org, threads, sizes):
+
+	(pool, conn, itersize) = open_process_connection(manifest['configfile'])
+
+	try:
+		ExportWorker(manifest, conn, itersize, pool.prepare, threads, sizes).run_organism(org)
+	except Exception as err:
+		return str(err)
+
+	return None
+
+
+#
+# Run the organisms of a slice concurrently within the memory budget,
+# starting them in slice order as slots and memory allow. Once one
+# fails no more are started. Returns the exit code.
+#
+def run_concurrently(manifest, sizes):
+
+	organisms = manifest['organisms']
+	concurrency = min(manifest['concurrency'], len(organisms))
+	threads = max(1, manifest.get('threads', 1) // concurrency)
+	needs = dict((org, organism_memory_mb(*sizes.get(org, (0, 0)))) for org in organisms)
+	budget = MemoryBudget(manifest.get('memory_mb', 0))
+
+	pending = list(organisms)
+	# future -> organism
+	running = {}
+	status = EXIT_OK
+
+	with concurrent.futures.ProcessPoolExecutor(max_workers=concurrency) as pool:
+
+		while len(running) > 0 or (len(pending) > 0 and status == EXIT_OK):
+
+			org = next_organism(pending, needs, budget)
+			while status == EXIT_OK and org is not None and len(running) < concurrency:
+				print("starting organism %s (estimated %d MB)" % (org, needs[org]))
+				pending.remove(org)
+				budget.reserve(needs[org])
+				running[pool.submit(run_organism_process, manifest, org, threads, sizes)] = org
+				org = next_organism(pending, needs, budget)
+
+			(done, not_done) = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+
+			for future in done:
+				org = running.pop(future)
+				budget.release(needs[org])
+				try:
+					error = future.result()
+				except Exception as err:
+					# e.g. a pool process that could not connect to the database
+					error = str(err) or type(err).__name__
+				if error is not None:
+					print("ERROR: Export of organism %s failed: %s" % (org, error), file=sys.stderr)
+					status = EXIT_STAGE_FAILED
+
+	return status
+
+
+#
+# Run the slice of a manifest file. Returns the exit code.
+#
+def run_slice(path):
+
+	manifest = read_slice_manifest(path)
+	if manifest is None:
+		return EXIT_BAD_MANIFEST
+
+	config = configparser.ConfigParser()
+	config.read(manifest['configfile'])
+
+	# One connection, kept open for every organism of the slice
+	pool = ChadoConnectionPool(config, 1)
+
+	try:
+		conn = pool.getconn()
+	except Exception as err:
+		print("ERROR: Unable to connect to the database: %s" % str(err), file=sys.stderr)
+		pool.close()
+		return EXIT_NO_DATABASE
+
+	concurrently = manifest.get('concurrency', 1) > 1 and len(manifest['organisms']) > 1
+
+	try:
+		sizes = {}
+		# Sizes are needed to share the job's memory, and check the space on scratch
+		if concurrently or scratch_base(manifest) is not None:
+			try:
+				sizes = query_organism_sizes(conn, manifest['organisms'], get_itersize(config))
+			except Exception as err:
+				print("ERROR: Unable to read the organism sizes: %s" % str(err), file=sys.stderr)
+				return EXIT_NO_DATABASE
+			finally:
+				conn.rollback()
+
+		worker = ExportWorker(manifest, conn, get_itersize(config), pool.prepare, None, sizes)
+		if not concurrently:
+			return worker.run()
+
+		worker.start()
+	finally:
+		pool.putconn(conn)
+		pool.close()
+
+	# Closed first, so that no connection is shared with the pool processes
+	return run_concurrently(manifest, sizes)
+
+
+#
+# Command line entry point.
+#
+def main(prog_args):
+
+	parser = argparse.ArgumentParser(prog=prog_args[0], description='Run the export pipeline of one slice of organisms in this process.')
+	parser.add_argument('--manifest', help='Path of the slice manifest (JSON) written by generate_gff_from_chado.py', required=True, dest='manifest')
+
+	args = parser.parse_args(prog_args[1:])
+
+	signal.signal(signal.SIGTERM, exit_on_sigterm)
+
+	return run_slice(args.manifest)
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import os
+import json
+
+from chado_db import iter_query, DEFAULT_ITERSIZE
+
+
+#
+# Organism change detection for incremental exports.
+#
+# A fingerprint records the latest feature.timelastmodified, the
+# number of features and a hash of the organismprops of an organism.
+# One is stored per organism after each successful export and an
+# organism is only exported again when its fingerprint has changed.
+#
+
+
+#
+# Query the current fingerprint of each of the given organisms.
+# Returns a dictionary of common_name -> fingerprint dictionary.
+#
+def query_organism_fingerprints(conn, organisms, itersize=DEFAULT_ITERSIZE):
+
+	fingerprints = {}
+
+	for (common_name, lastmodified, features, props) in iter_query(conn, "select o.common_name, " +
+	                                                              "(select max(f.timelastmodified) from feature f where f.organism_id = o.organism_id), " +
+	                                                              "(select count(f.feature_id) from feature f where f.organism_id = o.organism_id), " +
+	                                                              "(select md5(coalesce(string_agg(op.type_id || '=' || coalesce(op.value, '') || '@' || op.rank, ';' " +
+	                                                              "order by op.type_id, op.rank, op.value), '')) from organismprop op where op.organism_id = o.organism_id) " +
+	                                                              "from organism o " +
+	                                                              "where o.common_name = any(%s);", (list(organisms),), itersize):
+		fingerprints[common_name] = { 'timelastmodified': lastmodified.isoformat() if lastmodified is not None else None,
+		                              'features': int(features),
+		                              'organismprops': props }
+
+	return fingerprints
+
+
+#
+# Directory of per-organism fingerprint files, <organism>.json.
+#
+class FingerprintStore:
+
+	def __init__(self, path):
+		self.path = path
+
+	def fingerprint_file(self, organism):
+		return os.path.join(self.path, organism + ".json")
+
+	#
+	# Fingerprint recorded at the last successful export, or None.
+	#
+	def load(self, organism):
+
+		try:
+			with open(self.fingerprint_file(organism), "r") as f:
+				return json.load(f)
+		except (IOError, ValueError):
+			return None
+
+	#
+	# Has the organism changed since its last successful export?
+	#
+	def has_changed(self, organism, fingerprint):
+
+		return fingerprint is None or self.load(organism) != fingerprint
+
+
+#
+# Write a fingerprint to a file. Used for the pending fingerprint
+# that a job moves into the store once its export has succeeded.
+#
+def write_fingerprint(path, fingerprint):
+
+	with open(path, "w") as f:
+		json.dump(fingerprint, f, sort_keys=True)
@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import argparse
+import configparser
+
+from chado_db import ChadoConnectionPool, attach_snapshot, iter_query, query_prepared, get_itersize, DEFAULT_ITERSIZE, RESIDUE_CHUNK_SIZE
+from chado_cache import CachedFeatureSource, extract_sequences, cache_file_name
+from parallel_gzip import DEFAULT_COMPRESSION_LEVEL, rename_output, remove_output
+from bgzf_index import open_gff_writer, GFF_INDEX_FORMATS
+from chado_job_planner import pack_jobs
+
+
+#
+# Native Chado to GFF3 writer.
+#
+# Streams the annotation of an organism straight out of Chado
+# (feature, featureloc, featureprop, feature_relationship and dbxref)
+# into one sorted, gzipped GFF3 file per organism.
+# This replaces the writedb_entry per-sequence files and
+# the subsequent gt gff3 -sort -tidy merge pass.
+#
+# A large organism can be exported as several shards, each holding
+# a share of its top-level sequences balanced by length, which
+# gff3_merge.py stitches back together in sorted order.
+#
+# With -c, each organism is first copied out of Chado in bulk into a
+# local cache (chado_cache.py), from which the GFF3 is then written.
+#
+
+GFF_VERSION_PRAGMA = "##gff-version 3"
+GFF_SOURCE = "chado"
+FASTA_LINE_WIDTH = 60
+
+# Feature relationship types that are mapped to GFF3 attributes
+RELATIONSHIP_ATTRIBUTES = { 'part_of': 'Parent', 'derives_from': 'Derives_from' }
+
+# Characters that must be escaped in GFF3 column 9 values
+GFF_ATTRIBUTE_ESCAPES = { '%': '%25', ';': '%3B', '=': '%3D', '&': '%26', ',': '%2C', '\t': '%09', '\n': '%0A', '\r': '%0D' }
+
+
+#
+# Escape a GFF3 attribute value.
+#
+def escape_gff_value(value):
+
+	return ''.join(GFF_ATTRIBUTE_ESCAPES.get(c, c) for c in str(value))
+
+
+#
+# Convert a Chado strand value to its GFF3 equivalent.
+#
+def gff_strand(strand):
+
+	if strand is None or strand == 0:
+		return '.'
+
+	return '+' if strand > 0 else '-'
+
+
+#
+# Name of the file holding one shard of an organism.
+#
+def shard_file_name(organism, shard):
+
+	return "%s.shard%d.gff3.gz" % (organism, shard)
+
+
+#
+# Split top-level sequences into shard_count shares of similar total length.
+# The split is deterministic, so every shard's process picks the same share.
+# Returns a list of shard_count lists of sequences, in sequence name order.
+#
+def shard_sequences(sequences, shard_count):
+
+	lengths = dict((sequence[1], (0, sequence[2] or 0)) for sequence in sequences)
+	shares = pack_jobs(sorted(lengths), lengths, shard_count)
+	shares = shares + [[] for i in range(shard_count - len(shares))]
+
+	by_name = dict((sequence[1], sequence) for sequence in sequences)
+
+	return [[by_name[name] for name in sorted(share)] for share in shares]
+
+
+#
+# Query layer used by the writer to read organism data from Chado.
+# All queries are keyed on a top-level sequence (srcfeature).
+# Feature attribute queries are returned in the same order as the
+# features themselves, (fmin, fmax desc, feature_id), so that the writer
+# can merge them as streams without holding a sequence in memory.
+#
+class ChadoFeatureSource:
+
+	def __init__(self, conn, itersize=DEFAULT_ITERSIZE, prepare=True):
+		self.conn = conn
+		self.itersize = itersize
+		self.prepare = prepare
+
+	#
+	# Run a query on a server-side cursor and yield the result rows.
+	#
+	def query(self, sql, params):
+
+		return iter_query(self.conn, sql, params, self.itersize)
+
+	#
+	# Run a small, frequently repeated query as a prepared statement.
+	#
+	def query_small(self, name, sql, params):
+
+		return query_prepared(self.conn, name, sql, params, self.prepare)
+
+	#
+	# Look up the Chado organism_id for an organism common name.
+	#
+	def get_organism_id(self, common_name):
+
+		for row in self.query_small("chado_export_organism_id", "select organism_id from organism where common_name = %s;", (common_name,)):
+			return row[0]
+
+		return None
+
+	#
+	# Top-level sequences (chromosomes, contigs...) for an organism,
+	# ordered by sequence name.
+	#
+	def get_top_level_sequences(self, organism_id):
+
+		return self.query("select f.feature_id, f.uniquename, f.seqlen, cvt.name " +
+		                  "from feature f " +
+		                  "join cvterm cvt on cvt.cvterm_id = f.type_id " +
+		                  "join featureprop fp on fp.feature_id = f.feature_id " +
+		                  "join cvterm fpt on fpt.cvterm_id = fp.type_id " +
+		                  "where f.organism_id = %s and fpt.name = 'top_level_seq' and not f.is_obsolete " +
+		                  "order by f.uniquename;", (organism_id,))
+
+	#
+	# Features located on a sequence, in GFF3 sort order.
+	#
+	def get_features(self, srcfeature_id):
+
+		return self.query("select f.feature_id, f.uniquename, f.name, cvt.name, fl.fmin, fl.fmax, fl.strand, fl.phase " +
+		                  "from featureloc fl " +
+		                  "join feature f on f.feature_id = fl.feature_id " +
+		                  "join cvterm cvt on cvt.cvterm_id = f.type_id " +
+		                  "where fl.srcfeature_id = %s and fl.locgroup = 0 and fl.rank = 0 and not f.is_obsolete " +
+		                  "and fl.fmin is not null and fl.fmax is not null " +
+		                  "order by fl.fmin, fl.fmax desc, f.feature_id;", (srcfeature_id,))
+
+	#
+	# Properties of the features located on a sequence.
+	#
+	def get_feature_properties(self, srcfeature_id):
+
+		return self.query("select fl.fmin, fl.fmax, fl.feature_id, cvt.name, fp.value " +
+		                  "from featureloc fl " +
+		                  "join featureprop fp on fp.feature_id = fl.feature_id " +
+		                  "join cvterm cvt on cvt.cvterm_id = fp.type_id " +
+		                  "where fl.srcfeature_id = %s and fl.locgroup = 0 and fl.rank = 0 " +
+		                  "and fl.fmin is not null and fl.fmax is not null " +
+		                  "order by fl.fmin, fl.fmax desc, fl.feature_id, fp.rank, fp.featureprop_id;", (srcfeature_id,))
+
+	#
+	# Parent (part_of) and derives_from relationships of the
+	# features located on a sequence.
+	#
+	def get_feature_relationships(self, srcfeature_id):
+
+		return self.query("select fl.fmin, fl.fmax, fl.feature_id, cvt.name, o.uniquename " +
+		                  "from featureloc fl " +
+		                  "join feature_relationship fr on fr.subject_id = fl.feature_id " +
+		                  "join feature o on o.feature_id = fr.object_id " +
+		                  "join cvterm cvt on cvt.cvterm_id = fr.type_id " +
+		                  "where fl.srcfeature_id = %s and fl.locgroup = 0 and fl.rank = 0 " +
+		                  "and fl.fmin is not null and fl.fmax is not null " +
+		                  "and cvt.name in ('part_of', 'derives_from') " +
+		                  "order by fl.fmin, fl.fmax desc, fl.feature_id, fr.rank, o.uniquename;", (srcfeature_id,))
+
+	#
+	# Database cross-references of the features located on a sequence.
+	#
+	def get_feature_dbxrefs(self, srcfeature_id):
+
+		return self.query("select fl.fmin, fl.fmax, fl.feature_id, db.name, dx.accession " +
+		                  "from featureloc fl " +
+		                  "join feature_dbxref fd on fd.feature_id = fl.feature_id " +
+		                  "join dbxref dx on dx.dbxref_id = fd.dbxref_id " +
+		                  "join db on db.db_id = dx.db_id " +
+		                  "where fl.srcfeature_id = %s and fl.locgroup = 0 and fl.rank = 0 and fd.is_current " +
+		                  "and fl.fmin is not null and fl.fmax is not null " +
+		                  "order by fl.fmin, fl.fmax desc, fl.feature_id, db.name, dx.accession;", (srcfeature_id,))
+
+	#
+	# Residues of a sequence, delivered in chunks so that
+	# large chromosomes are never held in memory as a whole.
+	#
+	def get_residues(self, feature_id):
+
+		start = 1
+		while True:
+			chunk = None
+			for row in self.query_small("chado_export_residues", "select substr(residues, %s, %s) from feature where feature_id = %s;", (start, RESIDUE_CHUNK_SIZE, feature_id)):
+				chunk = row[0]
+
+			if not chunk:
+				return
+
+			yield chunk
+
+			if len(chunk) < RESIDUE_CHUNK_SIZE:
+				return
+
+			start = start + RESIDUE_CHUNK_SIZE
+
+
+#
+# A stream of (fmin, fmax, feature_id, key, value) attribute rows,
+# sorted in feature order, that is consumed one feature at a time.
+#
+class SortedAttributeStream:
+
+	def __init__(self, rows):
+		self.rows = iter(rows)
+		self.pending = next(self.rows, None)
+
+	#
+	# Sort key matching the feature query order by (fmin, fmax desc, feature_id).
+	#
+	@staticmethod
+	def sort_key(fmin, fmax, feature_id):
+		return (fmin, -fmax, feature_id)
+
+	#
+	# Collect the (key, value) pairs of the feature with the given sort key.
+	# Rows for features that precede it (e.g. obsolete ones) are skipped.
+	#
+	def take(self, key):
+
+		values = []
+		while self.pending is not None:
+			(fmin, fmax, feature_id, name, value) = self.pending
+			row_key = self.sort_key(fmin, fmax, feature_id)
+			if row_key > key:
+				break
+			if row_key == key and value is not None:
+				values.append((name, value))
+			self.pending = next(self.rows, None)
+
+		return values
+
+
+#
+# Writes the GFF3 representation of an organism to a text stream.
+#
+class ChadoGffWriter:
+
+	def __init__(self, source, outstream):
+		self.source = source
+		self.outstream = outstream
+		self.feature_count = 0
+
+	#
+	# The top-level sequences of the given organism, or those of one
+	# of its shards, as (feature_id, uniquename, seqlen, type) in name order.
+	#
+	def select_sequences(self, common_name, shard=1, shard_count=1):
+
+		organism_id = self.source.get_organism_id(common_name)
+		if organism_id is None:
+			raise Exception('Organism not found in Chado: %s' % common_name)
+
+		sequences = sorted(self.source.get_top_level_sequences(organism_id), key=lambda sequence: sequence[1])
+		if shard_count > 1:
+			sequences = shard_sequences(sequences, shard_count)[shard - 1]
+
+		return (organism_id, sequences)
+
+	#
+	# Write all top-level sequences of the given organism, or those of
+	# one of its shards, followed by their residues in a ##FASTA section.
+	# Sequences are written in name order, as gff3_merge.py expects.
+	#
+	def write_organism(self, common_name, shard=1, shard_count=1):
+
+		(organism_id, sequences) = self.select_sequences(common_name, shard, shard_count)
+
+		self.outstream.write(GFF_VERSION_PRAGMA + "\n")
+		for (feature_id, uniquename, seqlen, seqtype) in sequences:
+			self.outstream.write("##sequence-region %s 1 %d\n" % (uniquename, seqlen or 0))
+
+		for sequence in sequences:
+			self.write_sequence_features(sequence)
+
+		if len(sequences) > 0:
+			self.outstream.write("##FASTA\n")
+			for (feature_id, uniquename, seqlen, seqtype) in sequences:
+				self.write_sequence_residues(feature_id, uniquename)
+
+	#
+	# Write the features located on one top-level sequence.
+	#
+	def write_sequence_features(self, sequence):
+
+		(srcfeature_id, seqid, seqlen, seqtype) = sequence
+
+		properties = SortedAttributeStream(self.source.get_feature_properties(srcfeature_id))
+		relationships = SortedAttributeStream(self.source.get_feature_relationships(srcfeature_id))
+		dbxrefs = SortedAttributeStream(self.source.get_feature_dbxrefs(srcfeature_id))
+
+		# The sequence itself
+		self.write_gff_line(seqid, seqtype, 1, seqlen or 0, '+', '.', [('ID', [seqid])])
+
+		for (feature_id, uniquename, name, feature_type, fmin, fmax, strand, phase) in self.source.get_features(srcfeature_id):
+
+			key = SortedAttributeStream.sort_key(fmin, fmax, feature_id)
+			attributes = [('ID', [uniquename])]
+
+			if name:
+				attributes.append(('Name', [name]))
+
+			for (reltype, objects) in self.group_values(relationships.take(key)):
+				attributes.append((RELATIONSHIP_ATTRIBUTES[reltype], objects))
+
+			xrefs = [db + ':' + accession for (db, accession) in dbxrefs.take(key)]
+			if len(xrefs) > 0:
+				attributes.append(('Dbxref', xrefs))
+
+			attributes.extend(self.group_values(properties.take(key)))
+
+			if phase is None:
+				phase = 0 if feature_type == 'CDS' else '.'
+
+			self.write_gff_line(seqid, feature_type, fmin + 1, fmax, gff_strand(strand), phase, attributes)
+
+	#
+	# Write the residues of one top-level sequence in FASTA format.
+	#
+	def write_sequence_residues(self, feature_id, seqid):
+
+		self.outstream.write(">" + seqid + "\n")
+
+		pending = ''
+		for chunk in self.source.get_residues(feature_id):
+			pending = pending + chunk
+			full = len(pending) - (len(pending) % FASTA_LINE_WIDTH)
+			for i in range(0, full, FASTA_LINE_WIDTH):
+				self.outstream.write(pending[i:i + FASTA_LINE_WIDTH] + "\n")
+			pending = pending[full:]
+
+		if len(pending) > 0:
+			self.outstream.write(pending + "\n")
+
+	#
+	# Write a single GFF3 feature line.
+	#
+	def write_gff_line(self, seqid, feature_type, start, end, strand, phase, attributes):
+
+		column9 = ';'.join(key + '=' + ','.join(escape_gff_value(v) for v in values) for (key, values) in attributes if len(values) > 0)
+
+		self.outstream.write('\t'.join([seqid, GFF_SOURCE, feature_type, str(start), str(end), '.', strand, str(phase), column9]) + "\n")
+		self.feature_count = self.feature_count + 1
+
+	#
+	# Collapse [(key, value), ...] into [(key, [values]), ...],
+	# preserving first-seen key order.
+	#
+	@staticmethod
+	def group_values(pairs):
+
+		grouped = {}
+		for (key, value) in pairs:
+			grouped.setdefault(key, []).append(value)
+
+		return list(grouped.items())
+
+
+#
+# Export one organism to <outputdir>/<organism>.gff3.gz, or
+# one of its shards to <outputdir>/<organism>.shard<N>.gff3.gz.
+# The file is written under a temporary name and renamed
+# once complete, so a partial file is never left behind.
+# It is compressed with the given level on a pool of threads.
+# With a cache directory, the data is first copied out of Chado in
+# bulk and the file is then written from the cache, which is removed.
+# With a snapshot ID, the organism is read as of that exported snapshot.
+# With bgzf, 'tbi' or 'csi', the file is written as BGZF with that index.
+#
+def export_organism(conn, organism, outputdir, itersize=DEFAULT_ITERSIZE, level=DEFAULT_COMPRESSION_LEVEL, threads=1, shard=1, shard_count=1, prepare=True, cachedir=None, snapshot=None, bgzf=None):
+
+	if shard_count > 1:
+		outfile = os.path.join(outputdir, shard_file_name(organism, shard))
+	else:
+		outfile = os.path.join(outputdir, organism + ".gff3.gz")
+	tmpfile = outfile + ".part"
+	cachefile = None
+	source = ChadoFeatureSource(conn, itersize, prepare)
+
+	try:
+		if snapshot is not None:
+			attach_snapshot(conn, snapshot)
+
+		if cachedir is not None:
+			cachefile = os.path.join(cachedir, cache_file_name(organism, shard, shard_count))
+			(organism_id, sequences) = ChadoGffWriter(source, None).select_sequences(organism, shard, shard_count)
+			extract_sequences(conn, organism_id, organism, sequences, cachefile)
+			# Done with the database before formatting starts
+			conn.rollback()
+			source = CachedFeatureSource(cachefile)
+			# The cache holds the sequences of this shard only
+			(shard, shard_count) = (1, 1)
+
+		with open_gff_writer(tmpfile, level, threads, bgzf=bgzf) as out:
+			writer = ChadoGffWriter(source, out)
+			writer.write_organism(organism, shard, shard_count)
+		rename_output(tmpfile, outfile)
+
+	finally:
+		# End the read transaction
+		conn.rollback()
+		remove_output(tmpfile)
+		if cachefile is not None:
+			if isinstance(source, CachedFeatureSource):
+				source.close()
+			if os.path.exists(cachefile):
+				os.unlink(cachefile)
+
+	return writer.feature_count
+
+
+#
+# Command line entry point.
+#
+def main(prog_args):
+
+	parser = argparse.ArgumentParser(prog=prog_args[0], description='Export Chado organisms straight to sorted, gzipped GFF3 files.')
+	parser.add_argument('-i', help='Path of script configuration file', required=True, dest='configfile')
+	parser.add_argument('-o', help='Organism common name to export (may be repeated)', required=True, action='append', dest='organisms')
+	parser.add_argument('-x', help='Output directory', required=True, dest='outputdir')
+	parser.add_argument('-t', help='Compression threads (default: 1)', required=False, type=int, default=1, dest='threads')
+	parser.add_argument('-l', help='Compression level (default: %d)' % DEFAULT_COMPRESSION_LEVEL, required=False, type=int, default=DEFAULT_COMPRESSION_LEVEL, dest='level')
+
+	parser.add_argument('-n', help='Number of shards to split each organism into (default: 1)', required=False, type=int, default=1, dest='shard_count')
+	parser.add_argument('-s', help='Shard to export, from 1 to the number of shards (default: 1)', required=False, type=int, default=1, dest='shard')
+	parser.add_argument('-c', help='Copy each organism out of Chado in bulk into a cache in this directory before writing it', required=False, dest='cachedir')
+	parser.add_argument('-S', help='Read Chado as of this exported snapshot (see pg_export_snapshot)', required=False, dest='snapshot')
+	parser.add_argument('-b', help='Write BGZF with a tabix index of this format (default: plain gzip)', required=False, choices=GFF_INDEX_FORMATS, dest='bgzf')
+
+	args = parser.parse_args(prog_args[1:])
+
+	if args.shard < 1 or args.shard > args.shard_count:
+		print("ERROR: Shard %d is not between 1 and %d" % (args.shard, args.shard_count), file=sys.stderr)
+		return 1
+
+	config = configparser.ConfigParser()
+	config.read(args.configfile.strip())
+
+	# Organisms are exported one after another on the same pooled connection
+	pool = ChadoConnectionPool(config, 1)
+
+	try:
+		conn = pool.getconn()
+	except Exception as err:
+		print("Unable to connect to the database: %s" % str(err))
+		pool.close()
+		return 1
+
+	status = 0
+
+	try:
+		for organism in args.organisms:
+			try:
+				count = export_organism(conn, organism, args.outputdir, get_itersize(config), args.level, args.threads, args.shard, args.shard_count, pool.prepare, args.cachedir, args.snapshot, args.bgzf)
+				print("exported %d features for organism %s" % (count, organism))
+			except Exception as err:
+				print("ERROR: Export of organism %s failed: %s" % (organism, str(err)), file=sys.stderr)
+				status = 1
+	finally:
+		pool.putconn(conn)
+		pool.close()
+
+	return status
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import heapq
+
+from chado_db import iter_query, DEFAULT_ITERSIZE
+
+
+#
+# Size-aware job planning.
+#
+# Organisms are packed into jobs by estimated export cost,
+# derived from their Chado feature and residue counts, using the
+# longest-processing-time-first heuristic, and each job is given a
+# memory request to match its largest organism.
+#
+# The same counts give rough estimates of each job's run time and
+# output size, from which a dry run reports the cost of a plan.
+#
+
+# Relative export cost of one feature and one residue
+COST_PER_FEATURE = 1.0
+COST_PER_RESIDUE = 0.01
+
+# Memory model for exporting a single organism
+MEMORY_BASE_MB = 1000
+MEMORY_MB_PER_1000_FEATURES = 2
+MEMORY_MB_PER_MBASE = 10
+MEMORY_ROUNDING_MB = 500
+
+# Run time model for exporting a single organism and making its derived
+# files, and the size of its compressed result files. Rough figures,
+# to be tuned from the stage metrics of real runs (chado_stage_metrics.py).
+RUNTIME_BASE_SECS = 60
+RUNTIME_SECS_PER_1000_FEATURES = 0.5
+RUNTIME_SECS_PER_MBASE = 2.0
+OUTPUT_BYTES_PER_FEATURE = 60
+OUTPUT_BYTES_PER_RESIDUE = 0.6
+
+DEFAULT_MIN_MEMORY_MB = 3500
+DEFAULT_MAX_MEMORY_MB = 30000
+DEFAULT_CACHE_MAX_AGE_HOURS = 24
+
+# Organisms at least this long are worth splitting into shards
+DEFAULT_SHARD_MIN_RESIDUES = 100000000
+
+
+#
+# Query per-organism feature counts and total sequence length.
+# Returns a dictionary of common_name -> (features, residues).
+#
+def query_organism_sizes(conn, organisms, itersize=DEFAULT_ITERSIZE):
+
+	sizes = {}
+
+	for (common_name, features, residues) in iter_query(conn, "select o.common_name, count(f.feature_id), " +
+	                                                    "coalesce(sum(case when f.residues is not null then f.seqlen else 0 end), 0) " +
+	                                                    "from organism o " +
+	                                                    "left join feature f on f.organism_id = o.organism_id " +
+	                                                    "where o.common_name = any(%s) " +
+	                                                    "group by o.common_name;", (list(organisms),), itersize):
+		sizes[common_name] = (int(features), int(residues))
+
+	return sizes
+
+
+#
+# Estimated relative cost of exporting an organism.
+#
+def organism_cost(features, residues):
+
+	return features * COST_PER_FEATURE + residues * COST_PER_RESIDUE
+
+
+#
+# Estimated peak memory (MB) needed to export an organism.
+#
+def organism_memory_mb(features, residues):
+
+	return MEMORY_BASE_MB + (features / 1000.0) * MEMORY_MB_PER_1000_FEATURES + (residues / 1000000.0) * MEMORY_MB_PER_MBASE
+
+
+#
+# Estimated seconds to export an organism and make its derived files.
+#
+def organism_runtime_secs(features, residues):
+
+	return RUNTIME_BASE_SECS + (features / 1000.0) * RUNTIME_SECS_PER_1000_FEATURES + (residues / 1000000.0) * RUNTIME_SECS_PER_MBASE
+
+
+#
+# Estimated bytes of the compressed result files of an organism.
+#
+def organism_output_bytes(features, residues):
+
+	return features * OUTPUT_BYTES_PER_FEATURE + residues * OUTPUT_BYTES_PER_RESIDUE
+
+
+#
+# Estimated cost of a job exporting the given organisms one after another,
+# or the given fraction of each of them, as for a shard. Core hours are
+# those reserved for the job, i.e. run time times the cores requested.
+#
+def estimate_job(organisms, sizes, memory_mb, cores, fraction=1.0):
+
+	features = 0
+	residues = 0
+	runtime = 0.0
+	output = 0.0
+
+	for org in organisms:
+		(orgfeatures, orgresidues) = sizes.get(org, (0, 0))
+		features = features + int(orgfeatures * fraction)
+		residues = residues + int(orgresidues * fraction)
+		runtime = runtime + organism_runtime_secs(orgfeatures * fraction, orgresidues * fraction)
+		output = output + organism_output_bytes(orgfeatures * fraction, orgresidues * fraction)
+
+	return { 'organisms': list(organisms),
+	         'features': features,
+	         'residues': residues,
+	         'memory_mb': memory_mb,
+	         'cores': cores,
+	         'runtime_secs': int(runtime),
+	         'output_mb': round(output / 1048576.0, 1),
+	         'core_hours': round(runtime * cores / 3600.0, 2) }
+
+
+#
+# Totals of a list of job estimates. The longest job bounds how soon
+# the run can end, however many jobs run at once.
+#
+def summarise_plan(jobs):
+
+	return { 'jobs': len(jobs),
+	         'organisms': len(set(org for job in jobs for org in job['organisms'])),
+	         'features': sum(job['features'] for job in jobs),
+	         'residues': sum(job['residues'] for job in jobs),
+	         'runtime_secs': sum(job['runtime_secs'] for job in jobs),
+	         'longest_job_secs': max([job['runtime_secs'] for job in jobs] + [0]),
+	         'output_mb': round(sum(job['output_mb'] for job in jobs), 1),
+	         'core_hours': round(sum(job['core_hours'] for job in jobs), 2),
+	         'max_memory_mb': max([job['memory_mb'] for job in jobs] + [0]) }
+
+
+#
+# A number of seconds as hours:minutes:seconds.
+#
+def format_duration(secs):
+
+	secs = int(secs)
+
+	return "%d:%02d:%02d" % (secs // 3600, (secs // 60) % 60, secs % 60)
+
+
+#
+# Memory request (MB) for a job. Organisms in a job are exported
+# one after another, so the largest one sets the requirement.
+#
+def job_memory_mb(organisms, sizes, min_mb=DEFAULT_MIN_MEMORY_MB, max_mb=DEFAULT_MAX_MEMORY_MB):
+
+	memory = 0
+	for org in organisms:
+		(features, residues) = sizes.get(org, (0, 0))
+		memory = max(memory, organism_memory_mb(features, residues))
+
+	# Round up to a sensible request size
+	memory = int(-(-memory // MEMORY_ROUNDING_MB) * MEMORY_ROUNDING_MB)
+
+	return min(max(memory, min_mb), max_mb)
+
+
+#
+# Pack organisms into at most job_count jobs so that the most
+# expensive job is as cheap as possible (longest processing time first).
+# Organisms with unknown sizes are treated as zero cost.
+# Returns the non-empty jobs, most expensive first.
+#
+def pack_jobs(organisms, sizes, job_count):
+
+	job_count = max(1, min(job_count, len(organisms)))
+
+	costs = {}
+	for org in organisms:
+		(features, residues) = sizes.get(org, (0, 0))
+		costs[org] = organism_cost(features, residues)
+
+	# Heap of (load, job index) so the least loaded job is always on top
+	loads = [(0.0, i) for i in range(job_count)]
+	jobs = [[] for i in range(job_count)]
+
+	for org in sorted(organisms, key=lambda o: (-costs[o], o)):
+		(load, i) = heapq.heappop(loads)
+		jobs[i].append(org)
+		heapq.heappush(loads, (load + costs[org], i))
+
+	totals = dict((i, load) for (load, i) in loads)
+	order = sorted(range(job_count), key=lambda i: (-totals[i], i))
+
+	return [jobs[i] for i in order if len(jobs[i]) > 0]
+
+
+#
+# JSON file cache of organism sizes, so that Chado
+# is only queried for organisms that are new or stale.
+#
+class OrganismSizeCache:
+
+	def __init__(self, path, max_age_hours=DEFAULT_CACHE_MAX_AGE_HOURS):
+		self.path = path
+		self.max_age_secs = max_age_hours * 3600
+		self.entries = {}
+
+	def load(self):
+
+		self.entries = {}
+		if self.path and os.path.isfile(self.path):
+			try:
+				with open(self.path, "r") as f:
+					self.entries = json.load(f)
+			except ValueError:
+				# A corrupt cache is simply rebuilt
+				self.entries = {}
+
+	def save(self):
+
+		tmpfile = self.path + ".tmp"
+		with open(tmpfile, "w") as f:
+			json.dump(self.entries, f, indent=1, sort_keys=True)
+		os.replace(tmpfile, self.path)
+
+	#
+	# Cached (features, residues) for an organism, or None if absent or stale.
+	#
+	def get(self, organism, now=None):
+
+		entry = self.entries.get(organism)
+		if entry is None:
+			return None
+
+		now = time.time() if now is None else now
+		if now - entry['timestamp'] > self.max_age_secs:
+			return None
+
+		return (entry['features'], entry['residues'])
+
+	def put(self, organism, features, residues, now=None):
+
+		self.entries[organism] = { 'features': features, 'residues': residues,
+		                           'timestamp': time.time() if now is None else now }
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import re
+import sys
+import json
+import time
+
+from chado_executor import JobResult, run_bash_output, array_element_id, job_id_sort_key
+
+
+#
+# LSF job tracking.
+#
+# Job IDs are captured from the bsub output at submission, so later
+# steps can depend on exactly these jobs rather than on a job name
+# wildcard, and the jobs are polled with a single bjobs call per
+# interval until all of them have ended.
+#
+
+DEFAULT_POLL_INTERVAL_SECS = 60
+
+# Fields requested from bjobs, in order. The job index is 0 but for
+# elements of a job array, which share their array's job ID. The exit reason comes last
+# as it is free text, e.g. "TERM_MEMLIMIT: job killed after reaching LSF memory usage limit"
+BJOBS_FIELDS = "jobid jobindex stat exit_code max_mem run_time exit_reason"
+
+# LSF states of a job that has ended
+LSF_FINISHED_STATES = ['DONE', 'EXIT']
+
+MEMORY_UNITS_MB = { 'K': 1.0 / 1024, 'M': 1.0, 'G': 1024.0, 'T': 1024.0 * 1024 }
+
+
+#
+# A bjobs max_mem value such as "512 Mbytes" or "1.5 Gbytes" in MB, or None.
+#
+def parse_lsf_memory_mb(text):
+
+	match = re.match(r'\s*([0-9.]+)\s*([KMGT])', text or '', re.IGNORECASE)
+	if not match:
+		return None
+
+	return int(round(float(match.group(1)) * MEMORY_UNITS_MB[match.group(2).upper()]))
+
+
+#
+# A bjobs run_time value such as "45 second(s)" in seconds, or None.
+#
+def parse_lsf_seconds(text):
+
+	match = re.match(r'\s*(\d+)', text or '')
+
+	return int(match.group(1)) if match else None
+
+
+#
+# Polls LSF for the state of submitted jobs.
+#
+class LsfJobMonitor:
+
+	def __init__(self, poll_interval=DEFAULT_POLL_INTERVAL_SECS, run_cmd=run_bash_output, sleep=time.sleep):
+		self.poll_interval = poll_interval
+		self.run_cmd = run_cmd
+		self.sleep = sleep
+
+	#
+	# The bjobs command line reporting on the given job IDs.
+	# Job arrays are queried by their job ID, which reports every element.
+	#
+	def bjobs_cmd(self, job_ids):
+
+		ids = sorted(set(job_id.split('[')[0] for job_id in job_ids), key=int)
+
+		return "source /etc/bashrc; bjobs -noheader -o '" + BJOBS_FIELDS + " delimiter=\",\"' " + ' '.join(ids)
+
+	#
+	# Query the jobs once.
+	# Returns a dictionary of job ID -> (stat, exit code, max memory MB, run time secs, exit reason).
+	# Jobs unknown to LSF are left out.
+	#
+	def poll(self, job_ids):
+
+		states = {}
+
+		for line in self.run_cmd(self.bjobs_cmd(job_ids)).splitlines():
+			fields = line.strip().split(',', 6)
+			if len(fields) != 7:
+				continue
+
+			(job_id, index, stat, exit_code, max_mem, run_time, exit_reason) = fields
+			if index.strip().isdigit() and int(index) > 0:
+				job_id = array_element_id(job_id, int(index))
+			if job_id not in job_ids:
+				continue
+
+			if exit_code.strip().isdigit():
+				exit_code = int(exit_code)
+			elif stat in LSF_FINISHED_STATES:
+				# LSF gives no exit code for successful jobs or jobs killed by a signal
+				exit_code = 0 if stat == 'DONE' else 1
+			else:
+				exit_code = None
+
+			exit_reason = exit_reason.strip()
+			states[job_id] = (stat, exit_code, parse_lsf_memory_mb(max_mem), parse_lsf_seconds(run_time), None if exit_reason in ['', '-'] else exit_reason)
+
+		return states
+
+	#
+	# Wait for all jobs to end.
+	# jobs is a dictionary of job ID -> job name.
+	# Returns a JobResult per job, in order of job ID.
+	#
+	def wait(self, jobs):
+
+		results = {}
+		remaining = sorted(jobs, key=job_id_sort_key)
+		missed = dict((job_id, 0) for job_id in remaining)
+
+		while len(remaining) > 0:
+			states = self.poll(remaining)
+			now = time.time()
+
+			for job_id in list(remaining):
+				state = states.get(job_id)
+
+				if state is None:
+					# A job that bjobs no longer reports has long since finished.
+					# Give up on it after a few polls, without an exit code.
+					missed[job_id] = missed[job_id] + 1
+					if missed[job_id] < 3:
+						continue
+					results[job_id] = JobResult(jobs[job_id], None, now, now, job_id)
+					print("job %s (%s) is no longer known to LSF" % (jobs[job_id], job_id), file=sys.stderr)
+
+				elif state[0] in LSF_FINISHED_STATES:
+					(stat, exit_code, max_memory_mb, run_time, exit_reason) = state
+					results[job_id] = JobResult(jobs[job_id], exit_code, now - (run_time or 0), now, job_id, max_memory_mb, exit_reason)
+					print("job %s (%s) finished with exit code %d in %d secs" % (jobs[job_id], job_id, exit_code, run_time or 0))
+
+				else:
+					continue
+
+				remaining.remove(job_id)
+
+			if len(remaining) > 0:
+				self.sleep(self.poll_interval)
+
+		return [results[job_id] for job_id in sorted(jobs, key=job_id_sort_key)]
+
+
+#
+# Write a machine readable summary of a run's job results.
+#
+def write_run_summary(path, jobtitle, executor, results):
+
+	summary = { 'jobtitle': jobtitle,
+	            'executor': executor,
+	            'finished': time.strftime('%Y-%m-%dT%H:%M:%S'),
+	            'failed': len([r for r in results if r.exit_code != 0]),
+	            'retried': len([r for r in results if len(r.retries) > 0]),
+	            'jobs': [{ 'name': r.name,
+	                       'job_id': r.job_id,
+	                       'exit_code': r.exit_code,
+	                       'exit_reason': r.exit_reason,
+	                       'elapsed_secs': round(r.elapsed_secs, 1),
+	                       'max_memory_mb': r.max_memory_mb,
+	                       'attempts': len(r.retries) + 1,
+	                       'retries': [{ 'cause': cause, 'memory_mb': memory, 'cores': cores }
+	                                   for (cause, memory, cores) in r.retries] } for r in results] }
+
+	with open(path, "w") as f:
+		json.dump(summary, f, indent=1, sort_keys=True)
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import asyncio
+import concurrent.futures
+
+from chado_executor import JobSpec, JobResult, run_job_script, run_bash_output, parse_bsub_job_id
+from chado_monitor import LSF_FINISHED_STATES
+
+
+#
+# Asyncio job orchestration.
+#
+# AsyncExecutor holds every submitted job as a task that waits for the
+# jobs it depends on, then for a free slot: one of max_jobs overall and
+# one of the limit of its resource class, e.g. 'db' for jobs reading
+# Chado and 'io' for jobs merging, compressing and copying files. Only
+# then is the job started, so however many jobs a full-site export
+# generates, the cluster stays busy without more than the allowed
+# number reading Chado or writing to the shared file system at once.
+#
+# The jobs are run by a runner: LocalJobRunner on this machine, or
+# LsfJobRunner, which submits to LSF and polls for all of its running
+# jobs with a single bjobs call per interval.
+#
+# A job that fails can be run again, with more memory or cores where it
+# ran out of them, according to a RetryPolicy. Jobs that depend on it
+# wait for its last attempt.
+#
+
+# Resource classes of the export jobs
+DB_RESOURCE = 'db'
+IO_RESOURCE = 'io'
+
+# Causes of a job failure
+MEMORY_FAILURE = 'memory'
+RUNTIME_FAILURE = 'runtime'
+EXIT_FAILURE = 'exit'
+LOST_FAILURE = 'lost'
+
+# Memory of a job that ran out of it is multiplied by this for its next attempt
+DEFAULT_RETRY_MEMORY_FACTOR = 2.0
+
+# Exit codes of a job process killed by SIGKILL, as the kernel OOM killer does
+KILLED_EXIT_CODES = [-9, 137]
+
+
+#
+# Why a job failed: it ran out of memory, ran out of time, exited with
+# an error or was lost track of. None if it succeeded.
+#
+def failure_cause(job, result):
+
+	if result.exit_code == 0:
+		return None
+
+	if result.exit_code is None:
+		return LOST_FAILURE
+
+	reason = result.exit_reason or ''
+
+	if reason.startswith('TERM_MEMLIMIT') or result.exit_code in KILLED_EXIT_CODES or \
+			(job.memory and result.max_memory_mb and result.max_memory_mb >= job.memory):
+		return MEMORY_FAILURE
+
+	if reason.startswith('TERM_RUNLIMIT') or reason.startswith('TERM_CPULIMIT'):
+		return RUNTIME_FAILURE
+
+	return EXIT_FAILURE
+
+
+#
+# How failed jobs are retried: up to max_attempts runs in all, with
+# memory_factor times the memory after running out of memory (up to
+# max_memory MB) and twice the cores after running out of time (up to
+# max_cores). The resubmit callback, if given, makes the job to retry
+# from the failed one, e.g. covering only the organisms left to export,
+# or returns None when there is nothing left to retry.
+#
+class RetryPolicy:
+
+	def __init__(self, max_attempts=1, memory_factor=DEFAULT_RETRY_MEMORY_FACTOR, max_memory=0, max_cores=0, resubmit=None):
+		self.max_attempts = max_attempts
+		self.memory_factor = memory_factor
+		self.max_memory = max_memory
+		self.max_cores = max_cores
+		self.resubmit = resubmit
+
+	#
+	# The (memory MB, cores) for the next attempt of a job that failed with the given cause.
+	#
+	def escalate(self, job, cause):
+
+		memory = job.memory
+		cores = job.cores
+
+		if cause == MEMORY_FAILURE and memory:
+			memory = int(memory * self.memory_factor)
+			if self.max_memory > 0:
+				memory = max(job.memory, min(memory, self.max_memory))
+
+		if cause == RUNTIME_FAILURE and self.max_cores > cores:
+			cores = min(cores * 2, self.max_cores)
+
+		return (memory, cores)
+
+	#
+	# The job to run as the next attempt, or None if the job is not to be retried.
+	#
+	def retry(self, job, result, cause, attempt):
+
+		if cause is None or attempt >= self.max_attempts:
+			return None
+
+		(memory, cores) = self.escalate(job, cause)
+
+		if self.resubmit is not None:
+			return self.resubmit(job, result, cause, attempt + 1, memory, cores)
+
+		retry = JobSpec(job.name, job.script, memory, cores, job.outlog, job.errlog, job.depends, job.resource)
+		retry.organisms = job.organisms
+
+		return retry
+
+
+#
+# A slot limit, where a limit of 0 means unlimited.
+#
+class Slots:
+
+	def __init__(self, limit):
+		self.semaphore = asyncio.Semaphore(limit) if limit > 0 else None
+
+	async def __aenter__(self):
+		if self.semaphore is not None:
+			await self.semaphore.acquire()
+
+	async def __aexit__(self, exc_type, exc_value, traceback):
+		if self.semaphore is not None:
+			self.semaphore.release()
+
+
+#
+# Runs job scripts on this machine, on a pool of threads
+# that each wait for a job process.
+#
+class LocalJobRunner:
+
+	def __init__(self, workers=None):
+		self.workers = workers if workers else os.cpu_count()
+		self.pool = None
+
+	def open(self):
+		self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+
+	def close(self):
+		if self.pool is not None:
+			self.pool.shutdown()
+			self.pool = None
+
+	async def run(self, job):
+
+		print("starting job %s -- %s" % (job.name, os.path.basename(job.script)))
+
+		return await asyncio.get_event_loop().run_in_executor(self.pool, run_job_script, job)
+
+	def checker_job(self, jobscriptpath, name):
+
+		return JobSpec(name, jobscriptpath, 0, 1, os.devnull, os.devnull)
+
+
+#
+# Runs job scripts on LSF. Each job is submitted once a slot is free,
+# and the running jobs are polled together every poll interval.
+#
+class LsfJobRunner:
+
+	def __init__(self, lsf, monitor, run_cmd=run_bash_output):
+		self.lsf = lsf
+		self.monitor = monitor
+		self.run_cmd = run_cmd
+		# job ID -> [job name, future, polls missed]
+		self.running = {}
+		self.poller = None
+
+	def open(self):
+		self.running = {}
+		self.poller = None
+
+	def close(self):
+		pass
+
+	async def run(self, job):
+
+		loop = asyncio.get_event_loop()
+
+		print("starting job %s -- %s" % (job.name, os.path.basename(job.script)))
+		job_id = parse_bsub_job_id(await loop.run_in_executor(None, self.run_cmd, self.lsf.job_cmd(job)))
+
+		if job_id is None:
+			print("WARNING: No job ID reported by bsub for job %s" % job.name, file=sys.stderr)
+			now = time.time()
+			return JobResult(job.name, None, now, now)
+
+		self.lsf.job_ids[job_id] = job.name
+
+		future = loop.create_future()
+		self.running[job_id] = [job.name, future, 0]
+		if self.poller is None or self.poller.done():
+			self.poller = asyncio.ensure_future(self.poll())
+
+		return await future
+
+	#
+	# Poll LSF until none of the submitted jobs are running.
+	# A job that bjobs stops reporting is given up on after a few polls.
+	#
+	async def poll(self):
+
+		loop = asyncio.get_event_loop()
+
+		while len(self.running) > 0:
+			await asyncio.sleep(self.monitor.poll_interval)
+
+			job_ids = sorted(self.running, key=int)
+			states = await loop.run_in_executor(None, self.monitor.poll, job_ids)
+			now = time.time()
+
+			for job_id in job_ids:
+				(name, future, missed) = self.running[job_id]
+				state = states.get(job_id)
+
+				if state is None:
+					self.running[job_id][2] = missed + 1
+					if missed + 1 < 3:
+						continue
+					result = JobResult(name, None, now, now, job_id)
+
+				elif state[0] in LSF_FINISHED_STATES:
+					(stat, exit_code, max_memory_mb, run_time, exit_reason) = state
+					result = JobResult(name, exit_code, now - (run_time or 0), now, job_id, max_memory_mb, exit_reason)
+
+				else:
+					continue
+
+				del self.running[job_id]
+				future.set_result(result)
+
+	def checker_job(self, jobscriptpath, name):
+
+		return JobSpec(name, jobscriptpath, 3500, 1, self.lsf.logpath + "/" + name + ".o", self.lsf.logpath + "/" + name + ".e")
+
+
+#
+# Runs the submitted jobs concurrently within slot limits,
+# each once the jobs it depends on have ended.
+#
+class AsyncExecutor:
+
+	def __init__(self, runner, max_jobs=0, limits=None, run_jobs=True, retry=None):
+		self.runner = runner
+		self.max_jobs = max_jobs
+		# resource class -> maximum number of its jobs running at once
+		self.limits = limits if limits else {}
+		self.run_jobs = run_jobs
+		self.retry = retry if retry else RetryPolicy()
+		self.jobs = []
+		self.checker = None
+
+	def submit(self, job):
+
+		if self.run_jobs:
+			self.jobs.append(job)
+
+	#
+	# The checker is run once all jobs have ended.
+	#
+	def submit_checker(self, jobscriptpath, name):
+
+		if self.run_jobs:
+			self.checker = self.runner.checker_job(jobscriptpath, name)
+
+	#
+	# Run all jobs, report and return their results in order of submission.
+	#
+	def finish(self):
+
+		if len(self.jobs) == 0 and self.checker is None:
+			return []
+
+		# A new event loop for each run, as asyncio.run needs Python 3.7
+		loop = asyncio.new_event_loop()
+		self.runner.open()
+		try:
+			results = loop.run_until_complete(self.run_all())
+		finally:
+			self.runner.close()
+			loop.close()
+			self.jobs = []
+			self.checker = None
+
+		return results
+
+	async def run_all(self):
+
+		slots = Slots(self.max_jobs)
+		classes = dict((resource, Slots(limit)) for (resource, limit) in self.limits.items())
+		tasks = {}
+
+		for job in self.jobs:
+			depends = [tasks[name] for name in (job.depends or []) if name in tasks]
+			tasks[job.name] = asyncio.ensure_future(self.run_job(job, depends, slots, classes.get(job.resource, Slots(0))))
+
+		results = list(await asyncio.gather(*tasks.values()))
+
+		if self.checker is not None:
+			print("running chado export completion checker job")
+			await self.runner.run(self.checker)
+
+		return results
+
+	async def run_job(self, job, depends, slots, resource_slots):
+
+		# Dependencies are run regardless of each other's outcome, as with LSF ended()
+		if len(depends) > 0:
+			await asyncio.wait(depends)
+
+		retries = []
+		attempt = 1
+
+		while True:
+			async with slots:
+				async with resource_slots:
+					result = await self.runner.run(job)
+
+			print("job %s finished with exit code %s in %.1f secs using %s MB" % (result.name, result.exit_code, result.elapsed_secs, result.max_memory_mb))
+
+			cause = failure_cause(job, result)
+			retry = await asyncio.get_event_loop().run_in_executor(None, self.retry.retry, job, result, cause, attempt)
+			if retry is None:
+				break
+
+			print("retrying job %s after a %s failure, with %s MB and %d cores" % (job.name, cause, retry.memory, retry.cores))
+			retries.append((cause, job.memory, job.cores))
+			job = retry
+			attempt = attempt + 1
+
+		result.retries = retries
+
+		return result
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import fcntl
+import argparse
+
+
+#
+# Run-state manifest for resumable exports.
+#
+# The manifest is a JSON file under target_path recording how far each
+# organism of a run has got: queued when the run is planned, then
+# exporting, merged, derived, converted and published as its job
+# scripts complete each step. The job scripts update it with this
+# script's command line, under a lock as jobs run concurrently.
+#
+# A resumed run plans only the organisms that were not published:
+# those that were never exported are exported again, the others only
+# run the steps that they had not completed.
+#
+
+QUEUED = 'queued'
+EXPORTING = 'exporting'
+MERGED = 'merged'
+DERIVED = 'derived'
+CONVERTED = 'converted'
+PUBLISHED = 'published'
+
+# States in the order an organism reaches them
+RUN_STATES = [QUEUED, EXPORTING, MERGED, DERIVED, CONVERTED, PUBLISHED]
+
+MANIFEST_FILE_NAME = "run_manifest.json"
+
+
+#
+# Has an organism in the given state completed the step that leads to target?
+#
+def has_reached(state, target):
+
+	return RUN_STATES.index(state) >= RUN_STATES.index(target)
+
+
+#
+# The states of the organisms of one run, kept in a JSON file.
+# Organisms are kept in the order that they were added.
+#
+class RunManifest:
+
+	def __init__(self, path):
+		self.path = path
+		self.jobtitle = None
+		self.created = None
+		# organism -> state
+		self.states = {}
+
+	#
+	# Read the manifest file. Returns False if there is none.
+	#
+	def load(self):
+
+		try:
+			with open(self.path, "r") as f:
+				manifest = json.load(f)
+		except (IOError, ValueError):
+			return False
+
+		self.jobtitle = manifest.get('jobtitle')
+		self.created = manifest.get('created')
+		self.states = dict((entry['organism'], entry['state']) for entry in manifest.get('organisms', []))
+
+		return True
+
+	#
+	# Write the manifest file, under a temporary name that is then
+	# renamed, so that readers never see a partly written manifest.
+	#
+	def save(self):
+
+		manifest = { 'jobtitle': self.jobtitle,
+		             'created': self.created,
+		             'updated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		             'organisms': [{ 'organism': org, 'state': state } for (org, state) in self.states.items()] }
+
+		tmpfile = self.path + ".part"
+		with open(tmpfile, "w") as f:
+			json.dump(manifest, f, indent=1)
+		os.rename(tmpfile, self.path)
+
+	#
+	# Start the manifest of a new run.
+	#
+	def reset(self, jobtitle):
+
+		self.jobtitle = jobtitle
+		self.created = time.strftime('%Y-%m-%dT%H:%M:%S')
+		self.states = {}
+
+	def add(self, organism):
+		self.states[organism] = QUEUED
+
+	def state(self, organism):
+		return self.states.get(organism)
+
+	#
+	# The organisms in any of the given states.
+	#
+	def organisms_in(self, states):
+
+		return [org for (org, state) in self.states.items() if state in states]
+
+
+#
+# Record a new state for organisms in the manifest file.
+# The file is locked for the update, as concurrent jobs update it.
+#
+def update_states(path, organisms, state):
+
+	with open(path + ".lock", "a") as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		try:
+			manifest = RunManifest(path)
+			if not manifest.load():
+				raise Exception('Run manifest not found: %s' % path)
+			for org in organisms:
+				manifest.states[org] = state
+			manifest.save()
+		finally:
+			fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+#
+# Command line, as used by the job scripts.
+#
+def main(prog_args):
+
+	parser = argparse.ArgumentParser(prog=prog_args[0], description='Record the state of organisms in an export run manifest.')
+	parser.add_argument('-m', help='Path of the run manifest file', required=True, dest='manifest')
+	parser.add_argument('-s', help='State reached', required=True, choices=RUN_STATES, dest='state')
+	parser.add_argument('organisms', help='Common names of the organisms', nargs='+')
+
+	args = parser.parse_args(prog_args[1:])
+
+	update_states(args.manifest, args.organisms, args.state)
+
+
+if __name__ == '__main__':
+	main(sys.argv)
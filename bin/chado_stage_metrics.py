@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import glob
+import json
+import time
+import fcntl
+import socket
+import resource
+import argparse
+import subprocess
+
+
+#
+# Per-stage instrumentation of the export job scripts.
+#
+# Each pipeline stage of a job script (export, merge, inlineseq_split,
+# extractfeat, gzip...) is run through "chado_stage_metrics.py run",
+# which runs the stage's shell command and appends one JSON line to a
+# metrics file: its wall time, CPU time and peak RSS, taken from the
+# rusage of the stage's processes, and the bytes of its input and
+# output files. "chado_stage_metrics.py summary" aggregates a metrics
+# file by stage, or by organism, to show where the time of a run goes.
+# Stages run in-process, as by the export worker, are measured with
+# run_callable_stage and recorded the same way.
+#
+
+
+#
+# Total size in bytes of the files matching the given paths or glob
+# patterns. Directories count the files beneath them.
+#
+def path_bytes(paths):
+
+	total = 0
+
+	for pattern in paths:
+		for path in glob.glob(pattern):
+			if os.path.isdir(path):
+				for root, dirs, files in os.walk(path):
+					for name in files:
+						try:
+							total = total + os.path.getsize(os.path.join(root, name))
+						except OSError:
+							pass
+			else:
+				try:
+					total = total + os.path.getsize(path)
+				except OSError:
+					pass
+
+	return total
+
+
+#
+# Run a shell command, returning its exit code and measurements.
+# The peak RSS is that of the largest process in the stage.
+#
+def run_stage(cmd, inputs=None, outputs=None):
+
+	bytes_in = path_bytes(inputs or [])
+	start_time = time.time()
+
+	process = subprocess.Popen(['/bin/bash', '-c', cmd])
+	(pid, status, rusage) = os.wait4(process.pid, 0)
+	exit_code = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+
+	metrics = { 'start': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start_time)),
+	            'wall_secs': round(time.time() - start_time, 3),
+	            'user_secs': round(rusage.ru_utime, 3),
+	            'sys_secs': round(rusage.ru_stime, 3),
+	            # ru_maxrss is in KB on Linux
+	            'max_rss_mb': rusage.ru_maxrss // 1024,
+	            'bytes_in': bytes_in,
+	            'bytes_out': path_bytes(outputs or []),
+	            'exit_code': exit_code }
+
+	return (exit_code, metrics)
+
+
+#
+# Run a stage as a function call in this process, returning its result,
+# any exception that it raised and its measurements. The CPU time is
+# that of this process, including its threads, during the stage; the
+# peak RSS is that of the process so far.
+#
+def run_callable_stage(func, inputs=None, outputs=None):
+
+	bytes_in = path_bytes(inputs or [])
+	start_time = time.time()
+	start_usage = resource.getrusage(resource.RUSAGE_SELF)
+	result = None
+	error = None
+
+	try:
+		result = func()
+	except Exception as err:
+		error = err
+
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+
+	metrics = { 'start': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start_time)),
+	            'wall_secs': round(time.time() - start_time, 3),
+	            'user_secs': round(usage.ru_utime - start_usage.ru_utime, 3),
+	            'sys_secs': round(usage.ru_stime - start_usage.ru_stime, 3),
+	            'max_rss_mb': usage.ru_maxrss // 1024,
+	            'bytes_in': bytes_in,
+	            'bytes_out': path_bytes(outputs or []),
+	            'exit_code': 0 if error is None else 1 }
+
+	return (result, error, metrics)
+
+
+#
+# Append a record to a metrics file. The file is locked
+# for the write, as concurrent jobs share it.
+#
+def append_metrics(path, record):
+
+	with open(path, "a") as f:
+		fcntl.flock(f, fcntl.LOCK_EX)
+		try:
+			f.write(json.dumps(record, sort_keys=True) + "\n")
+		finally:
+			fcntl.flock(f, fcntl.LOCK_UN)
+
+
+#
+# Read the records of a metrics file, skipping any partly written line.
+#
+def read_metrics(path):
+
+	records = []
+
+	with open(path, "r") as f:
+		for line in f:
+			try:
+				records.append(json.loads(line))
+			except ValueError:
+				pass
+
+	return records
+
+
+#
+# Aggregate metrics records by stage, or by another record key such as
+# 'organisms'. Returns (key, totals) pairs, the most wall time first.
+#
+def summarise_metrics(records, key='stage'):
+
+	totals = {}
+
+	for record in records:
+		names = record.get(key)
+		for name in (names if isinstance(names, list) else [names]):
+			total = totals.setdefault(name, { 'count': 0, 'failed': 0, 'wall_secs': 0.0, 'max_wall_secs': 0.0,
+			                                  'cpu_secs': 0.0, 'max_rss_mb': 0, 'bytes_in': 0, 'bytes_out': 0 })
+			total['count'] = total['count'] + 1
+			total['failed'] = total['failed'] + (1 if record['exit_code'] != 0 else 0)
+			total['wall_secs'] = total['wall_secs'] + record['wall_secs']
+			total['max_wall_secs'] = max(total['max_wall_secs'], record['wall_secs'])
+			total['cpu_secs'] = total['cpu_secs'] + record['user_secs'] + record['sys_secs']
+			total['max_rss_mb'] = max(total['max_rss_mb'], record['max_rss_mb'])
+			total['bytes_in'] = total['bytes_in'] + record['bytes_in']
+			total['bytes_out'] = total['bytes_out'] + record['bytes_out']
+
+	return sorted(totals.items(), key=lambda item: item[1]['wall_secs'], reverse=True)
+
+
+#
+# Print a summary as a table, with the share of the total wall time
+# and the mean number of cores kept busy by each stage.
+#
+def print_summary(summary, key='stage', out=sys.stdout):
+
+	total_wall = sum(total['wall_secs'] for (name, total) in summary)
+
+	out.write("%-24s %6s %6s %10s %6s %10s %10s %6s %9s %10s %10s\n" % (key, 'runs', 'failed', 'wall secs', 'wall%', 'max wall',
+	                                                                 'cpu secs', 'cores', 'max MB', 'MB in', 'MB out'))
+
+	for (name, total) in summary:
+		out.write("%-24s %6d %6d %10.1f %6.1f %10.1f %10.1f %6.2f %9d %10.1f %10.1f\n" % (
+		          name, total['count'], total['failed'], total['wall_secs'],
+		          100.0 * total['wall_secs'] / total_wall if total_wall > 0 else 0.0,
+		          total['max_wall_secs'], total['cpu_secs'],
+		          total['cpu_secs'] / total['wall_secs'] if total['wall_secs'] > 0 else 0.0,
+		          total['max_rss_mb'], total['bytes_in'] / 1048576.0, total['bytes_out'] / 1048576.0))
+
+
+def main(prog_args):
+
+	parser = argparse.ArgumentParser(prog=prog_args[0], description='Measure and summarise the pipeline stages of export jobs.')
+	subparsers = parser.add_subparsers(dest='command')
+	subparsers.required = True
+
+	run = subparsers.add_parser('run', help='Run a stage, appending its metrics to the metrics file')
+	run.add_argument('-m', help='Path of the metrics file', required=True, dest='metricsfile')
+	run.add_argument('-s', help='Name of the stage', required=True, dest='stage')
+	run.add_argument('-t', help='Job title of the run', required=False, dest='jobtitle')
+	run.add_argument('-g', help='Organism that the stage processes (repeatable)', required=False, action='append', default=[], dest='organisms')
+	run.add_argument('-i', help='Input file, directory or glob pattern (repeatable)', required=False, action='append', default=[], dest='inputs')
+	run.add_argument('-o', help='Output file, directory or glob pattern (repeatable)', required=False, action='append', default=[], dest='outputs')
+	run.add_argument('cmd', help='Shell command of the stage')
+
+	summary = subparsers.add_parser('summary', help='Aggregate a metrics file')
+	summary.add_argument('-m', help='Path of the metrics file', required=True, dest='metricsfile')
+	summary.add_argument('-b', help='Aggregate by stage (the default) or organism', required=False, choices=['stage', 'organism'], default='stage', dest='by')
+	summary.add_argument('-j', help='Write the summary as JSON', required=False, action='store_true', dest='json')
+
+	args = parser.parse_args(prog_args[1:])
+
+	if args.command == 'run':
+		(exit_code, metrics) = run_stage(args.cmd, args.inputs, args.outputs)
+		metrics.update({ 'stage': args.stage, 'jobtitle': args.jobtitle, 'organisms': args.organisms, 'host': socket.gethostname() })
+		try:
+			append_metrics(args.metricsfile, metrics)
+		except IOError as err:
+			# Not an export error, so kept out of the error log
+			print("WARNING: Unable to record stage metrics: %s" % str(err))
+		# Exit as bash does for a stage killed by a signal
+		return exit_code if exit_code >= 0 else 128 - exit_code
+
+	key = 'organisms' if args.by == 'organism' else 'stage'
+	totals = summarise_metrics(read_metrics(args.metricsfile), key)
+
+	if args.json:
+		json.dump(dict(totals), sys.stdout, indent=1, sort_keys=True)
+		sys.stdout.write("\n")
+	else:
+		print_summary(totals, args.by)
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
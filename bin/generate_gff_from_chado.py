@@ -1,14 +1,29 @@
 #!/usr/bin/env python3
 
 import sys
-import psycopg2
 import os
 import shutil
-import subprocess
 import configparser
 import argparse
 import time
 import re
+import shlex
+import json
+
+from chado_db import ChadoConnectionPool, open_connection, export_snapshot, iter_query, get_itersize, DEFAULT_ITERSIZE
+from chado_fingerprint import FingerprintStore, query_organism_fingerprints, write_fingerprint
+from chado_executor import JobSpec, LsfExecutor, LocalExecutor, run_bash
+from chado_monitor import LsfJobMonitor, write_run_summary, DEFAULT_POLL_INTERVAL_SECS
+from chado_orchestrator import AsyncExecutor, LocalJobRunner, LsfJobRunner, RetryPolicy, DB_RESOURCE, IO_RESOURCE, \
+	DEFAULT_RETRY_MEMORY_FACTOR
+from chado_gff_writer import shard_file_name
+from chado_run_manifest import RunManifest, has_reached, MANIFEST_FILE_NAME, \
+	QUEUED, EXPORTING, MERGED, DERIVED, CONVERTED, PUBLISHED
+from chado_job_planner import OrganismSizeCache, query_organism_sizes, pack_jobs, job_memory_mb, estimate_job, summarise_plan, format_duration, \
+	DEFAULT_MIN_MEMORY_MB, DEFAULT_MAX_MEMORY_MB, DEFAULT_CACHE_MAX_AGE_HOURS, DEFAULT_SHARD_MIN_RESIDUES
+from parallel_gzip import DEFAULT_COMPRESSION_LEVEL
+from bgzf_index import GFF_INDEX_FORMATS
+import chado_export_worker
 
 
 #
@@ -34,6 +49,127 @@ class ChadoGffExporter:
 		self.apollogffpath = ''
 		self.checkerjobstartdelay = 10
 
+		# 'writedb' (writedb_entry + gt merge) or 'native' (chado_gff_writer.py)
+		self.exportmethod = 'writedb'
+		self.nativewriterpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chado_gff_writer.py')
+
+		# How writedb_entry output is merged: 'gt' (gt gff3 -sort -tidy) or 'native' (gff3_merge.py)
+		self.mergemethod = 'gt'
+		self.gffmergepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gff3_merge.py')
+
+		# How the noseq GFF, genome, protein and cDNA files are made: 'gt' (inlineseq_split
+		# and extractfeat) or 'native' (gff3_derived.py, in a single pass)
+		self.productsmethod = 'gt'
+		self.gffderivedpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gff3_derived.py')
+
+		# How a slice job runs its pipeline: 'script' (a generated bash script of one
+		# command per step) or 'worker' (this script's worker subcommand, running the
+		# native export and derived files of the whole slice in one Python process)
+		self.jobrunner = 'script'
+		self.exporterpath = os.path.abspath(__file__)
+
+		# Organisms that a worker processes at once, up to the job cores (0 = as many as
+		# the job cores), so long as their estimated memory fits in the job's memory
+		self.workerconcurrency = 1
+
+		# Workers write each organism on node-local scratch, scratchpath or else the
+		# job's $TMPDIR, and only copy the finished files to the results directory
+		self.scratchstaging = False
+		self.scratchpath = ''
+
+		# Number of rows fetched per round trip from server-side cursors
+		self.itersize = DEFAULT_ITERSIZE
+
+		# Chado connections shared by the planning stages, opened on first use
+		self.connectionpool = None
+		self.conn = None
+
+		# Job resources and how organisms are packed into jobs:
+		# 'fixed' slices of slice_size, or 'cost' packing by organism size
+		self.jobcores = 4
+		self.jobmemory = DEFAULT_MIN_MEMORY_MB
+		self.maxjobmemory = DEFAULT_MAX_MEMORY_MB
+		self.packing = 'fixed'
+
+		# Organisms with at least shardminresidues residues are exported by the native
+		# writer as this many parallel shards of their sequences (0 or 1 = no sharding)
+		self.shards = 0
+		self.shardminresidues = DEFAULT_SHARD_MIN_RESIDUES
+		self.shardedorganisms = []
+		self.sizecachefile = ''
+		self.sizecachemaxage = DEFAULT_CACHE_MAX_AGE_HOURS
+
+		# Where job scripts run: 'lsf' (bsub) or 'local' (a process pool of localworkers, 0 = all cores)
+		self.executor = 'lsf'
+		self.localworkers = 0
+
+		# Submit the LSF jobs of a run as job arrays, with a dispatcher script per array,
+		# instead of one bsub per job. At most maxjobs elements of an array run at once.
+		self.jobarrays = False
+
+		# How jobs are released to the executor: 'none' (all at once) or 'async'
+		# (an asyncio orchestrator running at most maxjobs at once, of which at
+		# most maxdbjobs read Chado and maxiojobs post-process files, 0 = no limit)
+		self.orchestrator = 'none'
+		self.maxjobs = 0
+		self.maxdbjobs = 0
+		self.maxiojobs = 0
+
+		# Failed jobs are run again, up to maxattempts runs in all, with retrymemoryfactor
+		# times the memory after running out of it (up to maxjobmemory) or twice the
+		# cores after running out of time (up to maxjobcores, 0 = no more cores).
+		# Export jobs are retried for only the organisms they did not export.
+		self.maxattempts = 1
+		self.retrymemoryfactor = DEFAULT_RETRY_MEMORY_FACTOR
+		self.maxjobcores = 0
+
+		# gzip level of the exported files, which are compressed on all of the job cores.
+		# gzip steps of the gt pipeline use pigz when pigzpath is set.
+		self.compressionlevel = DEFAULT_COMPRESSION_LEVEL
+		# Write the final files of the native tools as BGZF, with a tabix index
+		# of format gffindex for the GFF3 files and faidx and gzi indexes for the FASTA files.
+		self.bgzfoutput = False
+		self.gffindex = 'tbi'
+
+		# Wait for LSF jobs to end, polling every pollinterval seconds, and
+		# write a summary of the job results to runsummaryfile
+		self.waitforjobs = False
+		self.pollinterval = DEFAULT_POLL_INTERVAL_SECS
+		self.runsummaryfile = ''
+		self.pigzpath = ''
+
+		# Run each pipeline stage of the job scripts through chado_stage_metrics.py,
+		# recording its wall and CPU time, peak RSS and bytes in and out in stagemetricsfile
+		self.stagemetrics = False
+		self.stagemetricsfile = ''
+		self.stagemetricspath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chado_stage_metrics.py')
+		self.jobresults = []
+
+		# Directory in which the native writer caches each organism, copied out
+		# of Chado in bulk, before writing it. Not used when empty.
+		self.cachepath = ''
+
+		# Export every organism as of one database snapshot, which this process
+		# holds open until all jobs have ended. The jobs attach to snapshotid.
+		self.consistentsnapshot = False
+		self.snapshotconn = None
+		self.snapshotid = None
+
+		# Only export organisms whose fingerprint changed since their last successful export
+		self.incremental = False
+
+		# The state of each organism of the run is recorded in the runmanifestfile,
+		# by the job scripts with chado_run_manifest.py. A resumed run only does
+		# what the last run did not complete.
+		self.resume = False
+		self.runmanifest = None
+		self.runmanifestfile = ''
+		self.runmanifestpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chado_run_manifest.py')
+
+		# Dry run: print the jobs that would be submitted, with estimates of their
+		# cost from the organism sizes, as 'text' or 'json', without running them
+		self.plan = None
+
 		self.__gt_filepath_wildcard_escaping = False
 
 	# ------
@@ -78,6 +214,440 @@ class ChadoGffExporter:
 
 	# ------
 
+	@property
+	def exportmethod_property(self):
+		return self.exportmethod
+
+	@exportmethod_property.setter
+	def exportmethod_property(self, value):
+		self.exportmethod = value
+
+	# ------
+
+	@property
+	def nativewriterpath_property(self):
+		return self.nativewriterpath
+
+	@nativewriterpath_property.setter
+	def nativewriterpath_property(self, value):
+		self.nativewriterpath = value
+
+	# ------
+
+	@property
+	def mergemethod_property(self):
+		return self.mergemethod
+
+	@mergemethod_property.setter
+	def mergemethod_property(self, value):
+		self.mergemethod = value
+
+	# ------
+
+	@property
+	def gffmergepath_property(self):
+		return self.gffmergepath
+
+	@gffmergepath_property.setter
+	def gffmergepath_property(self, value):
+		self.gffmergepath = value
+
+	# ------
+
+	@property
+	def productsmethod_property(self):
+		return self.productsmethod
+
+	@productsmethod_property.setter
+	def productsmethod_property(self, value):
+		self.productsmethod = value
+
+	# ------
+
+	@property
+	def gffderivedpath_property(self):
+		return self.gffderivedpath
+
+	@gffderivedpath_property.setter
+	def gffderivedpath_property(self, value):
+		self.gffderivedpath = value
+
+	# ------
+
+	@property
+	def jobrunner_property(self):
+		return self.jobrunner
+
+	@jobrunner_property.setter
+	def jobrunner_property(self, value):
+		self.jobrunner = value
+
+	@property
+	def workerconcurrency_property(self):
+		return self.workerconcurrency
+
+	@workerconcurrency_property.setter
+	def workerconcurrency_property(self, value):
+		self.workerconcurrency = value
+
+	@property
+	def scratchstaging_property(self):
+		return self.scratchstaging
+
+	@scratchstaging_property.setter
+	def scratchstaging_property(self, value):
+		self.scratchstaging = value
+
+	@property
+	def scratchpath_property(self):
+		return self.scratchpath
+
+	@scratchpath_property.setter
+	def scratchpath_property(self, value):
+		self.scratchpath = value
+
+	@property
+	def itersize_property(self):
+		return self.itersize
+
+	@itersize_property.setter
+	def itersize_property(self, value):
+		self.itersize = value
+
+	# ------
+
+	@property
+	def jobcores_property(self):
+		return self.jobcores
+
+	@jobcores_property.setter
+	def jobcores_property(self, value):
+		self.jobcores = value
+
+	# ------
+
+	@property
+	def jobmemory_property(self):
+		return self.jobmemory
+
+	@jobmemory_property.setter
+	def jobmemory_property(self, value):
+		self.jobmemory = value
+
+	# ------
+
+	@property
+	def maxjobmemory_property(self):
+		return self.maxjobmemory
+
+	@maxjobmemory_property.setter
+	def maxjobmemory_property(self, value):
+		self.maxjobmemory = value
+
+	# ------
+
+	@property
+	def packing_property(self):
+		return self.packing
+
+	@packing_property.setter
+	def packing_property(self, value):
+		self.packing = value
+
+	# ------
+
+	@property
+	def sizecachefile_property(self):
+		return self.sizecachefile
+
+	@sizecachefile_property.setter
+	def sizecachefile_property(self, value):
+		self.sizecachefile = value
+
+	# ------
+
+	@property
+	def executor_property(self):
+		return self.executor
+
+	@executor_property.setter
+	def executor_property(self, value):
+		self.executor = value
+
+	# ------
+
+	@property
+	def localworkers_property(self):
+		return self.localworkers
+
+	@localworkers_property.setter
+	def localworkers_property(self, value):
+		self.localworkers = value
+
+	# ------
+
+	@property
+	def jobarrays_property(self):
+		return self.jobarrays
+
+	@jobarrays_property.setter
+	def jobarrays_property(self, value):
+		self.jobarrays = value
+
+	@property
+	def orchestrator_property(self):
+		return self.orchestrator
+
+	@orchestrator_property.setter
+	def orchestrator_property(self, value):
+		self.orchestrator = value
+
+	@property
+	def maxjobs_property(self):
+		return self.maxjobs
+
+	@maxjobs_property.setter
+	def maxjobs_property(self, value):
+		self.maxjobs = value
+
+	@property
+	def maxdbjobs_property(self):
+		return self.maxdbjobs
+
+	@maxdbjobs_property.setter
+	def maxdbjobs_property(self, value):
+		self.maxdbjobs = value
+
+	@property
+	def maxiojobs_property(self):
+		return self.maxiojobs
+
+	@maxiojobs_property.setter
+	def maxiojobs_property(self, value):
+		self.maxiojobs = value
+
+	# ------
+
+	@property
+	def maxattempts_property(self):
+		return self.maxattempts
+
+	@maxattempts_property.setter
+	def maxattempts_property(self, value):
+		self.maxattempts = value
+
+	@property
+	def retrymemoryfactor_property(self):
+		return self.retrymemoryfactor
+
+	@retrymemoryfactor_property.setter
+	def retrymemoryfactor_property(self, value):
+		self.retrymemoryfactor = value
+
+	@property
+	def maxjobcores_property(self):
+		return self.maxjobcores
+
+	@maxjobcores_property.setter
+	def maxjobcores_property(self, value):
+		self.maxjobcores = value
+
+	# ------
+
+	@property
+	def shards_property(self):
+		return self.shards
+
+	@shards_property.setter
+	def shards_property(self, value):
+		self.shards = value
+
+	# ------
+
+	@property
+	def shardminresidues_property(self):
+		return self.shardminresidues
+
+	@shardminresidues_property.setter
+	def shardminresidues_property(self, value):
+		self.shardminresidues = value
+
+	# ------
+
+	@property
+	def shardedorganisms_property(self):
+		return self.shardedorganisms
+
+	# ------
+
+	@property
+	def consistentsnapshot_property(self):
+		return self.consistentsnapshot
+
+	@consistentsnapshot_property.setter
+	def consistentsnapshot_property(self, value):
+		self.consistentsnapshot = value
+
+	@property
+	def snapshotid_property(self):
+		return self.snapshotid
+
+	@snapshotid_property.setter
+	def snapshotid_property(self, value):
+		self.snapshotid = value
+
+	# ------
+
+	@property
+	def waitforjobs_property(self):
+		return self.waitforjobs
+
+	@waitforjobs_property.setter
+	def waitforjobs_property(self, value):
+		self.waitforjobs = value
+
+	# ------
+
+	@property
+	def pollinterval_property(self):
+		return self.pollinterval
+
+	@pollinterval_property.setter
+	def pollinterval_property(self, value):
+		self.pollinterval = value
+
+	# ------
+
+	@property
+	def runsummaryfile_property(self):
+		return self.runsummaryfile
+
+	@runsummaryfile_property.setter
+	def runsummaryfile_property(self, value):
+		self.runsummaryfile = value
+
+	# ------
+
+	@property
+	def stagemetrics_property(self):
+		return self.stagemetrics
+
+	@stagemetrics_property.setter
+	def stagemetrics_property(self, value):
+		self.stagemetrics = value
+
+	@property
+	def stagemetricsfile_property(self):
+		return self.stagemetricsfile
+
+	@stagemetricsfile_property.setter
+	def stagemetricsfile_property(self, value):
+		self.stagemetricsfile = value
+
+	# ------
+
+	@property
+	def compressionlevel_property(self):
+		return self.compressionlevel
+
+	@compressionlevel_property.setter
+	def compressionlevel_property(self, value):
+		self.compressionlevel = value
+
+	# ------
+
+	@property
+	def bgzfoutput_property(self):
+		return self.bgzfoutput
+
+	@bgzfoutput_property.setter
+	def bgzfoutput_property(self, value):
+		self.bgzfoutput = value
+
+	# ------
+
+	@property
+	def gffindex_property(self):
+		return self.gffindex
+
+	@gffindex_property.setter
+	def gffindex_property(self, value):
+		self.gffindex = value
+
+	# ------
+
+	@property
+	def cachepath_property(self):
+		return self.cachepath
+
+	@cachepath_property.setter
+	def cachepath_property(self, value):
+		self.cachepath = value
+
+	# ------
+
+	@property
+	def pigzpath_property(self):
+		return self.pigzpath
+
+	@pigzpath_property.setter
+	def pigzpath_property(self, value):
+		self.pigzpath = value
+
+	# ------
+
+	@property
+	def jobresults_property(self):
+		return self.jobresults
+
+	# ------
+
+	@property
+	def incremental_property(self):
+		return self.incremental
+
+	@incremental_property.setter
+	def incremental_property(self, value):
+		self.incremental = value
+
+	# ------
+
+	@property
+	def resume_property(self):
+		return self.resume
+
+	@resume_property.setter
+	def resume_property(self, value):
+		self.resume = value
+
+	@property
+	def runmanifestfile_property(self):
+		return self.runmanifestfile
+
+	@runmanifestfile_property.setter
+	def runmanifestfile_property(self, value):
+		self.runmanifestfile = value
+
+	@property
+	def plan_property(self):
+		return self.plan
+
+	@plan_property.setter
+	def plan_property(self, value):
+		self.plan = value
+
+	# ------
+
+	@property
+	def fingerprintpath_property(self):
+		return self.fingerprintpath
+
+	@fingerprintpath_property.setter
+	def fingerprintpath_property(self, value):
+		self.fingerprintpath = value
+
+	# ------
+
 	@property
 	def org_list_file_property(self):
 		return self.org_list_file
@@ -286,8 +856,17 @@ class ChadoGffExporter:
 		self.read_configuration()
 		self.validate_config()
 		#self.display_configuration()
+		if self.plan:
+			try:
+				self.print_job_plan(self.plan_export(), self.plan)
+			finally:
+				self.close_connection_pool()
+			return
 		self.create_folder_structure()
-		self.execute_export()
+		try:
+			self.execute_export()
+		finally:
+			self.close_connection_pool()
 
 
 	#
@@ -299,11 +878,18 @@ class ChadoGffExporter:
 		parser.add_argument('-i', help='Path of script configuration file', required=True, dest='configfile')
 		parser.add_argument('-a', help='Export all public Chado organisms to GFF (overrides -f option)', required=False, action='store_true', dest='dump_all')
 		parser.add_argument('-f', help='A file containing a custom list of organisms to export from Chado', required=False, dest='org_list_file', default='generate_gff_from_chado.orglist')
+		parser.add_argument('-u', help='Incremental export: skip organisms unchanged since their last successful export', required=False, action='store_true', dest='incremental')
+		parser.add_argument('-r', '--resume', help='Resume the last run, doing only the steps that it did not complete', required=False, action='store_true', dest='resume')
+		parser.add_argument('-p', '--plan', help='Print the jobs that would be submitted, with estimated run time, memory and output size, without submitting them',
+		                    required=False, nargs='?', const='text', choices=['text', 'json'], dest='plan')
 
 		args = parser.parse_args(prog_args[1:])
 		self.configfile=args.configfile.strip()
 		self.dump_all=args.dump_all
 		self.org_list_file=args.org_list_file.strip()
+		self.incremental=args.incremental
+		self.resume=args.resume
+		self.plan=args.plan
 
 
 	#
@@ -347,6 +933,9 @@ class ChadoGffExporter:
 			self.logpath = self.targetpath + "/logs"
 			self.statuspath = self.targetpath + "/status"
 			self.resultbasepath = self.targetpath + "/artemis/GFF"
+			self.sizecachefile = self.targetpath + "/organism_sizes.json"
+			self.fingerprintpath = self.targetpath + "/fingerprints"
+			self.runmanifestfile = self.targetpath + "/" + MANIFEST_FILE_NAME
 
 		except (configparser.NoSectionError, configparser.MissingSectionHeaderError) as e:
 			print('Properties file is missing mandatory sections: %s' % str(e))
@@ -364,6 +953,57 @@ class ChadoGffExporter:
 			# Fall back to default value
 			pass
 
+		try:
+			self.exportmethod = config.get('General', 'export_method').strip()
+		except Exception:
+			# Fall back to default value
+			pass
+
+		self.mergemethod = config.get('General', 'merge_method', fallback=self.mergemethod).strip()
+		self.productsmethod = config.get('General', 'products_method', fallback=self.productsmethod).strip()
+
+		self.itersize = get_itersize(config)
+
+		# Optional job resource and packing settings
+		try:
+			self.jobcores = int(config.get('Job', 'cores', fallback=str(self.jobcores)))
+			self.jobmemory = int(config.get('Job', 'memory_mb', fallback=str(self.jobmemory)))
+			self.maxjobmemory = int(config.get('Job', 'max_memory_mb', fallback=str(self.maxjobmemory)))
+			self.sizecachemaxage = float(config.get('Job', 'size_cache_max_age_hours', fallback=str(self.sizecachemaxage)))
+			self.localworkers = int(config.get('Job', 'local_workers', fallback=str(self.localworkers)))
+			self.maxjobs = int(config.get('Job', 'max_concurrent_jobs', fallback=str(self.maxjobs)))
+			self.workerconcurrency = int(config.get('Job', 'worker_concurrency', fallback=str(self.workerconcurrency)))
+			self.maxdbjobs = int(config.get('Job', 'max_db_jobs', fallback=str(self.maxdbjobs)))
+			self.maxiojobs = int(config.get('Job', 'max_io_jobs', fallback=str(self.maxiojobs)))
+			self.maxattempts = int(config.get('Job', 'max_attempts', fallback=str(self.maxattempts)))
+			self.retrymemoryfactor = float(config.get('Job', 'retry_memory_factor', fallback=str(self.retrymemoryfactor)))
+			self.maxjobcores = int(config.get('Job', 'max_cores', fallback=str(self.maxjobcores)))
+			self.compressionlevel = int(config.get('Job', 'compression_level', fallback=str(self.compressionlevel)))
+			self.pollinterval = int(config.get('Job', 'poll_interval_secs', fallback=str(self.pollinterval)))
+			self.shards = int(config.get('Job', 'shards', fallback=str(self.shards)))
+			self.shardminresidues = int(config.get('Job', 'shard_min_residues', fallback=str(self.shardminresidues)))
+		except ValueError as e:
+			raise Exception('A [Job] resource property is not a valid number: %s. Please correct the value before restarting.' % str(e))
+
+		self.packing = config.get('Job', 'packing', fallback=self.packing).strip()
+		self.sizecachefile = config.get('Job', 'size_cache_file', fallback=self.sizecachefile).strip()
+		self.executor = config.get('Job', 'executor', fallback=self.executor).strip()
+		self.orchestrator = config.get('Job', 'orchestrator', fallback=self.orchestrator).strip()
+		self.jobrunner = config.get('Job', 'job_runner', fallback=self.jobrunner).strip()
+		self.scratchstaging = (config.get('Job', 'scratch_staging', fallback=str(self.scratchstaging)).strip() == "True")
+		self.bgzfoutput = (config.get('Job', 'bgzf_output', fallback=str(self.bgzfoutput)).strip() == "True")
+		self.gffindex = config.get('Job', 'gff_index', fallback=self.gffindex).strip()
+		self.scratchpath = config.get('Job', 'scratch_path', fallback=self.scratchpath).strip()
+		self.jobarrays = (config.get('Job', 'lsf_job_arrays', fallback=str(self.jobarrays)).strip() == "True")
+		self.pigzpath = config.get('General', 'pigz_path', fallback=self.pigzpath).strip()
+		self.cachepath = config.get('General', 'cache_path', fallback=self.cachepath).strip()
+		self.waitforjobs = (config.get('Job', 'wait_for_jobs', fallback=str(self.waitforjobs)).strip() == "True")
+		self.consistentsnapshot = (config.get('Job', 'consistent_snapshot', fallback=str(self.consistentsnapshot)).strip() == "True")
+		self.runsummaryfile = config.get('Job', 'run_summary_file', fallback=self.runsummaryfile).strip()
+		self.stagemetrics = (config.get('Job', 'stage_metrics', fallback=str(self.stagemetrics)).strip() == "True")
+		self.stagemetricsfile = config.get('Job', 'stage_metrics_file', fallback=self.stagemetricsfile).strip()
+		self.runmanifestfile = config.get('Job', 'run_manifest_file', fallback=self.runmanifestfile).strip()
+
 		# Read any properties related to Apollo export
 		self.read_apollo_export_configuration(config)
 
@@ -383,52 +1023,209 @@ class ChadoGffExporter:
 			print('Configuration file genome_tools_bin property is not valid: %s' % self.gtbin)
 			valid = False
 
-		if len(self.writedbentrypath) == 0 or shutil.which(self.writedbentrypath) is None:
+		if self.exportmethod not in ['writedb', 'native']:
+			print('Configuration file export_method property must be writedb or native: %s' % self.exportmethod)
+			valid = False
+
+		if self.exportmethod == 'writedb' and (len(self.writedbentrypath) == 0 or shutil.which(self.writedbentrypath) is None):
 			print('Configuration file write_db_entry_path property is not valid: %s' % self.writedbentrypath)
 			valid = False
 
-		if self.apolloexport:
-			if len(self.apolloconverterapp) == 0 or shutil.which(self.apolloconverterapp) is None:
-				print('Configuration file apollo_gff_converter_app_path property is not valid: %s' % self.apolloconverterapp)
-				valid = False
+		if self.mergemethod not in ['gt', 'native']:
+			print('Configuration file merge_method property must be gt or native: %s' % self.mergemethod)
+			valid = False
 
-			if self.copytoftpsiteflag == True and (len(self.ftpsitefolder) == 0 or not os.path.isdir(self.ftpsitefolder)):
-				print('Configuration file ftp_site_folder property does not point to a valid directory: %s' % self.ftpsitefolder)
-				valid = False
+		if self.productsmethod not in ['gt', 'native']:
+			print('Configuration file products_method property must be gt or native: %s' % self.productsmethod)
+			valid = False
 
-			if not re.match("[^@]+@[^@]+\.[^@]+", self.reportemailaddress):
-				print('Configuration file report_email_address property is not a valid email address: %s' % self.reportemailaddress)
-				valid = False
+		if self.packing not in ['fixed', 'cost']:
+			print('Configuration file packing property must be fixed or cost: %s' % self.packing)
+			valid = False
 
-			if self.checkerjobstartdelay < 1:
-				print('Configuration file checker_job_start_delay_secs property is not permitted to be less than 1 second: %s' % self.checkerjobstartdelay)
-				valid = False
+		if self.executor not in ['lsf', 'local']:
+			print('Configuration file executor property must be lsf or local: %s' % self.executor)
+			valid = False
 
-		if not valid:
-			exit(1)
+		if self.localworkers < 0:
+			print('Configuration file local_workers property must not be negative: %s' % self.localworkers)
+			valid = False
 
-	#
-	# Print out the configuration
-	#
-	def display_configuration(self):
+		if self.orchestrator not in ['none', 'async']:
+			print('Configuration file orchestrator property must be none or async: %s' % self.orchestrator)
+			valid = False
 
-		print("dump_all property: %s" % self.dump_all)
-		print("gtbin property: %s" % self.gtbin)
-		print("writedbentrypath property: %s" % self.writedbentrypath)
-		print("org_list_file property: %s" % self.org_list_file)
-		print("slice_size property: %d" % self.slice_size)
-		print("queue property: %s" % self.queue)
-		print("targetpath property: %s" % self.targetpath)
-		print("finalresultpath property: %s" % self.finalresultpath)
-		print("scriptpath property: %s" % self.scriptpath)
-		print("logpath property: %s" % self.logpath)
+		if self.jobarrays and (self.executor != 'lsf' or self.orchestrator != 'none'):
+			print('Configuration file lsf_job_arrays property requires the lsf executor and orchestrator none')
+			valid = False
+
+		if min(self.maxjobs, self.maxdbjobs, self.maxiojobs) < 0:
+			print('Configuration file max_concurrent_jobs, max_db_jobs and max_io_jobs properties must not be negative')
+			valid = False
+
+		if self.maxattempts < 1:
+			print('Configuration file max_attempts property must be positive: %s' % self.maxattempts)
+			valid = False
+
+		if self.maxattempts > 1 and self.orchestrator != 'async':
+			print('Configuration file max_attempts property requires orchestrator async')
+			valid = False
+
+		if self.retrymemoryfactor < 1:
+			print('Configuration file retry_memory_factor property must be at least 1: %s' % self.retrymemoryfactor)
+			valid = False
+
+		if self.maxjobcores != 0 and self.maxjobcores < self.jobcores:
+			print('Configuration file max_cores property must be 0 or at least cores: %s' % self.maxjobcores)
+			valid = False
+
+		if self.jobcores < 1 or self.jobmemory < 1 or self.maxjobmemory < self.jobmemory:
+			print('Configuration file cores, memory_mb and max_memory_mb properties must be positive, with max_memory_mb >= memory_mb')
+			valid = False
+
+		if self.jobrunner not in ['script', 'worker']:
+			print('Configuration file job_runner property must be script or worker: %s' % self.jobrunner)
+			valid = False
+
+		if self.jobrunner == 'worker' and (self.exportmethod != 'native' or self.productsmethod != 'native' or self.apolloexport):
+			print('Configuration file job_runner property worker requires export_method native and products_method native, without an Apollo export')
+			valid = False
+
+		if self.workerconcurrency < 0:
+			print('Configuration file worker_concurrency property must not be negative: %s' % self.workerconcurrency)
+			valid = False
+
+		if self.workerconcurrency != 1 and self.jobrunner != 'worker':
+			print('Configuration file worker_concurrency property requires job_runner worker')
+			valid = False
+
+		if self.scratchstaging and self.jobrunner != 'worker':
+			print('Configuration file scratch_staging property requires job_runner worker')
+			valid = False
+
+		if self.shards > 1 and self.exportmethod != 'native':
+			print('Configuration file shards property requires export_method native')
+			valid = False
+
+		if len(self.cachepath) > 0 and self.exportmethod != 'native':
+			print('Configuration file cache_path property requires export_method native')
+			valid = False
+
+		if self.consistentsnapshot and self.exportmethod != 'native':
+			print('Configuration file consistent_snapshot property requires export_method native')
+			valid = False
+
+		if self.consistentsnapshot and self.executor == 'lsf' and not self.waitforjobs and self.orchestrator != 'async':
+			print('Configuration file consistent_snapshot property requires wait_for_jobs True or orchestrator async with the lsf executor')
+			valid = False
+
+		if self.resume and not os.path.isfile(self.runmanifestfile):
+			print('There is no run to resume, as the run manifest file does not exist: %s' % self.runmanifestfile)
+			valid = False
+
+		if self.pollinterval < 1:
+			print('Configuration file poll_interval_secs property must be positive: %s' % self.pollinterval)
+			valid = False
+
+		if self.compressionlevel < 1 or self.compressionlevel > 9:
+			print('Configuration file compression_level property must be between 1 and 9: %s' % self.compressionlevel)
+			valid = False
+
+		if self.gffindex not in GFF_INDEX_FORMATS:
+			print('Configuration file gff_index property must be tbi or csi: %s' % self.gffindex)
+			valid = False
+
+		if self.bgzfoutput and ((self.exportmethod != 'native' and self.mergemethod != 'native') or self.productsmethod != 'native'):
+			print('Configuration file bgzf_output property requires products_method native, and export_method or merge_method native')
+			valid = False
+
+		if len(self.pigzpath) > 0 and shutil.which(self.pigzpath) is None:
+			print('Configuration file pigz_path property is not valid: %s' % self.pigzpath)
+			valid = False
+
+		if self.apolloexport:
+			if len(self.apolloconverterapp) == 0 or shutil.which(self.apolloconverterapp) is None:
+				print('Configuration file apollo_gff_converter_app_path property is not valid: %s' % self.apolloconverterapp)
+				valid = False
+
+			if self.copytoftpsiteflag == True and (len(self.ftpsitefolder) == 0 or not os.path.isdir(self.ftpsitefolder)):
+				print('Configuration file ftp_site_folder property does not point to a valid directory: %s' % self.ftpsitefolder)
+				valid = False
+
+			if not re.match("[^@]+@[^@]+\.[^@]+", self.reportemailaddress):
+				print('Configuration file report_email_address property is not a valid email address: %s' % self.reportemailaddress)
+				valid = False
+
+			if self.checkerjobstartdelay < 1:
+				print('Configuration file checker_job_start_delay_secs property is not permitted to be less than 1 second: %s' % self.checkerjobstartdelay)
+				valid = False
+
+		if not valid:
+			exit(1)
+
+	#
+	# Print out the configuration
+	#
+	def display_configuration(self):
+
+		print("dump_all property: %s" % self.dump_all)
+		print("incremental property: %s" % self.incremental)
+		print("resume property: %s" % self.resume)
+		print("runmanifestfile property: %s" % self.runmanifestfile)
+		print("plan property: %s" % self.plan)
+		print("fingerprintpath property: %s" % self.fingerprintpath)
+		print("gtbin property: %s" % self.gtbin)
+		print("writedbentrypath property: %s" % self.writedbentrypath)
+		print("exportmethod property: %s" % self.exportmethod)
+		print("mergemethod property: %s" % self.mergemethod)
+		print("productsmethod property: %s" % self.productsmethod)
+		print("jobrunner property: %s" % self.jobrunner)
+		print("workerconcurrency property: %d" % self.workerconcurrency)
+		print("scratchstaging property: %s" % self.scratchstaging)
+		print("scratchpath property: %s" % self.scratchpath)
+		print("org_list_file property: %s" % self.org_list_file)
+		print("slice_size property: %d" % self.slice_size)
+		print("queue property: %s" % self.queue)
+		print("targetpath property: %s" % self.targetpath)
+		print("finalresultpath property: %s" % self.finalresultpath)
+		print("scriptpath property: %s" % self.scriptpath)
+		print("logpath property: %s" % self.logpath)
 		print("statuspath property: %s" % self.statuspath)
 		print("resultbasepath property: %s" % self.resultbasepath)
+		print("packing property: %s" % self.packing)
+		print("jobcores property: %d" % self.jobcores)
+		print("jobmemory property: %d" % self.jobmemory)
+		print("maxjobmemory property: %d" % self.maxjobmemory)
+		print("sizecachefile property: %s" % self.sizecachefile)
+		print("executor property: %s" % self.executor)
+		print("localworkers property: %d" % self.localworkers)
+		print("jobarrays property: %s" % self.jobarrays)
+		print("orchestrator property: %s" % self.orchestrator)
+		print("maxjobs property: %d" % self.maxjobs)
+		print("maxdbjobs property: %d" % self.maxdbjobs)
+		print("maxiojobs property: %d" % self.maxiojobs)
+		print("maxattempts property: %d" % self.maxattempts)
+		print("retrymemoryfactor property: %s" % self.retrymemoryfactor)
+		print("maxjobcores property: %d" % self.maxjobcores)
+		print("compressionlevel property: %d" % self.compressionlevel)
+		print("bgzfoutput property: %s" % self.bgzfoutput)
+		print("gffindex property: %s" % self.gffindex)
+		print("shards property: %d" % self.shards)
+		print("shardminresidues property: %d" % self.shardminresidues)
+		print("waitforjobs property: %s" % self.waitforjobs)
+		print("consistentsnapshot property: %s" % self.consistentsnapshot)
+		print("pollinterval property: %d" % self.pollinterval)
+		print("runsummaryfile property: %s" % self.runsummaryfile)
+		print("stagemetrics property: %s" % self.stagemetrics)
+		print("stagemetricsfile property: %s" % self.stagemetricsfile)
+		print("pigzpath property: %s" % self.pigzpath)
+		print("cachepath property: %s" % self.cachepath)
 		print("dbname property: %s" % self.config.get('Connection', 'database'))
 		print("user property: %s" % self.config.get('Connection', 'user'))
 		print("host property: %s" % self.config.get('Connection', 'host'))
 		print("password property: %s" % self.config.get('Connection', 'password'))
 		print("port property: %s" % self.config.get('Connection', 'port'))
+		print("itersize property: %d" % self.itersize)
 		print("Apollo export flag: %s" % self.apolloexport)
 		print("apolloconverterapp property: %s" % self.apolloconverterapp)
 		print("apolloconverterappargs property: %s" % self.apolloconverterappargs)
@@ -457,27 +1254,69 @@ class ChadoGffExporter:
 		return results
 
 
+	#
+	# Deliver the common names of all public organisms in Chado,
+	# streamed from a server-side cursor.
+	#
+	def read_public_organisms_from_chado(self):
+
+		self.open_database_connection()
+
+		try:
+
+			for elem in iter_query(self.conn, "select o.common_name as commonName " +
+			                       "from organismprop op " +
+			                       "left join cvterm cv on op.type_id = cv.cvterm_id " +
+			                       "left join organism o on o.organism_id = op.organism_id " +
+			                       "where cv.name = 'genedb_public' and op.value = 'yes' " +
+			                       "order by o.common_name;", None, self.itersize):
+				if elem is None or elem[0] is None:
+					continue
+				yield str(elem[0])
+
+		finally:
+			self.close_database_connection()
+
+
 	#
 	# Run a bash shell process.
 	#
 	@staticmethod
 	def run_bash(cmd):
-		subprocess.Popen(cmd, shell=True, executable='/bin/bash')
+		run_bash(cmd)
+
+
+	#
+	# Create the backend that runs the job scripts.
+	#
+	def create_executor(self):
+
+		if self.orchestrator == 'async':
+			if self.executor == 'local':
+				runner = LocalJobRunner(self.localworkers)
+			else:
+				runner = LsfJobRunner(LsfExecutor(self.queue, self.logpath, self.jobtitle), LsfJobMonitor(self.pollinterval))
+			retry = RetryPolicy(self.maxattempts, self.retrymemoryfactor, self.maxjobmemory, self.maxjobcores, self.retry_job)
+			return AsyncExecutor(runner, self.maxjobs, { DB_RESOURCE: self.maxdbjobs, IO_RESOURCE: self.maxiojobs }, self.run_jobs_flag, retry)
+
+		if self.executor == 'local':
+			return LocalExecutor(self.localworkers, self.run_jobs_flag)
+
+		monitor = LsfJobMonitor(self.pollinterval) if self.waitforjobs else None
+
+		return LsfExecutor(self.queue, self.logpath, self.jobtitle, self.checkerjobstartdelay, self.run_jobs_flag, monitor, self.jobarrays, self.maxjobs)
 
 
 	#
-	# Connect to the database.
+	# Take a connection to the database from the shared pool.
 	#
 	def open_database_connection(self):
 
 		try:
 
-			self.conn = psycopg2.connect("dbname='" + self.config.get('Connection', 'database') + "' " +
-	                            "user='" + self.config.get('Connection', 'user') + "' " +
-	                            "host='" + self.config.get('Connection', 'host') + "' " +
-	                            "password='" + self.config.get('Connection', 'password') + "' " +
-	                            "port='" + self.config.get('Connection', 'port') + "'")
-			self.conn.autocommit = True
+			if self.connectionpool is None:
+				self.connectionpool = ChadoConnectionPool(self.config, 1)
+			self.conn = self.connectionpool.getconn()
 
 		except Exception as err:
 			print("Unable to connect to the database: %s" % str(err))
@@ -485,17 +1324,30 @@ class ChadoGffExporter:
 
 
 	#
-	# Close the database connection.
+	# Return the database connection to the pool, ending its transaction.
+	# The connection stays open for the next stage.
 	#
 	def close_database_connection(self):
 
 		try:
 
-			self.conn.close()
+			self.connectionpool.putconn(self.conn)
 
 		except Exception as err:
 			print("Unable to close database connection: %s" % str(err))
 
+		self.conn = None
+
+
+	#
+	# Close the pooled database connections.
+	#
+	def close_connection_pool(self):
+
+		if self.connectionpool is not None:
+			self.connectionpool.close()
+			self.connectionpool = None
+
 
 	#
 	# Create any required directories and clean up any old ones.
@@ -509,10 +1361,15 @@ class ChadoGffExporter:
 			raise Exception('The target GFF file directory ' + self.targetpath + ' does not exist. Please create it or change it in the configuration file, and then re-run.')
 
 		# make dirs if required
-		for directory in [self.statuspath, self.logpath, self.scriptpath, self.finalresultpath]:
+		for directory in [self.statuspath, self.logpath, self.scriptpath, self.finalresultpath, self.fingerprintpath] + \
+						 ([self.cachepath] if len(self.cachepath) > 0 else []):
 			if not os.path.isdir(directory):
 				os.makedirs(directory)
 
+		# A resumed run carries on with the files of the last one
+		if self.resume:
+			return
+
 		# clean up old status files
 		for root, dirs, files in os.walk(self.statuspath, topdown=False):
 			for name in files:
@@ -568,34 +1425,203 @@ class ChadoGffExporter:
 	def get_organism_list(self, size):
 
 		if self.dump_all:
+			rows = list(self.read_public_organisms_from_chado())
+		else:
+			rows = self.read_organism_list_from_file()
 
-			self.open_database_connection()
+		for i in range(0, len(rows), size):
+			yield rows[i:i + size]
 
-			try:
 
-				cur = self.conn.cursor()
-				cur.execute("select o.common_name as commonName " +
-			                "from organismprop op " +
-			                "left join cvterm cv on op.type_id = cv.cvterm_id " +
-			                "left join organism o on o.organism_id = op.organism_id " +
-			                "where cv.name = 'genedb_public' and op.value = 'yes';")
-				rows = cur.fetchall()
-				cur.close()
+	#
+	# Deliver the jobs to run as (organisms, memory MB) pairs.
+	# Either fixed slices of slice_size organisms, or the same number
+	# of jobs packed by estimated cost from the organism sizes in Chado.
+	#
+	def get_job_slices(self):
+
+		if self.resume:
+			# Export again the organisms that the last run did not export
+			pending = self.runmanifest.organisms_in([QUEUED, EXPORTING])
+			slices = [pending[i:i + self.slice_size] for i in range(0, len(pending), self.slice_size)]
+		else:
+			slices = list(self.get_organism_list(self.slice_size))
+
+		if self.incremental and not self.resume:
+			changed = self.select_changed_organisms([org for sl in slices for org in sl])
+			slices = [changed[i:i + self.slice_size] for i in range(0, len(changed), self.slice_size)]
+
+		self.shardedorganisms = []
+		if self.shards > 1 and len(slices) > 0:
+			remaining = self.select_sharded_organisms([org for sl in slices for org in sl])
+			slices = [remaining[i:i + self.slice_size] for i in range(0, len(remaining), self.slice_size)]
+
+		if self.packing != 'cost' or len(slices) == 0:
+			return [(sl, self.jobmemory) for sl in slices]
+
+		organisms = [org for sl in slices for org in sl]
+		sizes = self.read_organism_sizes(organisms)
+
+		return [(job, job_memory_mb(job, sizes, self.jobmemory, self.maxjobmemory)) for job in pack_jobs(organisms, sizes, len(slices))]
+
+
+	#
+	# Set aside the organisms large enough to be exported in shards,
+	# recording (organism, shards, memory per shard) for each.
+	# Returns the remaining organisms.
+	#
+	def select_sharded_organisms(self, organisms):
+
+		sizes = self.read_organism_sizes(organisms)
+		remaining = []
+
+		for org in organisms:
+			(features, residues) = sizes.get(org, (0, 0))
+			if residues >= self.shardminresidues:
+				shardsizes = { org: (features // self.shards, residues // self.shards) }
+				memory = job_memory_mb([org], shardsizes, self.jobmemory, self.maxjobmemory)
+				self.shardedorganisms.append((org, self.shards, memory))
+			else:
+				remaining.append(org)
+
+		return remaining
+
+	#
+	# Filter organisms down to those whose Chado fingerprint differs from
+	# the one recorded at their last successful export. A pending fingerprint
+	# is written to the status directory for each, which the job moves into
+	# the fingerprint store once the organism has been exported.
+	#
+	def select_changed_organisms(self, organisms):
+
+		self.open_database_connection()
+		try:
+			fingerprints = query_organism_fingerprints(self.conn, organisms, self.itersize)
+		finally:
+			self.close_database_connection()
+
+		store = FingerprintStore(self.fingerprintpath)
+		changed = []
+
+		for org in organisms:
+			fingerprint = fingerprints.get(org)
+			if store.has_changed(org, fingerprint):
+				changed.append(org)
+				# A dry run leaves the status directory as it is
+				if fingerprint is not None and not self.plan:
+					write_fingerprint(self.pending_fingerprint_file(org), fingerprint)
+			else:
+				print("skipping unchanged organism %s" % org, file=sys.stderr)
+
+		return changed
+
+	#
+	# Where the fingerprint of an organism waits for its export to succeed.
+	#
+	def pending_fingerprint_file(self, org):
+
+		return self.statuspath + "/" + org + ".fingerprint"
 
+
+	#
+	# Feature and residue counts for the given organisms, from the
+	# size cache file where fresh, otherwise from Chado.
+	#
+	def read_organism_sizes(self, organisms):
+
+		cache = OrganismSizeCache(self.sizecachefile, self.sizecachemaxage)
+		cache.load()
+
+		sizes = {}
+		missing = []
+		for org in organisms:
+			size = cache.get(org)
+			if size is None:
+				missing.append(org)
+			else:
+				sizes[org] = size
+
+		if len(missing) > 0:
+			self.open_database_connection()
+			try:
+				queried = query_organism_sizes(self.conn, missing, self.itersize)
 			finally:
 				self.close_database_connection()
 
-			for elem in rows[0:min(size, len(rows))]:
-				if elem is None:
-					continue
-				res = str(elem[0])
-				yield(res)
+			for (org, (features, residues)) in queried.items():
+				cache.put(org, features, residues)
+				sizes[org] = (features, residues)
 
-		else:
-			rows = self.read_organism_list_from_file()
-			for i in range(0, len(rows), size):
-				yield rows[i:i + size]
+			cache.save()
+
+		return sizes
+
+
+	#
+	# The jobs that a run would submit, each with estimates of its run
+	# time, memory, output size and core hours, and their totals.
+	# Shard jobs each cover a share of their organism, whose stitch job
+	# is counted in the shards.
+	#
+	def plan_export(self):
+
+		self.open_run_manifest()
+
+		slices = self.get_job_slices()
+
+		organisms = [org for (sl, memory) in slices for org in sl] + [org for (org, shardcount, memory) in self.shardedorganisms]
+		steps = self.runmanifest.organisms_in([MERGED, DERIVED, CONVERTED]) if self.resume else []
+		sizes = self.read_organism_sizes(organisms + steps) if len(organisms + steps) > 0 else {}
+
+		jobs = []
+
+		for (sl, memory) in slices:
+			job = estimate_job(sl, sizes, memory, self.jobcores)
+			job['kind'] = 'export'
+			jobs.append(job)
+
+		for (org, shardcount, memory) in self.shardedorganisms:
+			for shard in range(1, shardcount + 1):
+				job = estimate_job([org], sizes, memory, self.jobcores, 1.0 / shardcount)
+				job['kind'] = 'shard'
+				job['shard'] = shard
+				jobs.append(job)
+
+		for org in steps:
+			job = estimate_job([org], sizes, self.jobmemory, self.jobcores)
+			job['kind'] = 'steps'
+			jobs.append(job)
+
+		return { 'jobtitle': self.jobtitle,
+		         'executor': self.executor,
+		         'packing': self.packing,
+		         'jobs': jobs,
+		         'totals': summarise_plan(jobs) }
 
+	#
+	# Print a job plan as a table, or as JSON for other tools.
+	#
+	def print_job_plan(self, plan, format='text', out=sys.stdout):
+
+		if format == 'json':
+			json.dump(plan, out, indent=1, sort_keys=True)
+			out.write("\n")
+			return
+
+		out.write("%-5s %-7s %8s %6s %10s %10s %10s  %s\n" % ('job', 'kind', 'memory', 'cores', 'runtime', 'output MB', 'core hrs', 'organisms'))
+
+		for (i, job) in enumerate(plan['jobs']):
+			names = ",".join(job['organisms'])
+			if job['kind'] == 'shard':
+				names = "%s (shard %d)" % (names, job['shard'])
+			out.write("%-5d %-7s %8d %6d %10s %10.1f %10.2f  %s\n" % (i + 1, job['kind'], job['memory_mb'], job['cores'],
+			          format_duration(job['runtime_secs']), job['output_mb'], job['core_hours'], names))
+
+		totals = plan['totals']
+		out.write("%d jobs exporting %d organisms (%d features, %d residues): estimated %s of job time, longest job %s, "
+		          "%.1f MB of output, %.2f core hours, at most %d MB per job\n" % (
+		          totals['jobs'], totals['organisms'], totals['features'], totals['residues'], format_duration(totals['runtime_secs']),
+		          format_duration(totals['longest_job_secs']), totals['output_mb'], totals['core_hours'], totals['max_memory_mb']))
 
 	#
 	# Export the specified organism sequences to GFF from Chado.
@@ -603,140 +1629,672 @@ class ChadoGffExporter:
 	#
 	def execute_export(self):
 
+		executor = self.create_executor()
+
+		self.open_run_manifest()
+
+		if self.maxattempts > 1 and os.path.exists(self.get_retry_log_file()):
+			os.remove(self.get_retry_log_file())
+
+		if self.consistentsnapshot:
+			self.open_export_snapshot()
+
+		try:
+			self.submit_export_jobs(executor)
+		finally:
+			self.close_export_snapshot()
+
+		if len(self.jobresults) > 0:
+			write_run_summary(self.get_run_summary_file(), self.jobtitle, self.executor, self.jobresults)
+
+		for result in self.jobresults:
+			for (cause, memory, cores) in result.retries:
+				print("job %s was retried after a %s failure with %s MB and %d cores" % (result.name, cause, memory, cores))
+
+	#
+	# Write and submit the export jobs, then wait for them where the executor does.
+	#
+	def submit_export_jobs(self, executor):
+
 		jobs = []
 		donefiles = []
 		errorlogs = []
-		orgs = []
 
 		i = 0
 
+		slices = self.get_job_slices()
+
+		# The manifest lists the organisms before any job can update it
+		if not self.resume:
+			for (sl, memory) in slices:
+				for org in sl:
+					self.runmanifest.add(org)
+			for (org, shardcount, memory) in self.shardedorganisms:
+				self.runmanifest.add(org)
+		self.runmanifest.save()
+
 		# generate batch jobs and submit them
-		for sl in self.get_organism_list(self.slice_size):
+		for (sl, memory) in slices:
 
 			i = i + 1
-			runstr = "writedb_entries.py -v -w "+ self.writedbentrypath + " "
 			scriptname = "%d__" % i
 			for org in sl:
-				orgs.append(org)
-				runstr = runstr + " -o " + org + " "
 				scriptname = scriptname + org
 
-			runstr = runstr + " -x " + self.targetpath + " -d " + self.configfile + " -f 3000"
-
-			tf = open(self.scriptpath + "/" + scriptname, "w+")
-			# construct per-node script
-			tf.write("#!/bin/bash\n")
+			tf = self.open_job_script(scriptname)
 
-			tf.write("JOB_ERROR_STATUS=0\n")
-			tf.write("WORKING_DIRECTORY=$(pwd)\n")
+			if self.jobrunner == 'worker':
+				# The worker runs the slice, and the organism steps unless they are separate jobs
+				tf.write(self.construct_worker_cmd(scriptname, sl, memory, self.orchestrator != 'async') + " || JOB_ERROR_STATUS=$?\n")
 
-			for org in sl:
-				orgpath = self.resultbasepath + "/" + org
-				tf.write("rm -rf \"" + orgpath + "\"\n")
+			else:
+				if self.exportmethod == 'writedb':
+					for org in sl:
+						orgpath = self.resultbasepath + "/" + org
+						tf.write("rm -rf \"" + orgpath + "\"\n")
+
+				tf.write(self.construct_export_start_cmds(sl))
+				tf.write(self.construct_stage_cmd('export', sl, self.construct_export_cmd(sl), None, self.export_outputs(sl)) + " || JOB_ERROR_STATUS=1\n")
+
+			if self.orchestrator == 'async':
+				# The organism steps run as separate file bound jobs once the export has
+				# ended, so that their slots are limited apart from those reading Chado
+				exportjob = self.submit_job_script(executor, tf, scriptname, self.jobtitle + str(i), memory, None, donefiles, errorlogs, DB_RESOURCE, sl)
+				jobs.append(exportjob.name)
+
+				for org in sl:
+					i = i + 1
+					scriptname = "%d__%s.steps" % (i, org)
+					tf = self.open_job_script(scriptname)
+					self.write_organism_steps(tf, org)
+					job = self.submit_job_script(executor, tf, scriptname, self.jobtitle + str(i), self.jobmemory, [exportjob.name], donefiles, errorlogs, IO_RESOURCE)
+					jobs.append(job.name)
+				continue
+
+			if self.jobrunner != 'worker':
+				for org in sl:
+					self.write_organism_steps(tf, org)
+
+			job = self.submit_job_script(executor, tf, scriptname, self.jobtitle + str(i), memory, None, donefiles, errorlogs)
+			jobs.append(job.name)
+
+		# Large organisms are exported as parallel shards of their sequences,
+		# then stitched together by a job that runs when all of the shards have ended
+		for (org, shardcount, memory) in self.shardedorganisms:
+
+			shardjobs = []
+			shardfiles = []
+
+			# The shards of an earlier run are removed here rather than by a shard job,
+			# as the shards run side by side and a shard job may be retried after the
+			# others have written their files
+			shutil.rmtree(self.resultbasepath + "/" + org, ignore_errors=True)
+
+			for shard in range(1, shardcount + 1):
+
+				i = i + 1
+				scriptname = "%d__%s.shard%d" % (i, org, shard)
+				shardfiles.append(self.resultbasepath + "/" + org + "/" + shard_file_name(org, shard))
+
+				tf = self.open_job_script(scriptname)
+				if shard == 1:
+					tf.write(self.construct_export_start_cmds([org]))
+				tf.write("mkdir -p \"" + self.resultbasepath + "/" + org + "\"\n")
+				tf.write(self.construct_stage_cmd('export_shard', [org], self.construct_shard_export_cmd(org, shard, shardcount), None, [shardfiles[-1]]) + " || JOB_ERROR_STATUS=1\n")
+
+				job = self.submit_job_script(executor, tf, scriptname, self.jobtitle + str(i), memory, None, donefiles, errorlogs, DB_RESOURCE)
+				shardjobs.append(job.name)
+				jobs.append(job.name)
 
-			tf.write(runstr + "\n")
+			i = i + 1
+			scriptname = "%d__%s.stitch" % (i, org)
 
-			for org in sl:
-				orgpath = self.resultbasepath + "/" + org
-				# navigate to directory
-				tf.write("cd " + orgpath + "\n")
-				# flatten directory structure
-				tf.write("find . -type f -exec mv {} . \\;\n")
-				# clean up logs
-				tf.write("rm -f tidylog.log\n")
-				# remove empty dirs
-				tf.write("find . -type d -delete\n")
-
-				# merge GFFs into one file per organism
-				search_path = self.escape_gt_wildcards("*.gff.gz")
-				tf.write("GT_RETAINIDS=yes " + self.gtbin + " gff3 -sort -tidy -force -retainids -o " +
-					org + ".gff3.gz -gzip " + search_path + " 2> " + org + ".tidylog \n")
-
-				# allow access to pathdev members
-				tf.write("chmod -R 775 .\n")
-				# move result to separate directory
-				tf.write("cp " + org + ".gff3.gz " + self.finalresultpath + "\n")
-				tf.write("cp " + org + ".tidylog " + self.finalresultpath + "\n")
-				tf.write("cd $WORKING_DIRECTORY\n")
-
-				if not self.apolloexport:
-					# split sequences and annotations
-					tf.write("GT_RETAINIDS=yes " + self.gtbin + " inlineseq_split -seqfile "+ self.finalresultpath + "/" + org + ".genome.fasta -gff3file " + self.finalresultpath + "/" + org + ".noseq.gff3 " + self.finalresultpath + "/" + org + ".gff3.gz\n")
-					# gzip everything
-					tf.write("gzip -f " + self.finalresultpath + "/" + org + ".genome.fasta \n")
-					tf.write("gzip -f " + self.finalresultpath + "/" + org + ".noseq.gff3 \n")
-					# prepare cDNA and protein sequences
-					tf.write("GT_RETAINIDS=yes " + self.gtbin + " extractfeat -type CDS -join -translate -retainids -seqfile "+ self.finalresultpath + "/" + org + ".genome.fasta.gz -matchdescstart -force -o " + self.finalresultpath + "/" + org + ".prot.fasta.gz -gzip " + self.finalresultpath + "/" + org + ".noseq.gff3.gz \n")
-					tf.write("GT_RETAINIDS=yes " + self.gtbin + " extractfeat -type mRNA -retainids -seqfile "+ self.finalresultpath + "/" + org + ".genome.fasta.gz -matchdescstart -force -o " + self.finalresultpath + "/" + org + ".cdna.fasta.gz -gzip " + self.finalresultpath + "/" + org + ".noseq.gff3.gz \n")
-					# clean up indices
-					tf.write("rm -f " + self.finalresultpath + "/" + org + ".genome.fasta.gz.* \n")
-					tf.write("chmod -R 777 " + self.finalresultpath + " \n")
-
-				# Clean-up working writedbentry files to save disk space
-				tf.write("rm -rf \"" + orgpath + "\"\n")
-
-				#
-				# If this export is for Apollo then we must convert the gff file features to the correct parent-child relationship
-				# and copy to ftp site.
-				#
-				if self.apolloexport:
-
-					inputfile = self.finalresultpath + "/" + org + ".gff3.gz"
-					outputfile = self.apollogffpath + "/" + org + ".gff3.gz"
-
-					tf.write(self.construct_apollo_converter_app_cmds(inputfile, outputfile) + "\n")
-
-					if self.copytoftpsiteflag:
-						tf.write("if [[ -s \"" + outputfile + "\" ]]; then\n")
-						tf.write("   cp " + outputfile + " " + self.ftptargetfolder + "/" + "\n")
-						tf.write("fi\n")
-
-				tf.write("\n")
-
-			donefile = self.statuspath + "/" + scriptname + ".done"
-
-			tf.write("touch " + donefile + "\n")
-			tf.close()
+			tf = self.open_job_script(scriptname)
+			tf.write(self.construct_stitch_cmds(org, shardfiles))
+			self.write_organism_steps(tf, org)
 
-			os.chmod(self.scriptpath + "/" + scriptname, 0o775)
+			job = self.submit_job_script(executor, tf, scriptname, self.jobtitle + str(i), self.jobmemory, shardjobs, donefiles, errorlogs, IO_RESOURCE)
+			jobs.append(job.name)
 
-			errorlog = self.logpath + "/" + scriptname + ".e"
-			jobid = self.jobtitle + str(i)
+		# Organisms of a resumed run that were exported, but not published,
+		# only run the steps that they had not completed
+		if self.resume:
+			for org in self.runmanifest.organisms_in([MERGED, DERIVED, CONVERTED]):
 
-			# Create LSF job execution string
-			execline = "source /etc/bashrc; bsub -J " + jobid + " -q " + self.queue + " -n4  " + \
-		              "-R 'select[mem>3500] rusage[mem=3500] span[hosts=1]' -M 3500 " + \
-		              "-o " + self.logpath + "/" + scriptname  + ".o " + \
-		              "-e " + errorlog + " " + \
-		              str(self.scriptpath) + "/" + str(scriptname)
+				i = i + 1
+				scriptname = "%d__%s.steps" % (i, org)
 
-			# Keep track of the jobs that we need to monitor...
-			donefiles.append(donefile)
-			errorlogs.append(errorlog)
-			jobs.append(jobid)
+				tf = self.open_job_script(scriptname)
+				self.write_organism_steps(tf, org, self.runmanifest.state(org))
 
-			# Submit script to LSF
-			if self.run_jobs_flag:
-				print("starting job %d -- %s" % (i, scriptname))
-				self.run_bash(execline)
+				job = self.submit_job_script(executor, tf, scriptname, self.jobtitle + str(i), self.jobmemory, None, donefiles, errorlogs, IO_RESOURCE)
+				jobs.append(job.name)
 
 		# Submit dependent "completion checker" job.
 		# This job runs when all export jobs have finished.
-		# We add a small delay as it's possible for the checker to
-		# sometimes get scheduled before export jobs and consequently
-		# exit immediately (race condition).
 		#
 		if len(jobs) > 0 and self.apolloexport == True:
-			print("waiting to start chado export completion checker job...")
-			time.sleep(self.checkerjobstartdelay)
-			self.run_checker_job(donefiles, errorlogs)
+			self.run_checker_job(executor, donefiles, errorlogs)
+
+		self.jobresults = executor.finish()
+
+	#
+	# Read the manifest of the run to resume, or start a new one.
+	#
+	def open_run_manifest(self):
+
+		self.runmanifest = RunManifest(self.runmanifestfile)
+
+		if self.resume:
+			if not self.runmanifest.load():
+				raise Exception('The run manifest ' + self.runmanifestfile + ' could not be read, so the run cannot be resumed.')
+			print("resuming run %s of %s" % (self.runmanifest.jobtitle, self.runmanifest.created), file=sys.stderr)
+		else:
+			self.runmanifest.reset(self.jobtitle)
+
+	#
+	# Export a snapshot of the database for the jobs to attach to.
+	# The transaction that exported it must stay open until every
+	# job has started reading, so it is kept until the jobs have ended.
+	#
+	def open_export_snapshot(self):
+
+		try:
+			self.snapshotconn = open_connection(self.config)
+			self.snapshotid = export_snapshot(self.snapshotconn)
+		except Exception as err:
+			print("Unable to export a database snapshot: %s" % str(err))
+			exit(1)
+
+		print("exporting Chado as of snapshot %s" % self.snapshotid)
+
+	#
+	# End the snapshot transaction.
+	#
+	def close_export_snapshot(self):
+
+		if self.snapshotconn is not None:
+			try:
+				self.snapshotconn.close()
+			except Exception as err:
+				print("Unable to close database connection: %s" % str(err))
+			self.snapshotconn = None
+
+	#
+	# Where the summary of job results is written,
+	# by default <logpath>/<jobtitle>.summary.json.
+	#
+	def get_run_summary_file(self):
+
+		if len(self.runsummaryfile) > 0:
+			return self.runsummaryfile
+
+		return os.path.join(self.logpath, self.jobtitle + ".summary.json")
+
+	#
+	# Where the stage metrics of the job scripts are written,
+	# by default <logpath>/<jobtitle>.metrics.jsonl.
+	#
+	def get_stage_metrics_file(self):
+
+		if len(self.stagemetricsfile) > 0:
+			return self.stagemetricsfile
+
+		return os.path.join(self.logpath, self.jobtitle + ".metrics.jsonl")
+
+	#
+	# Wrap the shell command of a pipeline stage so that its metrics are
+	# recorded, if stage metrics are enabled. inputs and outputs are the
+	# files, directories or glob patterns whose bytes are counted.
+	#
+	def construct_stage_cmd(self, stage, organisms, cmd, inputs=None, outputs=None):
+
+		if not self.stagemetrics:
+			return cmd
+
+		wrapped = self.stagemetricspath + " run -m " + self.get_stage_metrics_file() + " -s " + stage + " -t " + self.jobtitle
+		for org in organisms:
+			wrapped = wrapped + " -g " + org
+		for path in (inputs or []):
+			wrapped = wrapped + " -i " + shlex.quote(path)
+		for path in (outputs or []):
+			wrapped = wrapped + " -o " + shlex.quote(path)
+
+		return wrapped + " " + shlex.quote(cmd)
+
+	#
+	# The files or directories that an export job writes for organisms.
+	#
+	def export_outputs(self, organisms):
+
+		if self.exportmethod == 'native':
+			return [self.finalresultpath + "/" + org + ".gff3.gz" for org in organisms]
+
+		return [self.resultbasepath + "/" + org for org in organisms]
+
+	#
+	# Create a job script and write its preamble.
+	#
+	def open_job_script(self, scriptname):
+
+		tf = open(self.scriptpath + "/" + scriptname, "w+")
+		# construct per-node script
+		tf.write("#!/bin/bash\n")
+
+		tf.write("JOB_ERROR_STATUS=0\n")
+		tf.write("WORKING_DIRECTORY=$(pwd)\n")
+
+		return tf
+
+	#
+	# Complete a job script and submit it, once the named
+	# jobs it depends on (if any) have ended.
+	# Its done file and error log are added to the lists to check.
+	# resource is the class of job slot it needs, DB_RESOURCE or IO_RESOURCE,
+	# and organisms those that the script exports from Chado, if any.
+	#
+	def submit_job_script(self, executor, tf, scriptname, jobname, memory, depends, donefiles, errorlogs, resource=None, organisms=None):
+
+		donefile = self.statuspath + "/" + scriptname + ".done"
+
+		# A resumed run may reuse the script names of the last one
+		if os.path.exists(donefile):
+			os.remove(donefile)
+
+		tf.write("touch " + donefile + "\n")
+		tf.write("exit $JOB_ERROR_STATUS\n")
+		tf.close()
+
+		os.chmod(self.scriptpath + "/" + scriptname, 0o775)
+
+		job = self.create_job_spec(scriptname, jobname, memory)
+		job.depends = depends
+		job.resource = resource
+		job.organisms = organisms if organisms else []
+
+		for log in [job.outlog, job.errlog]:
+			if os.path.exists(log):
+				os.rename(log, log + ".previous")
+
+		# Keep track of the jobs that we need to monitor...
+		donefiles.append(donefile)
+		errorlogs.append(job.errlog)
+
+		# Submit script to LSF or run it locally
+		executor.submit(job)
+
+		return job
+
+	#
+	# Make the next attempt of a failed job, with the given memory and cores.
+	# A native export job is retried for only those of its organisms with
+	# no result written since the failed attempt started, by the worker if
+	# that is the job runner; other jobs run their whole script again.
+	# The logs of the failed attempt are kept as <log>.attempt<N>, so
+	# that the checker only sees those of the last one.
+	# Returns None when every organism of the job was exported after all.
+	#
+	def retry_job(self, job, result, cause, attempt, memory, cores):
+
+		scriptname = re.sub(r'\.retry\d+$', '', os.path.basename(job.script))
+		script = job.script
+		organisms = job.organisms
+
+		if len(job.organisms) > 0 and self.exportmethod == 'native':
+			organisms = [org for org in job.organisms if not self.is_exported_since(org, result.start_time)]
+			if len(organisms) == 0:
+				return None
+
+			retryname = "%s.retry%d" % (scriptname, attempt)
+			script = self.scriptpath + "/" + retryname
+
+			tf = self.open_job_script(retryname)
+			if self.jobrunner == 'worker':
+				# The worker keeps its concurrency and staging within the escalated memory
+				tf.write(self.construct_worker_cmd(retryname, organisms, memory, False) + " || JOB_ERROR_STATUS=$?\n")
+			else:
+				tf.write(self.construct_stage_cmd('export', organisms, self.construct_export_cmd(organisms), None, self.export_outputs(organisms)) + " || JOB_ERROR_STATUS=1\n")
+			tf.write("touch " + self.statuspath + "/" + scriptname + ".done\n")
+			tf.write("exit $JOB_ERROR_STATUS\n")
+			tf.close()
+			os.chmod(script, 0o775)
+
+		for log in [job.outlog, job.errlog]:
+			if os.path.exists(log):
+				os.rename(log, "%s.attempt%d" % (log, attempt - 1))
+
+		with open(self.get_retry_log_file(), "a") as f:
+			f.write("%s attempt %d failed (%s, exit code %s%s): retrying %s with %s MB and %d cores\n" % (
+			        job.name, attempt - 1, cause, result.exit_code,
+			        ", " + result.exit_reason if result.exit_reason else "",
+			        " ".join(organisms) if len(organisms) > 0 else scriptname, memory, cores))
+
+		retry = JobSpec(job.name, script, memory, cores, job.outlog, job.errlog, job.depends, job.resource)
+		retry.organisms = organisms
+
+		return retry
+
+	#
+	# Whether the final result of an organism was written since the given time.
+	#
+	def is_exported_since(self, org, since):
+
+		resultfile = self.finalresultpath + "/" + org + ".gff3.gz"
+
+		return os.path.exists(resultfile) and os.path.getsize(resultfile) > 0 and os.path.getmtime(resultfile) >= since
+
+	#
+	# Where the failed job attempts that were retried are listed.
+	#
+	def get_retry_log_file(self):
+
+		return os.path.join(self.logpath, self.jobtitle + ".retries.log")
+
+	#
+	# Write the job script steps that turn the export of an organism into
+	# the final result files: merging writedb_entry output, splitting out
+	# sequences, Apollo conversion and recording the export fingerprint.
+	# Each step completed is recorded in the run manifest. The steps that
+	# an organism had completed by the given state are left out.
+	#
+	def write_organism_steps(self, tf, org, state=QUEUED):
+
+		orgpath = self.resultbasepath + "/" + org
+		resultfile = self.finalresultpath + "/" + org + ".gff3.gz"
+
+		# The organisms of a job have their own status, so that
+		# a failed organism does not stop the others being recorded
+		tf.write("ORG_STATUS=0\n")
+		failed = " || { ORG_STATUS=1; JOB_ERROR_STATUS=1; }\n"
+
+		if has_reached(state, MERGED):
+			pass
+
+		elif self.exportmethod == 'writedb' and self.mergemethod == 'native':
+			# merge the sorted per-sequence GFFs straight into the final file
+			tf.write(self.construct_stage_cmd('merge', [org], self.construct_merge_cmd(org), [orgpath], [resultfile]) + failed)
+
+		elif self.exportmethod == 'writedb':
+			# navigate to directory
+			tf.write("cd " + orgpath + "\n")
+			# flatten directory structure
+			tf.write("find . -type f -exec mv {} . \\;\n")
+			# clean up logs
+			tf.write("rm -f tidylog.log\n")
+			# remove empty dirs
+			tf.write("find . -type d -delete\n")
+
+			# merge GFFs into one file per organism
+			search_path = self.escape_gt_wildcards("*.gff.gz")
+			tf.write(self.construct_stage_cmd('gt_gff3', [org], "GT_RETAINIDS=yes " + self.gtbin + " gff3 -sort -tidy -force -retainids -o " +
+				org + ".gff3.gz -gzip " + search_path + " 2> " + org + ".tidylog", ["*.gff.gz"], [org + ".gff3.gz"]) + failed)
+
+			# allow access to pathdev members
+			tf.write("chmod -R 775 .\n")
+			# move result to separate directory
+			tf.write("cp " + org + ".gff3.gz " + self.finalresultpath + "\n")
+			tf.write("cp " + org + ".tidylog " + self.finalresultpath + "\n")
+			tf.write("cd $WORKING_DIRECTORY\n")
+
+		# The result must have been written since this run started exporting the organism,
+		# or its later steps are not recorded as done
+		if not has_reached(state, MERGED):
+			tf.write("if [[ -s \"" + resultfile + "\" && \"" + resultfile + "\" -nt \"" + self.export_marker_file(org) + "\" ]]; then\n")
+			tf.write("   " + self.construct_manifest_cmd([org], MERGED) + "\n")
+			tf.write("else\n")
+			tf.write("   echo \"ERROR: No result was exported for " + org + "\" 1>&2\n")
+			tf.write("   ORG_STATUS=1\n")
+			tf.write("   JOB_ERROR_STATUS=1\n")
+			tf.write("fi\n")
+
+		if self.apolloexport or has_reached(state, DERIVED):
+			pass
+
+		elif self.productsmethod == 'native':
+			# write annotation, genome, protein and cDNA files in one pass
+			tf.write(self.construct_stage_cmd('derived', [org], self.construct_derived_files_cmd(org), [resultfile],
+			         [self.finalresultpath + "/" + org + "." + product + ".gz" for product in ['noseq.gff3', 'genome.fasta', 'prot.fasta', 'cdna.fasta']]) + failed)
+			tf.write("chmod -R 777 " + self.finalresultpath + " \n")
+
+		else:
+			# split sequences and annotations
+			orgfile = self.finalresultpath + "/" + org
+			tf.write(self.construct_stage_cmd('inlineseq_split', [org], "GT_RETAINIDS=yes " + self.gtbin + " inlineseq_split -seqfile "+ orgfile + ".genome.fasta -gff3file " + orgfile + ".noseq.gff3 " + resultfile,
+			         [resultfile], [orgfile + ".genome.fasta", orgfile + ".noseq.gff3"]) + failed)
+			# gzip everything
+			tf.write(self.construct_stage_cmd('gzip', [org], self.construct_gzip_cmd() + " " + orgfile + ".genome.fasta", [orgfile + ".genome.fasta"], [orgfile + ".genome.fasta.gz"]) + failed)
+			tf.write(self.construct_stage_cmd('gzip', [org], self.construct_gzip_cmd() + " " + orgfile + ".noseq.gff3", [orgfile + ".noseq.gff3"], [orgfile + ".noseq.gff3.gz"]) + failed)
+			# prepare cDNA and protein sequences
+			tf.write(self.construct_stage_cmd('extractfeat_cds', [org], "GT_RETAINIDS=yes " + self.gtbin + " extractfeat -type CDS -join -translate -retainids -seqfile "+ orgfile + ".genome.fasta.gz -matchdescstart -force -o " + orgfile + ".prot.fasta.gz -gzip " + orgfile + ".noseq.gff3.gz",
+			         [orgfile + ".genome.fasta.gz", orgfile + ".noseq.gff3.gz"], [orgfile + ".prot.fasta.gz"]) + failed)
+			tf.write(self.construct_stage_cmd('extractfeat_mrna', [org], "GT_RETAINIDS=yes " + self.gtbin + " extractfeat -type mRNA -retainids -seqfile "+ orgfile + ".genome.fasta.gz -matchdescstart -force -o " + orgfile + ".cdna.fasta.gz -gzip " + orgfile + ".noseq.gff3.gz",
+			         [orgfile + ".genome.fasta.gz", orgfile + ".noseq.gff3.gz"], [orgfile + ".cdna.fasta.gz"]) + failed)
+			# clean up indices
+			tf.write("rm -f " + self.finalresultpath + "/" + org + ".genome.fasta.gz.* \n")
+			tf.write("chmod -R 777 " + self.finalresultpath + " \n")
+
+		if not self.apolloexport and not has_reached(state, DERIVED):
+			tf.write(self.construct_manifest_update(org, DERIVED))
+
+		# Clean-up working writedbentry files to save disk space
+		if self.exportmethod == 'writedb':
+			tf.write("rm -rf \"" + orgpath + "\"\n")
+
+		#
+		# If this export is for Apollo then we must convert the gff file features to the correct parent-child relationship
+		# and copy to ftp site.
+		#
+		if self.apolloexport:
+
+			inputfile = self.finalresultpath + "/" + org + ".gff3.gz"
+			outputfile = self.apollogffpath + "/" + org + ".gff3.gz"
+
+			if not has_reached(state, CONVERTED):
+				tf.write(self.construct_apollo_converter_app_cmds(inputfile, outputfile, org) + "\n")
+				tf.write(self.construct_manifest_update(org, CONVERTED))
+
+			if self.copytoftpsiteflag:
+				tf.write("if [[ -s \"" + outputfile + "\" ]]; then\n")
+				tf.write("   cp " + outputfile + " " + self.ftptargetfolder + "/" + "\n")
+				tf.write("fi\n")
+
+		# Record the fingerprint of a successfully exported organism,
+		# i.e. one with a non-empty result written after the fingerprint was taken
+		if self.incremental:
+			tf.write("if [[ -s \"" + resultfile + "\" && \"" + resultfile + "\" -nt \"" + self.pending_fingerprint_file(org) + "\" && $ORG_STATUS -eq 0 ]]; then\n")
+			tf.write("   mv \"" + self.pending_fingerprint_file(org) + "\" \"" + FingerprintStore(self.fingerprintpath).fingerprint_file(org) + "\"\n")
+			tf.write("fi\n")
+
+		tf.write(self.construct_manifest_update(org, PUBLISHED))
+
+		tf.write("\n")
+
+	#
+	# Write the slice manifest of a worker job, <scriptpath>/<scriptname>.json,
+	# and return the command that runs the worker on it. With steps, the
+	# worker also writes the derived files of each organism and records
+	# its fingerprint and run state through to published. memory is the
+	# job's memory request, within which concurrent organisms must fit.
+	#
+	def construct_worker_cmd(self, scriptname, organisms, memory, steps=True):
+
+		manifestfile = self.scriptpath + "/" + scriptname + ".json"
+
+		manifest = { 'jobtitle': self.jobtitle,
+		             'configfile': self.configfile,
+		             'organisms': organisms,
+		             'outputdir': self.finalresultpath,
+		             'level': self.compressionlevel,
+		             'threads': self.jobcores,
+		             'bgzf': self.gffindex if self.bgzfoutput else None,
+		             'concurrency': min(self.workerconcurrency, self.jobcores) if self.workerconcurrency > 0 else self.jobcores,
+		             'memory_mb': memory,
+		             'cachedir': self.cachepath if len(self.cachepath) > 0 else None,
+		             'snapshot': self.snapshotid,
+		             'steps': steps,
+		             # An empty path stands for the job's $TMPDIR
+		             'scratch': self.scratchpath if self.scratchstaging else None,
+		             'runmanifest': self.runmanifestfile,
+		             'markers': dict((org, self.export_marker_file(org)) for org in organisms),
+		             'fingerprints': dict((org, (self.pending_fingerprint_file(org), FingerprintStore(self.fingerprintpath).fingerprint_file(org)))
+		                                  for org in organisms) if self.incremental else {},
+		             'stagemetrics': self.get_stage_metrics_file() if self.stagemetrics else None }
+
+		with open(manifestfile, "w") as f:
+			json.dump(manifest, f, indent=1)
+
+		return self.exporterpath + " worker --manifest " + manifestfile
+
+	#
+	# Shell commands run as a job starts exporting organisms: recording
+	# when it started, against which their results are checked, and
+	# their new state in the run manifest.
+	#
+	def construct_export_start_cmds(self, organisms):
+
+		cmds = ""
+		for org in organisms:
+			cmds = cmds + "touch \"" + self.export_marker_file(org) + "\"\n"
+
+		return cmds + self.construct_manifest_cmd(organisms, EXPORTING) + "\n"
+
+	#
+	# Where the time an organism started to be exported is recorded.
+	#
+	def export_marker_file(self, org):
+
+		return self.statuspath + "/" + org + ".exporting"
+
+	#
+	# Shell command recording the state of organisms in the run manifest.
+	#
+	def construct_manifest_cmd(self, organisms, state):
+
+		return self.runmanifestpath + " -m " + self.runmanifestfile + " -s " + state + " " + " ".join(organisms)
+
+	#
+	# Shell commands recording the state of an organism in the
+	# run manifest, if its steps have had no errors so far.
+	#
+	def construct_manifest_update(self, org, state):
+
+		return "if [[ $ORG_STATUS -eq 0 ]]; then " + self.construct_manifest_cmd([org], state) + "; fi\n"
+
+	#
+	# Construct the shell command that exports a slice of organisms
+	# from Chado to GFF, using either writedb_entry or the native writer.
+	#
+	def construct_export_cmd(self, organisms):
+
+		if self.exportmethod == 'native':
+			# The native writer produces the final sorted <org>.gff3.gz directly
+			cmd = self.nativewriterpath + " -i " + self.configfile
+			for org in organisms:
+				cmd = cmd + " -o " + org
+			cmd = cmd + " -x " + self.finalresultpath + self.construct_compression_args() + self.construct_cache_args() + self.construct_snapshot_args()
+		else:
+			cmd = "writedb_entries.py -v -w "+ self.writedbentrypath + " "
+			for org in organisms:
+				cmd = cmd + " -o " + org + " "
+			cmd = cmd + " -x " + self.targetpath + " -d " + self.configfile + " -f 3000"
+
+		return cmd
+
+	#
+	# Construct the shell command that exports one shard of an organism
+	# with the native writer, into <resultbasepath>/<org>/.
+	#
+	def construct_shard_export_cmd(self, org, shard, shardcount):
+
+		return self.nativewriterpath + " -i " + self.configfile + " -o " + org + \
+			" -x " + self.resultbasepath + "/" + org + self.construct_compression_args(False) + \
+			" -s " + str(shard) + " -n " + str(shardcount) + self.construct_cache_args() + self.construct_snapshot_args()
+
+	#
+	# Native writer arguments attaching to the exported database snapshot, if there is one.
+	#
+	def construct_snapshot_args(self):
+
+		if self.snapshotid is not None:
+			return " -S " + self.snapshotid
+
+		return ""
+
+	#
+	# Native writer arguments for the bulk extraction cache, if one is set.
+	#
+	def construct_cache_args(self):
+
+		if len(self.cachepath) > 0:
+			return " -c " + self.cachepath
+
+		return ""
+
+	#
+	# Construct the shell commands that stitch the shards of an organism
+	# together into <org>.gff3.gz, provided that every shard was exported.
+	#
+	def construct_stitch_cmds(self, org, shardfiles):
+
+		cmds = ""
+		for shardfile in shardfiles:
+			cmds = cmds + "if [[ ! -s \"" + shardfile + "\" ]]; then echo \"ERROR: Missing export shard " + shardfile + "\" 1>&2; JOB_ERROR_STATUS=1; fi\n"
+
+		cmds = cmds + "if [[ $JOB_ERROR_STATUS -eq 0 ]]; then\n"
+		cmds = cmds + "   " + self.construct_stage_cmd('stitch', [org], self.construct_merge_cmd(org), shardfiles, [self.finalresultpath + "/" + org + ".gff3.gz"]) + "\n"
+		cmds = cmds + "fi\n"
+		cmds = cmds + "rm -rf \"" + self.resultbasepath + "/" + org + "\"\n"
+
+		return cmds
+
+	#
+	# Construct the shell command that merges the writedb_entry output (or
+	# export shards) of an organism into <org>.gff3.gz with gff3_merge.py,
+	# in place of flattening the output tree and running gt gff3 -sort -tidy.
+	#
+	def construct_merge_cmd(self, org):
+
+		return self.gffmergepath + self.construct_compression_args() + " -o " + self.finalresultpath + "/" + org + ".gff3.gz " + \
+			self.resultbasepath + "/" + org + " 2> " + self.finalresultpath + "/" + org + ".tidylog"
+
+	#
+	# Construct the shell command that writes the noseq GFF, genome,
+	# protein and cDNA files of an organism with gff3_derived.py.
+	#
+	def construct_derived_files_cmd(self, org):
+
+		return self.gffderivedpath + self.construct_compression_args() + " " + self.finalresultpath + "/" + org + ".gff3.gz"
+
+	#
+	# Compression arguments for the native writer, merge and derived file
+	# tools, so that they compress with all of the cores reserved for a job.
+	# Final files are written as BGZF with their indexes if so configured;
+	# export shards, which are merged and removed, never are.
+	#
+	def construct_compression_args(self, final=True):
+
+		args = " -t " + str(self.jobcores) + " -l " + str(self.compressionlevel)
+
+		if final and self.bgzfoutput:
+			args = args + " -b " + self.gffindex
+
+		return args
+
+	#
+	# The command that gzips a file in place in the gt pipeline.
+	#
+	def construct_gzip_cmd(self):
+
+		if len(self.pigzpath) > 0:
+			return self.pigzpath + " -p " + str(self.jobcores) + " -" + str(self.compressionlevel) + " -f"
 
+		return "gzip -f"
 
 	#
 	# Create a job that runs upon completion of the export jobs.
 	# It checks successful completion and emails a report.
 	#
-	def run_checker_job(self, donefiles, errorlogs):
+	def run_checker_job(self, executor, donefiles, errorlogs):
 
 		if len(donefiles) == 0:
 			return
@@ -749,11 +2307,7 @@ class ChadoGffExporter:
 		cf.close()
 		os.chmod(checkerjobscript, 0o775)
 
-		cmd = self.construct_checker_job_invoker_cmd(checkerjobscript, checkerjobname)
-
-		if self.run_jobs_flag:
-			print("starting chado export completion checker job")
-			self.run_bash(cmd)
+		executor.submit_checker(checkerjobscript, checkerjobname)
 
 
 # ================= Local utility methods ======================
@@ -812,15 +2366,20 @@ class ChadoGffExporter:
 	# invoke the Apollo gff polypeptide converter program.
 	# The program can accept gzipped or non-gzip input.
 	#
-	def construct_apollo_converter_app_cmds(self, inputfile, outputfile):
+	def construct_apollo_converter_app_cmds(self, inputfile, outputfile, org=None):
 
 		cmd = "if [[ -s \"" + inputfile + "\" ]]; then\n"
 		cmd = cmd + "	set -o pipefail\n"
-		cmd = cmd + "	gzip -d -c " + inputfile + " | " + self.apolloconverterapp + " " + self.apolloconverterappargs + " | gzip > " + outputfile + "\n"
+		pipeline = "gzip -d -c " + inputfile + " | " + self.apolloconverterapp + " " + self.apolloconverterappargs + " | gzip > " + outputfile
+		if self.stagemetrics:
+			# The stage runs in a shell of its own
+			pipeline = self.construct_stage_cmd('apollo_convert', [org] if org else [], "set -o pipefail; " + pipeline, [inputfile], [outputfile])
+		cmd = cmd + "	" + pipeline + "\n"
 		cmd = cmd + "	status=$?\n"
 		cmd = cmd + "	if [[ $status -ne 0 ]]; then\n"
 		cmd = cmd + "		echo \"ERROR: " + self.apolloconverterapp + " processing failed with status $status.\" 1>&2\n"
 		cmd = cmd + "		rm -f " + outputfile + "\n"
+		cmd = cmd + "		ORG_STATUS=1\n"
 		cmd = cmd + "		JOB_ERROR_STATUS=1\n"
 		cmd = cmd + "	fi\n"
 		cmd = cmd + "else\n"
@@ -829,6 +2388,24 @@ class ChadoGffExporter:
 
 		return cmd
 
+	#
+	# Utility method to create the LSF job command string
+	# for an export job script, with its memory request in MB.
+	#
+	def construct_job_invoker_cmd(self, scriptname, jobid, memory):
+
+		executor = LsfExecutor(self.queue, self.logpath, self.jobtitle)
+
+		return executor.job_cmd(self.create_job_spec(scriptname, jobid, memory))
+
+	#
+	# Describe the job that runs a generated export script.
+	#
+	def create_job_spec(self, scriptname, jobid, memory):
+
+		return JobSpec(jobid, str(self.scriptpath) + "/" + str(scriptname), memory, self.jobcores,
+		               self.logpath + "/" + scriptname + ".o", self.logpath + "/" + scriptname + ".e")
+
 	#
 	# Utility method to create the completion checker LSF job command string.
 	# To be run when all export jobs have finished.
@@ -836,16 +2413,9 @@ class ChadoGffExporter:
 	#
 	def construct_checker_job_invoker_cmd(self, jobscriptpath, name):
 
-		condition = "ended(" + self.jobtitle + "*)"
-
-		cmd = "source /etc/bashrc; bsub -J " + name + " -q " + self.queue + \
-		         " -R 'select[mem>3500] rusage[mem=3500] span[hosts=1]' -M 3500 " + \
-		          "-o " + self.logpath + "/" + name  + ".o " + \
-		          "-e " + self.logpath + "/" + name + ".e " + \
-		          "-w \'" + condition + "' " + \
-		          str(jobscriptpath)
+		executor = LsfExecutor(self.queue, self.logpath, self.jobtitle)
 
-		return cmd
+		return executor.checker_cmd(jobscriptpath, name)
 
 	#
 	# Utility method to write the completion checker job
@@ -862,6 +2432,14 @@ class ChadoGffExporter:
 		for errorlog in errorlogs:
 			outstream.write("if [[ -s " + errorlog + " ]]; then MAILMSG=${MAILMSG}'ERROR: Errors detected in log file: " + errorlog + "\\n'; fi\n")
 
+		# Report the jobs that were retried, and why, in either case
+		if self.maxattempts > 1:
+			outstream.write("RETRIES=\n")
+			outstream.write("if [[ -s " + self.get_retry_log_file() + " ]]; then RETRIES=\"\\nRetried jobs:\\n$(cat " + self.get_retry_log_file() + ")\"; fi\n")
+			outstream.write( "if [[ \"$MAILMSG\" == \"\" ]]; then echo -e \"Organism data has been exported to gff files.$RETRIES\" | mailx -s 'Chado export job [" + self.jobtitle + "] completed successfully' " + self.reportemailaddress + "; fi\n" )
+			outstream.write( "if [[ \"$MAILMSG\" != \"\" ]]; then echo -e \"$MAILMSG$RETRIES\" | mailx -s 'Chado export job [" + self.jobtitle + "] has errors - investigation required' " + self.reportemailaddress + "; fi\n" )
+			return
+
 		outstream.write( "if [[ \"$MAILMSG\" == \"\" ]]; then echo \"Organism data has been exported to gff files.\" | mailx -s 'Chado export job [" + self.jobtitle + "] completed successfully' " + self.reportemailaddress + "; fi\n" )
 		outstream.write( "if [[ \"$MAILMSG\" != \"\" ]]; then echo -e $MAILMSG | mailx -s 'Chado export job [" + self.jobtitle + "] has errors - investigation required' " + self.reportemailaddress + "; fi\n" )
 
@@ -869,5 +2447,8 @@ class ChadoGffExporter:
 # ================= Run it =====================================
 
 if __name__ == '__main__':
+	# The worker subcommand runs one slice job, see chado_export_worker.py
+	if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+		sys.exit(chado_export_worker.main([sys.argv[0] + " worker"] + sys.argv[2:]))
 	exporter = ChadoGffExporter(sys.argv)
 	exporter.run()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+import sys
+import gzip
+import argparse
+import concurrent.futures
+
+from parallel_gzip import DEFAULT_COMPRESSION_LEVEL, rename_output, remove_output
+from bgzf_index import open_gff_writer, open_fasta_writer, GFF_INDEX_FORMATS
+
+
+#
+# Single pass generation of the derived export files from <org>.gff3.gz,
+# replacing gt inlineseq_split, two gzip runs and two gt extractfeat runs:
+#
+#   <org>.noseq.gff3.gz    annotation without the ##FASTA section
+#   <org>.genome.fasta.gz  the ##FASTA section
+#   <org>.prot.fasta.gz    joined CDS of each transcript, translated
+#   <org>.cdna.fasta.gz    the span of each mRNA
+#
+# Feature coordinates are collected while the annotation is copied, then
+# the sequences are extracted as each FASTA record is read, so only one
+# sequence is held in memory at a time and no sequence index is built.
+#
+# With -b, the files are written as BGZF, the noseq GFF3 with a tabix
+# index and the FASTA files with faidx and gzi indexes, each built as
+# the file is written.
+#
+
+FASTA_LINE_WIDTH = 60
+CDNA_TYPE = 'mRNA'
+CDS_TYPE = 'CDS'
+OUTPUT_SUFFIXES = ('.noseq.gff3.gz', '.genome.fasta.gz', '.prot.fasta.gz', '.cdna.fasta.gz')
+
+COMPLEMENT = str.maketrans('ACGTUMRWSYKVHDBNacgtumrwsykvhdbn', 'TGCAAKYWSRMBDHVNtgcaakywsrmbdhvn')
+
+BASES = 'TCAG'
+AMINO_ACIDS = 'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG'
+
+# Standard genetic code (translation table 1)
+CODON_TABLE = dict((a + b + c, AMINO_ACIDS[16 * i + 4 * j + k])
+                   for (i, a) in enumerate(BASES)
+                   for (j, b) in enumerate(BASES)
+                   for (k, c) in enumerate(BASES))
+
+
+#
+# Reverse complement a nucleotide sequence.
+#
+def reverse_complement(sequence):
+	return sequence.translate(COMPLEMENT)[::-1]
+
+
+#
+# Translate a coding sequence. Codons containing ambiguous
+# bases become X and an incomplete final codon is dropped.
+#
+def translate(sequence):
+
+	sequence = sequence.upper().replace('U', 'T')
+
+	return ''.join(CODON_TABLE.get(sequence[i:i + 3], 'X') for i in range(0, len(sequence) - 2, 3))
+
+
+#
+# Write a FASTA record with fixed width sequence lines.
+#
+def write_fasta(outstream, name, sequence):
+
+	outstream.write(">" + name + "\n")
+	for i in range(0, len(sequence), FASTA_LINE_WIDTH):
+		outstream.write(sequence[i:i + FASTA_LINE_WIDTH] + "\n")
+
+
+#
+# Parse a GFF3 attribute column into a dictionary of name -> raw value.
+#
+def parse_attributes(column):
+
+	attributes = {}
+	for pair in column.split(';'):
+		if '=' in pair:
+			(key, value) = pair.split('=', 1)
+			attributes[key.strip()] = value
+
+	return attributes
+
+
+#
+# Collects the transcripts and coding segments of each sequence
+# from the annotation, for extraction once the sequence is read.
+#
+class SequenceFeatures:
+
+	def __init__(self):
+		# seqid -> [(ID, start, end, strand)] in file order
+		self.mrnas = {}
+		# seqid -> transcript ID -> [(start, end, strand, phase)]
+		self.cds = {}
+		# seqid -> transcript IDs in order of their first CDS
+		self.cds_order = {}
+
+	def add(self, cols):
+
+		if cols[2] == CDNA_TYPE:
+			attributes = parse_attributes(cols[8])
+			if 'ID' in attributes:
+				self.mrnas.setdefault(cols[0], []).append((attributes['ID'], int(cols[3]), int(cols[4]), cols[6]))
+
+		elif cols[2] == CDS_TYPE:
+			attributes = parse_attributes(cols[8])
+			parents = attributes.get('Parent', attributes.get('Derives_from'))
+			if parents is None:
+				return
+			phase = int(cols[7]) if cols[7].isdigit() else 0
+			segments = self.cds.setdefault(cols[0], {})
+			for parent in parents.split(','):
+				if parent not in segments:
+					segments[parent] = []
+					self.cds_order.setdefault(cols[0], []).append(parent)
+				segments[parent].append((int(cols[3]), int(cols[4]), cols[6], phase))
+
+	#
+	# The (ID, cDNA) records of the mRNAs on a sequence.
+	#
+	def cdna_records(self, seqid, sequence):
+
+		for (name, start, end, strand) in self.mrnas.pop(seqid, []):
+			cdna = sequence[start - 1:end]
+			yield (name, reverse_complement(cdna) if strand == '-' else cdna)
+
+	#
+	# The (transcript ID, protein) records of the coding transcripts on a sequence.
+	# Segments are joined in transcription order and the phase of the
+	# first one gives the offset of the first complete codon.
+	#
+	def protein_records(self, seqid, sequence):
+
+		segments = self.cds.pop(seqid, {})
+
+		for name in self.cds_order.pop(seqid, []):
+			parts = sorted(segments[name])
+			if parts[0][2] == '-':
+				parts.reverse()
+				cds = ''.join(reverse_complement(sequence[start - 1:end]) for (start, end, strand, phase) in parts)
+			else:
+				cds = ''.join(sequence[start - 1:end] for (start, end, strand, phase) in parts)
+
+			yield (name, translate(cds[parts[0][3]:]))
+
+
+#
+# Write the derived files for one GFF3 file with an embedded ##FASTA section.
+# Outputs are written under temporary names and renamed once all are complete.
+# All four are compressed on one shared pool of threads, as BGZF
+# with their indexes if bgzf, the tabix index format, is given.
+# Returns the number of (sequences, proteins, cDNAs) written.
+#
+def write_derived_files(inputfile, prefix, level=DEFAULT_COMPRESSION_LEVEL, threads=1, bgzf=None):
+
+	outputs = [prefix + suffix for suffix in OUTPUT_SUFFIXES]
+	partfiles = [output + ".part" for output in outputs]
+	features = SequenceFeatures()
+	counts = [0, 0, 0]
+
+	pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, threads))
+
+	try:
+		with gzip.open(inputfile, "rt") as gff, \
+			 open_gff_writer(partfiles[0], level, threads, pool, bgzf) as noseq, \
+			 open_fasta_writer(partfiles[1], level, threads, pool, bgzf) as genome, \
+			 open_fasta_writer(partfiles[2], level, threads, pool, bgzf) as prot, \
+			 open_fasta_writer(partfiles[3], level, threads, pool, bgzf) as cdna:
+
+			# Annotation
+			for line in gff:
+				if line.startswith('##FASTA'):
+					break
+				noseq.write(line)
+				if not line.startswith('#'):
+					cols = line.rstrip('\n').split('\t')
+					if len(cols) == 9:
+						features.add(cols)
+
+			# Sequences, extracting from each one as it completes
+			seqid = None
+			chunks = []
+			for line in gff:
+				if line.startswith('>'):
+					if seqid is not None:
+						counts = write_sequence_products(features, seqid, ''.join(chunks), prot, cdna, counts)
+					seqid = (line[1:].split(None, 1) + [''])[0]
+					chunks = []
+				elif seqid is not None:
+					chunks.append(line.strip())
+				genome.write(line)
+
+			if seqid is not None:
+				counts = write_sequence_products(features, seqid, ''.join(chunks), prot, cdna, counts)
+
+		for (partfile, output) in zip(partfiles, outputs):
+			rename_output(partfile, output)
+	finally:
+		pool.shutdown()
+		for partfile in partfiles:
+			remove_output(partfile)
+
+	return tuple(counts)
+
+
+#
+# Write the protein and cDNA records of one sequence.
+# Returns the updated (sequences, proteins, cDNAs) counts.
+#
+def write_sequence_products(features, seqid, sequence, prot, cdna, counts):
+
+	(sequences, proteins, cdnas) = counts
+
+	for (name, protein) in features.protein_records(seqid, sequence):
+		write_fasta(prot, name, protein)
+		proteins = proteins + 1
+
+	for (name, transcript) in features.cdna_records(seqid, sequence):
+		write_fasta(cdna, name, transcript)
+		cdnas = cdnas + 1
+
+	return [sequences + 1, proteins, cdnas]
+
+
+#
+# Command line entry point.
+#
+def main(prog_args):
+
+	parser = argparse.ArgumentParser(prog=prog_args[0], description='Write the noseq GFF3, genome, protein and cDNA FASTA files for a gff3.gz file with embedded sequences.')
+	parser.add_argument('-o', help='Output file prefix (default: the input file name without .gff3.gz)', required=False, dest='prefix')
+	parser.add_argument('-t', help='Compression threads (default: 1)', required=False, type=int, default=1, dest='threads')
+	parser.add_argument('-l', help='Compression level (default: %d)' % DEFAULT_COMPRESSION_LEVEL, required=False, type=int, default=DEFAULT_COMPRESSION_LEVEL, dest='level')
+	parser.add_argument('-b', help='Write BGZF with indexes, with a tabix index of this format for the GFF3 (default: plain gzip)', required=False, choices=GFF_INDEX_FORMATS, dest='bgzf')
+	parser.add_argument('inputfile', help='Input gff3.gz file')
+
+	args = parser.parse_args(prog_args[1:])
+
+	prefix = args.prefix
+	if prefix is None:
+		prefix = args.inputfile[:-len('.gff3.gz')] if args.inputfile.endswith('.gff3.gz') else args.inputfile
+
+	try:
+		write_derived_files(args.inputfile, prefix, args.level, args.threads, args.bgzf)
+	except Exception as err:
+		print("ERROR: Cannot write derived files for %s: %s" % (args.inputfile, str(err)), file=sys.stderr)
+		return 1
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
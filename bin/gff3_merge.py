@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import gzip
+import heapq
+import codecs
+import argparse
+import tempfile
+
+from parallel_gzip import DEFAULT_COMPRESSION_LEVEL, rename_output, remove_output
+from bgzf_index import open_gff_writer, GFF_INDEX_FORMATS
+
+
+#
+# Streaming GFF3 merge, replacing gt gff3 -sort -tidy -retainids
+# for the sorted per-sequence GFF3 files written by writedb_entry.
+#
+# Feature blocks (a top-level feature followed by its children) are
+# k-way merged by (seqid, start, end) straight into one gzipped
+# GFF3 file. Input files are opened only when their first block is
+# due, so per-contig inputs are effectively concatenated in order
+# without exhausting file handles. IDs are never rewritten.
+#
+# Tidy fixes applied, reported on stderr:
+#   - one ##gff-version header and one ##sequence-region per seqid,
+#     widened to cover all of the pragmas seen for it
+#   - start and end swapped when start > end
+#   - missing CDS phase set to 0
+#   - 8-column feature lines given an empty attribute column,
+#     other malformed lines dropped
+#   - ### separators and comments dropped
+#   - one FASTA record per sequence, written after all features
+#     in sequence name order
+#
+
+GFF_VERSION_PRAGMA = "##gff-version 3"
+INPUT_SUFFIXES = ('.gff.gz', '.gff3.gz', '.gff', '.gff3')
+
+
+#
+# Open a GFF3 file for reading as text, gzipped or not.
+#
+def open_gff3(path):
+
+	with open(path, "rb") as f:
+		magic = f.read(2)
+
+	if magic == b'\x1f\x8b':
+		return gzip.open(path, "rt")
+
+	return open(path, "r")
+
+
+#
+# Expand input paths: directories are searched recursively for GFF3 files,
+# which removes the need to flatten the writedb_entry output tree first.
+#
+def find_input_files(paths):
+
+	files = []
+	for path in paths:
+		if os.path.isdir(path):
+			for root, dirs, names in os.walk(path):
+				dirs.sort()
+				for name in sorted(names):
+					if name.endswith(INPUT_SUFFIXES):
+						files.append(os.path.join(root, name))
+		else:
+			files.append(path)
+
+	return files
+
+
+#
+# Report a tidy fix or problem.
+#
+def warn(message):
+	print("warning: " + message, file=sys.stderr)
+
+
+#
+# Apply tidy fixes to a feature line.
+# Returns (seqid, start, end, is_child, line) or None if the line is unusable.
+#
+def tidy_feature_line(line, location):
+
+	cols = line.rstrip('\n').split('\t')
+
+	if len(cols) == 8:
+		warn("%s: feature line with 8 columns, adding empty attributes" % location)
+		cols.append('.')
+	elif len(cols) != 9:
+		warn("%s: dropping malformed line with %d columns" % (location, len(cols)))
+		return None
+
+	try:
+		start = int(cols[3])
+		end = int(cols[4])
+	except ValueError:
+		warn("%s: dropping line with invalid coordinates" % location)
+		return None
+
+	if start > end:
+		warn("%s: swapping start %d and end %d" % (location, start, end))
+		(start, end) = (end, start)
+		cols[3] = str(start)
+		cols[4] = str(end)
+
+	if cols[2] == 'CDS' and cols[7] == '.':
+		warn("%s: setting missing CDS phase to 0" % location)
+		cols[7] = '0'
+
+	attributes = cols[8]
+	is_child = attributes.startswith('Parent=') or ';Parent=' in attributes
+
+	return (cols[0], start, end, is_child, '\t'.join(cols) + '\n')
+
+
+#
+# A sorted GFF3 input file.
+#
+class Gff3InputFile:
+
+	def __init__(self, path):
+		self.path = path
+		self.pragmas = []
+		self.first_key = None
+
+	#
+	# Read the header pragmas and the sort key of the first feature,
+	# without keeping the file open.
+	#
+	def scan_header(self):
+
+		with open_gff3(self.path) as f:
+			for (n, line) in enumerate(f, 1):
+				if line.startswith('##FASTA') or line.startswith('>'):
+					return
+				if line.startswith('##'):
+					self.pragmas.append(line.rstrip('\n'))
+				elif line.startswith('#') or line.strip() == '':
+					continue
+				else:
+					feature = tidy_feature_line(line, "%s:%d" % (self.path, n))
+					if feature is not None:
+						self.first_key = feature[0:3]
+						return
+
+	#
+	# Generate ((seqid, start, end), lines) feature blocks in file order.
+	# When the ##FASTA section is reached its lines are passed to fasta_sink.
+	#
+	def blocks(self, fasta_sink):
+
+		key = None
+		lines = []
+
+		with open_gff3(self.path) as f:
+			for (n, line) in enumerate(f, 1):
+
+				if line.startswith('##FASTA') or line.startswith('>'):
+					if not line.startswith('##FASTA'):
+						fasta_sink.write(line)
+					for line in f:
+						fasta_sink.write(line)
+					break
+
+				if line.startswith('#') or line.strip() == '':
+					continue
+
+				feature = tidy_feature_line(line, "%s:%d" % (self.path, n))
+				if feature is None:
+					continue
+
+				(seqid, start, end, is_child, text) = feature
+
+				if is_child and len(lines) > 0:
+					lines.append(text)
+					continue
+
+				if len(lines) > 0:
+					yield (key, lines)
+
+				key = (seqid, start, end)
+				lines = [text]
+
+		if len(lines) > 0:
+			yield (key, lines)
+
+
+#
+# Collects the FASTA sections of all inputs in a temporary file,
+# keeping the first record seen for each sequence, and copies
+# them out in sequence name order.
+#
+class FastaSpill:
+
+	def __init__(self, tmpdir=None):
+		self.tmpfile = tempfile.TemporaryFile(mode="w+b", dir=tmpdir)
+		# seqid -> (offset, length) of its record in the temporary file
+		self.index = {}
+		self.seqid = None
+		self.keep = False
+		self.records = 0
+
+	def write(self, line):
+
+		if line.startswith('>'):
+			self.end_record()
+			seqid = line[1:].split(None, 1)[0] if len(line) > 2 else ''
+			self.keep = seqid not in self.index
+			if self.keep:
+				self.seqid = seqid
+				self.index[seqid] = (self.tmpfile.tell(), 0)
+				self.records = self.records + 1
+			else:
+				warn("dropping duplicate FASTA record for sequence %s" % seqid)
+
+		if self.keep and line.strip() != '':
+			self.tmpfile.write((line if line.endswith('\n') else line + '\n').encode('utf-8'))
+
+	#
+	# Record the length of the record being written, if any.
+	#
+	def end_record(self):
+
+		if self.seqid is not None:
+			offset = self.index[self.seqid][0]
+			self.index[self.seqid] = (offset, self.tmpfile.tell() - offset)
+			self.seqid = None
+
+	def copy_to(self, outstream):
+
+		self.end_record()
+
+		decoder = codecs.getincrementaldecoder('utf-8')()
+
+		for seqid in sorted(self.index):
+			(offset, length) = self.index[seqid]
+			self.tmpfile.seek(offset)
+			while length > 0:
+				chunk = self.tmpfile.read(min(length, 1048576))
+				length = length - len(chunk)
+				outstream.write(decoder.decode(chunk))
+
+	def close(self):
+		self.tmpfile.close()
+
+
+#
+# Parse a ##sequence-region pragma into (seqid, start, end), or None.
+#
+def parse_sequence_region(pragma):
+
+	parts = pragma.split()
+	if len(parts) != 4 or parts[0] != '##sequence-region':
+		return None
+
+	try:
+		return (parts[1], int(parts[2]), int(parts[3]))
+	except ValueError:
+		return None
+
+
+#
+# Merge sorted GFF3 files into one sorted GFF3 text stream.
+# Returns the number of feature lines written.
+#
+def merge_gff3_files(paths, outstream, tmpdir=None):
+
+	inputs = [Gff3InputFile(path) for path in paths]
+
+	regions = {}
+	pragmas = []
+	for gff in inputs:
+		gff.scan_header()
+		for pragma in gff.pragmas:
+			region = parse_sequence_region(pragma)
+			if region is not None:
+				(seqid, start, end) = region
+				if seqid in regions:
+					(start, end) = (min(start, regions[seqid][0]), max(end, regions[seqid][1]))
+				regions[seqid] = (start, end)
+			elif not pragma.startswith('##gff-version') and pragma != '###' and pragma not in pragmas:
+				pragmas.append(pragma)
+
+	outstream.write(GFF_VERSION_PRAGMA + "\n")
+	for seqid in sorted(regions):
+		(start, end) = regions[seqid]
+		outstream.write("##sequence-region   %s %d %d\n" % (seqid, start, end))
+	for pragma in pragmas:
+		outstream.write(pragma + "\n")
+
+	fasta = FastaSpill(tmpdir)
+	count = 0
+
+	try:
+		# Heap entries are (key, input index, block lines, block iterator).
+		# A file is only opened when its first block reaches the top of the heap.
+		heap = [(gff.first_key, i, None, None) for (i, gff) in enumerate(inputs) if gff.first_key is not None]
+		heapq.heapify(heap)
+		last_keys = {}
+
+		while len(heap) > 0:
+			(key, i, lines, it) = heapq.heappop(heap)
+
+			if lines is None:
+				it = inputs[i].blocks(fasta)
+				block = next(it, None)
+				if block is not None:
+					heapq.heappush(heap, (block[0], i, block[1], it))
+				continue
+
+			if i in last_keys and key[0:2] < last_keys[i][0:2]:
+				warn("%s: feature at %s:%d is out of order" % (inputs[i].path, key[0], key[1]))
+			last_keys[i] = key
+
+			outstream.writelines(lines)
+			count = count + len(lines)
+
+			block = next(it, None)
+			if block is not None:
+				heapq.heappush(heap, (block[0], i, block[1], it))
+
+		# Inputs without features may still carry sequences
+		for gff in inputs:
+			if gff.first_key is None:
+				for block in gff.blocks(fasta):
+					pass
+
+		if fasta.records > 0:
+			outstream.write("##FASTA\n")
+			fasta.copy_to(outstream)
+
+	finally:
+		fasta.close()
+
+	return count
+
+
+#
+# Merge into a gzipped output file, written under a temporary
+# name and renamed once complete. With bgzf, 'tbi' or 'csi',
+# the file is written as BGZF with that index.
+#
+def merge_to_file(paths, outfile, tmpdir=None, level=DEFAULT_COMPRESSION_LEVEL, threads=1, bgzf=None):
+
+	partfile = outfile + ".part"
+
+	try:
+		with open_gff_writer(partfile, level, threads, bgzf=bgzf) as out:
+			count = merge_gff3_files(paths, out, tmpdir)
+		rename_output(partfile, outfile)
+	finally:
+		remove_output(partfile)
+
+	return count
+
+
+#
+# Command line entry point.
+#
+def main(prog_args):
+
+	parser = argparse.ArgumentParser(prog=prog_args[0], description='Merge sorted GFF3 files (or directories of them) into one sorted, gzipped GFF3 file.')
+	parser.add_argument('-o', help='Output gff3.gz file', required=True, dest='outfile')
+	parser.add_argument('-t', help='Compression threads (default: 1)', required=False, type=int, default=1, dest='threads')
+	parser.add_argument('-l', help='Compression level (default: %d)' % DEFAULT_COMPRESSION_LEVEL, required=False, type=int, default=DEFAULT_COMPRESSION_LEVEL, dest='level')
+	parser.add_argument('-b', help='Write BGZF with a tabix index of this format (default: plain gzip)', required=False, choices=GFF_INDEX_FORMATS, dest='bgzf')
+	parser.add_argument('inputs', help='Input GFF3 files or directories', nargs='+')
+
+	args = parser.parse_args(prog_args[1:])
+
+	files = find_input_files(args.inputs)
+	if len(files) == 0:
+		print("ERROR: No GFF3 input files found", file=sys.stderr)
+		return 1
+
+	try:
+		merge_to_file(files, args.outfile, None, args.level, args.threads, args.bgzf)
+	except Exception as err:
+		print("ERROR: GFF3 merge failed: %s" % str(err), file=sys.stderr)
+		return 1
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+import os
+import zlib
+import struct
+import collections
+import concurrent.futures
+
+
+#
+# Block parallel gzip output.
+#
+# Text written to a ParallelGzipWriter is cut into blocks that are
+# compressed on a thread pool (zlib releases the GIL) and written out
+# in order, each as its own gzip member. Like pigz output, the result is
+# a standard multi-member gzip file readable by gzip, zcat and gt.
+#
+# A BgzfWriter writes BGZF instead, the blocked gzip of htslib (bgzip):
+# members of at most 64 KB of text, each recording its compressed size,
+# ended by an empty member. It is still read as one stream by gzip, but
+# a reader can also seek to the start of any member. An index of the
+# output (bgzf_index.py) is built from the lines as they are written and
+# saved beside it, so that tools such as tabix and samtools faidx can
+# seek straight to a locus without indexing the file themselves.
+#
+
+DEFAULT_COMPRESSION_LEVEL = 6
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# Text per BGZF block, as bgzip uses, leaving room for incompressible data in 64 KB
+BGZF_BLOCK_SIZE = 0xff00
+
+# The empty member that ends a BGZF file
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# Suffixes of the index files that are kept beside a BGZF file
+INDEX_SUFFIXES = ('.tbi', '.csi', '.fai', '.gzi')
+
+
+#
+# Compress a block of bytes into a complete gzip member.
+#
+def compress_member(data, level=DEFAULT_COMPRESSION_LEVEL):
+
+	compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+	return compressor.compress(data) + compressor.flush()
+
+
+#
+# Compress at most BGZF_BLOCK_SIZE bytes into a BGZF member: a gzip
+# member with a BC extra field holding the size of the member.
+#
+def compress_bgzf_block(data, level=DEFAULT_COMPRESSION_LEVEL):
+
+	compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+	deflated = compressor.compress(data) + compressor.flush()
+
+	# Header of 18 bytes, deflated data and a trailer of 8 bytes
+	header = struct.pack('<BBBBIBBHBBHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25)
+
+	return header + deflated + struct.pack('<II', zlib.crc32(data), len(data))
+
+
+#
+# Compress bytes into a complete BGZF file, as for an index file.
+#
+def compress_bgzf(data, level=DEFAULT_COMPRESSION_LEVEL):
+
+	blocks = [compress_bgzf_block(data[i:i + BGZF_BLOCK_SIZE], level) for i in range(0, len(data), BGZF_BLOCK_SIZE)]
+
+	return b''.join(blocks) + BGZF_EOF
+
+
+#
+# Rename a completed output file written under a temporary name, with any
+# index files written beside it. Index files left at the destination by an
+# earlier export are removed, so that no index is left that does not match.
+# The output is renamed last, once its indexes are in place.
+#
+def rename_output(partfile, outfile):
+
+	for suffix in INDEX_SUFFIXES:
+		if os.path.exists(partfile + suffix):
+			os.rename(partfile + suffix, outfile + suffix)
+		elif os.path.exists(outfile + suffix):
+			os.unlink(outfile + suffix)
+
+	os.rename(partfile, outfile)
+
+
+#
+# Remove an incomplete output file and any index files written beside it.
+#
+def remove_output(partfile):
+
+	for path in [partfile] + [partfile + suffix for suffix in INDEX_SUFFIXES]:
+		if os.path.exists(path):
+			os.unlink(path)
+
+
+#
+# Write-only text file object producing a multi-member gzip file.
+# A thread pool may be shared between several writers, in which case
+# it is left running when the writer is closed.
+#
+class ParallelGzipWriter:
+
+	def __init__(self, path, level=DEFAULT_COMPRESSION_LEVEL, threads=1, pool=None, blocksize=DEFAULT_BLOCK_SIZE, encoding='utf-8'):
+		self.level = level
+		self.blocksize = blocksize
+		self.encoding = encoding
+		self.own_pool = pool is None
+		self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, threads)) if pool is None else pool
+		# Bound the compressed blocks held in memory
+		self.max_pending = 2 * max(1, threads)
+		self.pending = collections.deque()
+		self.buffer = []
+		self.buffered = 0
+		self.members = 0
+		self.fileobj = open(path, "wb")
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def write(self, text):
+
+		self.buffer.append(text)
+		self.buffered = self.buffered + len(text)
+		if self.buffered >= self.blocksize:
+			self.flush_block()
+
+		return len(text)
+
+	def writelines(self, lines):
+
+		for line in lines:
+			self.write(line)
+
+	#
+	# Queue the buffered text for compression, writing out
+	# completed members once too many are pending.
+	#
+	def flush_block(self):
+
+		data = ''.join(self.buffer).encode(self.encoding)
+		self.buffer = []
+		self.buffered = 0
+
+		self.pending.append(self.pool.submit(compress_member, data, self.level))
+		self.members = self.members + 1
+
+		while len(self.pending) >= self.max_pending:
+			self.write_member(self.pending.popleft().result())
+
+	def write_member(self, member):
+
+		self.fileobj.write(member)
+
+	def close(self):
+
+		if self.fileobj is None:
+			return
+
+		try:
+			# An empty file still gets one (empty) member, to be valid gzip
+			if self.buffered > 0 or self.members == 0:
+				self.flush_block()
+			while len(self.pending) > 0:
+				self.write_member(self.pending.popleft().result())
+			self.finish()
+		finally:
+			if self.own_pool:
+				self.pool.shutdown()
+			self.fileobj.close()
+			self.fileobj = None
+
+	#
+	# Complete the file once every member has been written.
+	#
+	def finish(self):
+		pass
+
+
+#
+# Write-only text file object producing a BGZF file, compressed on a
+# thread pool as by ParallelGzipWriter. An index, if given, is passed
+# every line written, with its start and end offsets in the text, and
+# is saved beside the file once it is complete.
+#
+class BgzfWriter(ParallelGzipWriter):
+
+	def __init__(self, path, level=DEFAULT_COMPRESSION_LEVEL, threads=1, pool=None, index=None, encoding='utf-8'):
+		ParallelGzipWriter.__init__(self, path, level, threads, pool, BGZF_BLOCK_SIZE, encoding)
+		self.path = path
+		self.index = index
+		self.buffer = bytearray()
+		# Bytes of text written
+		self.position = 0
+		# The compressed offset of each block written out, and of the end of the file
+		self.block_offsets = []
+		self.compressed = 0
+		# The text of the line being written, so far, and its offset
+		self.line = b''
+		self.line_start = 0
+
+	def write(self, text):
+
+		data = text.encode(self.encoding)
+
+		if self.index is not None:
+			self.index_lines(data)
+
+		self.buffer += data
+		self.buffered = len(self.buffer)
+		self.position = self.position + len(data)
+		while self.buffered >= BGZF_BLOCK_SIZE:
+			self.flush_block()
+
+		return len(text)
+
+	#
+	# Pass each line completed by some text to the index.
+	#
+	def index_lines(self, data):
+
+		start = 0
+
+		while True:
+			end = data.find(b'\n', start)
+			if end < 0:
+				self.line = self.line + data[start:]
+				break
+			line_end = self.position + end + 1
+			self.index.add_line(self.line + data[start:end], self.line_start, line_end)
+			self.line = b''
+			self.line_start = line_end
+			start = end + 1
+
+	def flush_block(self):
+
+		data = bytes(self.buffer[:BGZF_BLOCK_SIZE])
+		del self.buffer[:BGZF_BLOCK_SIZE]
+		self.buffered = len(self.buffer)
+
+		self.pending.append(self.pool.submit(compress_bgzf_block, data, self.level))
+		self.members = self.members + 1
+
+		while len(self.pending) >= self.max_pending:
+			self.write_member(self.pending.popleft().result())
+
+	def write_member(self, member):
+
+		self.block_offsets.append(self.compressed)
+		self.compressed = self.compressed + len(member)
+		self.fileobj.write(member)
+
+	def finish(self):
+
+		self.block_offsets.append(self.compressed)
+		self.fileobj.write(BGZF_EOF)
+
+		if self.index is not None:
+			if len(self.line) > 0:
+				self.index.add_line(self.line, self.line_start, self.position)
+			self.index.save(self.path, self)
+
+	#
+	# The BGZF virtual offset of a text offset: the compressed offset of
+	# its block, shifted left 16 bits, plus its offset within the block.
+	# Every block but the last holds BGZF_BLOCK_SIZE bytes of text.
+	#
+	def virtual_offset(self, position):
+
+		(block, within) = divmod(position, BGZF_BLOCK_SIZE)
+
+		return (self.block_offsets[block] << 16) | within
+
+	#
+	# Write a gzi index, as bgzip -i does: the compressed
+	# and text offsets of each block after the first.
+	#
+	def save_gzi(self, path):
+
+		starts = [(self.block_offsets[i], i * BGZF_BLOCK_SIZE) for i in range(1, len(self.block_offsets) - 1)]
+
+		with open(path, "wb") as f:
+			f.write(struct.pack('<Q', len(starts)))
+			for (compressed, uncompressed) in starts:
+				f.write(struct.pack('<QQ', compressed, uncompressed))
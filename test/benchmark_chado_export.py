@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import configparser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from nose import SkipTest
+
+from chado_fixture import ChadoTestDatabase
+from chado_stage_metrics import read_metrics, summarise_metrics
+
+
+#
+# Benchmark of a full export from a synthetic Chado database.
+#
+# Loads synthetic organisms of a given size into a throwaway PostgreSQL
+# database (see chado_fixture.py), runs generate_gff_from_chado.py end
+# to end with the native methods on the local executor, with stage
+# metrics enabled, and reports each stage's throughput (features/s and
+# MB/s of output) and peak memory. Results are appended to a JSON lines
+# file and compared with the last result of the same benchmark there,
+# so that regressions between releases are visible.
+#
+# Usage: PYTHONPATH=bin CHADO_TEST_DSN=... test/benchmark_chado_export.py -p small
+#
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+DEFAULT_RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'chado_export.jsonl')
+
+# Stages that read features from Chado, whose throughput is given in features/s
+EXPORT_STAGES = ['export', 'export_shard']
+
+# Per cent slower, or larger, than the last result that counts as a regression
+DEFAULT_REGRESSION_PCT = 10.0
+
+# name -> (organisms, contigs per organism, genes per contig, exons per gene, props per gene)
+PROFILES = { 'tiny': (1, 2, 200, 2, 1),
+             'small': (4, 5, 2000, 3, 2),
+             'large': (2, 10, 20000, 4, 3) }
+
+
+#
+# Release or revision of the code being benchmarked.
+#
+def code_version():
+
+	try:
+		version = subprocess.run(['git', 'describe', '--tags', '--always', '--dirty'], cwd=BIN_DIR, stdout=subprocess.PIPE,
+		                         stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+	except OSError:
+		version = ''
+
+	return version if len(version) > 0 else 'unknown'
+
+
+#
+# Write an exporter configuration for the benchmark: the native export,
+# merge and derived file methods, run by the local executor with stage metrics.
+#
+def write_benchmark_config(database, path, target_path, workers):
+
+	database.write_config(path, target_path)
+
+	config = configparser.ConfigParser()
+	config.read(path)
+	# The native pipeline never runs gt, but the exporter requires an executable
+	config.set('General', 'genome_tools_bin', shutil.which('gt') or shutil.which('true'))
+	config.set('General', 'merge_method', 'native')
+	config.set('General', 'products_method', 'native')
+	config.set('Job', 'name', 'chadobench')
+	config.set('Job', 'executor', 'local')
+	config.set('Job', 'local_workers', str(workers))
+	config.set('Job', 'stage_metrics', 'True')
+
+	with open(path, "w") as f:
+		config.write(f)
+
+
+#
+# Per-stage results of a run from its metrics records.
+#
+def stage_results(records, features):
+
+	results = {}
+
+	for (stage, total) in summarise_metrics(records):
+		wall = total['wall_secs']
+		results[stage] = { 'runs': total['count'],
+		                   'failed': total['failed'],
+		                   'wall_secs': round(wall, 3),
+		                   'cpu_secs': round(total['cpu_secs'], 3),
+		                   'max_rss_mb': total['max_rss_mb'],
+		                   'mb_out': round(total['bytes_out'] / 1048576.0, 3),
+		                   'mb_per_sec': round(total['bytes_out'] / 1048576.0 / wall, 3) if wall > 0 else None }
+		if stage in EXPORT_STAGES:
+			results[stage]['features_per_sec'] = round(features / wall, 1) if wall > 0 else None
+
+	return results
+
+
+#
+# The last stored result of the same benchmark, or None.
+#
+def previous_result(path, benchmark):
+
+	previous = None
+
+	if os.path.exists(path):
+		with open(path, "r") as f:
+			for line in f:
+				try:
+					result = json.loads(line)
+				except ValueError:
+					continue
+				if result.get('benchmark') == benchmark:
+					previous = result
+
+	return previous
+
+
+#
+# Compare the stages of a result with a previous one. Returns
+# (stage, measure, previous, current, per cent change) for each stage
+# whose wall time or peak memory grew by more than threshold per cent.
+#
+def find_regressions(previous, current, threshold=DEFAULT_REGRESSION_PCT):
+
+	regressions = []
+
+	for (stage, stats) in sorted(current['stages'].items()):
+		before = previous['stages'].get(stage)
+		if before is None:
+			continue
+		for measure in ['wall_secs', 'max_rss_mb']:
+			if before[measure] and stats[measure] > before[measure] * (1 + threshold / 100.0):
+				regressions.append((stage, measure, before[measure], stats[measure], 100.0 * (stats[measure] - before[measure]) / before[measure]))
+
+	return regressions
+
+
+def print_result(result, previous, out=sys.stdout):
+
+	out.write("benchmark %s (%d features) at %s: %.1f secs\n" % (result['benchmark'], result['features'], result['version'], result['wall_secs']))
+	out.write("%-16s %6s %10s %10s %12s %9s %10s\n" % ('stage', 'runs', 'wall secs', 'cpu secs', 'features/s', 'MB/s', 'max MB'))
+
+	for (stage, stats) in sorted(result['stages'].items(), key=lambda item: item[1]['wall_secs'], reverse=True):
+		out.write("%-16s %6d %10.2f %10.2f %12s %9s %10d\n" % (stage, stats['runs'], stats['wall_secs'], stats['cpu_secs'],
+		          stats.get('features_per_sec', '-'), stats['mb_per_sec'], stats['max_rss_mb']))
+
+	if previous is not None:
+		out.write("compared with %s of %s\n" % (previous['version'], previous['finished']))
+
+
+#
+# Load the synthetic organisms, run the export and return the result.
+#
+def run_benchmark(name, organisms, contigs, genes, exons, props, workers=2, keep=False):
+
+	database = ChadoTestDatabase()
+	workdir = tempfile.mkdtemp(prefix='chado-export-bench-')
+
+	try:
+		database.start()
+
+		names = ["Bench%02d" % (i + 1) for i in range(organisms)]
+		features = 0
+		for (i, org) in enumerate(names):
+			features = features + database.create_synthetic_organism(org, contigs, genes, exons, seed=i + 1, props=props)
+
+		target_path = os.path.join(workdir, 'export')
+		os.makedirs(target_path)
+		configfile = os.path.join(workdir, 'benchmark.ini')
+		orglistfile = os.path.join(workdir, 'benchmark.orglist')
+		write_benchmark_config(database, configfile, target_path, workers)
+		with open(orglistfile, "w") as f:
+			f.write("\n".join(names) + "\n")
+
+		start_time = time.time()
+		subprocess.run([sys.executable, os.path.join(BIN_DIR, 'generate_gff_from_chado.py'), '-i', configfile, '-f', orglistfile],
+		               check=True, stdout=subprocess.DEVNULL)
+		wall_secs = time.time() - start_time
+
+		records = read_metrics(os.path.join(target_path, 'logs', 'chadobench.metrics.jsonl'))
+
+		return { 'benchmark': name,
+		         'parameters': { 'organisms': organisms, 'contigs': contigs, 'genes': genes, 'exons': exons, 'props': props, 'workers': workers },
+		         'version': code_version(),
+		         'finished': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		         'features': features,
+		         'wall_secs': round(wall_secs, 3),
+		         'stages': stage_results(records, features) }
+
+	finally:
+		database.stop()
+		if keep:
+			print("benchmark files kept in %s" % workdir)
+		else:
+			shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(prog_args):
+
+	parser = argparse.ArgumentParser(prog=prog_args[0], description='Benchmark a full Chado export from a synthetic database.')
+	parser.add_argument('-p', help='Size profile', required=False, choices=sorted(PROFILES), default='small', dest='profile')
+	parser.add_argument('-n', help='Number of organisms (overrides the profile)', required=False, type=int, dest='organisms')
+	parser.add_argument('-c', help='Contigs per organism (overrides the profile)', required=False, type=int, dest='contigs')
+	parser.add_argument('-g', help='Genes per contig (overrides the profile)', required=False, type=int, dest='genes')
+	parser.add_argument('-e', help='Exons per gene (overrides the profile)', required=False, type=int, dest='exons')
+	parser.add_argument('-P', help='Properties per gene (overrides the profile)', required=False, type=int, dest='props')
+	parser.add_argument('-w', help='Local job workers', required=False, type=int, default=2, dest='workers')
+	parser.add_argument('-r', help='Results file (JSON lines)', required=False, default=DEFAULT_RESULTS_FILE, dest='resultsfile')
+	parser.add_argument('-t', help='Per cent growth in stage time or memory reported as a regression', required=False,
+	                    type=float, default=DEFAULT_REGRESSION_PCT, dest='threshold')
+	parser.add_argument('-k', help='Keep the export files', required=False, action='store_true', dest='keep')
+
+	args = parser.parse_args(prog_args[1:])
+
+	sizes = list(PROFILES[args.profile])
+	for (i, value) in enumerate([args.organisms, args.contigs, args.genes, args.exons, args.props]):
+		if value is not None:
+			sizes[i] = value
+
+	# Results are only comparable between runs of the same sizes
+	name = args.profile if sizes == list(PROFILES[args.profile]) else "%dx%dx%dx%dx%d" % tuple(sizes)
+
+	try:
+		result = run_benchmark(name, *sizes, workers=args.workers, keep=args.keep)
+	except SkipTest as e:
+		print("Unable to run the benchmark: %s" % str(e))
+		return 2
+
+	previous = previous_result(args.resultsfile, name)
+	print_result(result, previous)
+
+	os.makedirs(os.path.dirname(os.path.abspath(args.resultsfile)), exist_ok=True)
+	with open(args.resultsfile, "a") as f:
+		f.write(json.dumps(result, sort_keys=True) + "\n")
+
+	regressions = find_regressions(previous, result, args.threshold) if previous is not None else []
+	for (stage, measure, before, after, change) in regressions:
+		print("REGRESSION: %s %s %s -> %s (%+.1f%%)" % (stage, measure, before, after, change))
+
+	return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import random
+import shutil
+import tempfile
+import itertools
+import subprocess
+import psycopg2
+
+from nose import SkipTest
+
+#
+# Throwaway PostgreSQL database loaded with a minimal Chado
+# schema (resources/chado_schema.sql) and synthetic organisms.
+#
+# Uses the server given by the CHADO_TEST_DSN environment variable
+# if set (e.g. "host=localhost port=5432 user=postgres"), otherwise
+# starts a private server with initdb/pg_ctl from the PATH.
+# Tests are skipped when neither is available.
+#
+# FOR UNIT TESTS ONLY.
+#
+class ChadoTestDatabase:
+
+	SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources', 'chado_schema.sql')
+
+	_database_ids = itertools.count(1)
+
+	def __init__(self):
+		self.tempdir = None
+		self.datadir = None
+		self.server_params = None
+		self.dbname = None
+
+	#
+	# Start (or attach to) a server and create a fresh Chado database.
+	#
+	def start(self):
+
+		dsn = os.environ.get('CHADO_TEST_DSN')
+
+		if dsn:
+			self.server_params = psycopg2.extensions.parse_dsn(dsn)
+		else:
+			self.start_private_server()
+
+		self.dbname = "chado_export_test_%d_%d" % (os.getpid(), next(ChadoTestDatabase._database_ids))
+
+		admin = self.connect_admin()
+		try:
+			admin.cursor().execute("create database " + self.dbname + ";")
+		finally:
+			admin.close()
+
+		conn = self.connect()
+		try:
+			with open(ChadoTestDatabase.SCHEMA_FILE, "r") as f:
+				conn.cursor().execute(f.read())
+			conn.commit()
+		finally:
+			conn.close()
+
+	#
+	# Start a private server listening on a unix socket in a temp directory.
+	#
+	def start_private_server(self):
+
+		initdb = shutil.which('initdb')
+		pg_ctl = shutil.which('pg_ctl')
+
+		if initdb is None or pg_ctl is None:
+			raise SkipTest("No PostgreSQL installation found; set CHADO_TEST_DSN to use an existing server")
+
+		if os.geteuid() == 0:
+			raise SkipTest("PostgreSQL cannot be started as root; set CHADO_TEST_DSN to use an existing server")
+
+		self.tempdir = tempfile.mkdtemp(prefix='chado-export-pg-')
+		self.datadir = os.path.join(self.tempdir, 'data')
+
+		subprocess.run([initdb, '-D', self.datadir, '-A', 'trust', '-U', 'postgres'],
+		               check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		subprocess.run([pg_ctl, '-D', self.datadir, '-w', '-l', os.path.join(self.tempdir, 'server.log'),
+		                '-o', "-p 5432 -k " + self.tempdir + " -c listen_addresses=''", 'start'],
+		               check=True, stdout=subprocess.DEVNULL)
+
+		self.server_params = { 'host': self.tempdir, 'port': '5432', 'user': 'postgres', 'dbname': 'postgres' }
+
+	#
+	# Drop the test database and stop any private server.
+	#
+	def stop(self):
+
+		if self.server_params is None:
+			return
+
+		try:
+			if self.dbname is not None:
+				admin = self.connect_admin()
+				try:
+					admin.cursor().execute("drop database if exists " + self.dbname + " with (force);")
+				finally:
+					admin.close()
+		finally:
+			if self.datadir is not None:
+				subprocess.run([shutil.which('pg_ctl'), '-D', self.datadir, '-m', 'immediate', 'stop'],
+				               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+			if self.tempdir is not None:
+				shutil.rmtree(self.tempdir, ignore_errors=True)
+
+			self.server_params = None
+
+	def connect_admin(self):
+
+		conn = psycopg2.connect(**self.server_params)
+		conn.autocommit = True
+		return conn
+
+	def connect(self):
+
+		params = dict(self.server_params)
+		params['dbname'] = self.dbname
+		return psycopg2.connect(**params)
+
+	#
+	# Write an exporter configuration file pointing at the test database.
+	#
+	def write_config(self, path, target_path='/tmp/chado-export'):
+
+		with open(path, "w") as f:
+			f.write("[General]\n")
+			f.write("target_path = " + target_path + "\n")
+			f.write("genome_tools_bin = gt\n")
+			f.write("write_db_entry_path = writedb_entry\n")
+			f.write("export_method = native\n\n")
+			f.write("[Job]\n")
+			f.write("slice_size = 10\n")
+			f.write("queue = normal\n\n")
+			f.write("[Connection]\n")
+			f.write("host = " + self.server_params.get('host', 'localhost') + "\n")
+			f.write("database = " + self.dbname + "\n")
+			f.write("user = " + self.server_params.get('user', 'postgres') + "\n")
+			f.write("password = " + self.server_params.get('password', '') + "\n")
+			f.write("port = " + self.server_params.get('port', '5432') + "\n")
+
+	#
+	# Load a synthetic organism: a number of contigs each carrying
+	# gene models of gene -> mRNA -> exons, plus a polypeptide
+	# with a product property and props - 1 notes.
+	# Returns the number of located features.
+	#
+	def create_synthetic_organism(self, common_name, contigs=1, genes=10, exons=2, contig_length=None, public=True, seed=1, props=1):
+
+		gene_spacing = 100 * exons
+		if contig_length is None:
+			contig_length = genes * gene_spacing + gene_spacing
+		rand = random.Random(seed)
+
+		conn = self.connect()
+		try:
+			cur = conn.cursor()
+
+			cur.execute("select name, cvterm_id from cvterm;")
+			cvterms = dict(cur.fetchall())
+
+			cur.execute("insert into organism (genus, species, common_name) values ('Synthetic', %s, %s) returning organism_id;", (common_name, common_name))
+			organism_id = cur.fetchone()[0]
+
+			if public:
+				cur.execute("insert into organismprop (organism_id, type_id, value) values (%s, %s, 'yes');", (organism_id, cvterms['genedb_public']))
+
+			features_per_gene = 3 + exons
+			total = contigs * (1 + genes * features_per_gene)
+			cur.execute("select nextval('feature_feature_id_seq');")
+			next_id = cur.fetchone()[0]
+			cur.execute("select setval('feature_feature_id_seq', %s);", (next_id + total,))
+
+			features = io.StringIO()
+			locs = io.StringIO()
+			properties = io.StringIO()
+			rels = io.StringIO()
+
+			for c in range(1, contigs + 1):
+				contig_id = next_id
+				next_id = next_id + 1
+				contig_name = "%s_%02d" % (common_name, c)
+				residues = ''.join(rand.choices('ACGT', k=contig_length))
+				features.write("%d\t%d\t%s\t%s\t%s\t%d\t%d\n" % (contig_id, organism_id, contig_name, contig_name, residues, contig_length, cvterms['contig']))
+				properties.write("%d\t%d\ttrue\t0\n" % (contig_id, cvterms['top_level_seq']))
+
+				for g in range(genes):
+					strand = 1 if g % 2 == 0 else -1
+					fmin = (g + 1) * gene_spacing
+					fmax = fmin + 100 * (exons - 1) + 50
+					gene_name = "%s_%06d" % (contig_name, g)
+
+					gene_id = next_id
+					mrna_id = next_id + 1
+					pep_id = next_id + 2
+					next_id = next_id + features_per_gene
+
+					for (fid, name, ftype) in [(gene_id, gene_name, 'gene'), (mrna_id, gene_name + '.1', 'mRNA'), (pep_id, gene_name + '.1:pep', 'polypeptide')]:
+						features.write("%d\t%d\t\\N\t%s\t\\N\t\\N\t%d\n" % (fid, organism_id, name, cvterms[ftype]))
+						locs.write("%d\t%d\t%d\t%d\t%d\n" % (fid, contig_id, fmin, fmax, strand))
+
+					rels.write("%d\t%d\t%d\n" % (mrna_id, gene_id, cvterms['part_of']))
+					rels.write("%d\t%d\t%d\n" % (pep_id, mrna_id, cvterms['derives_from']))
+					properties.write("%d\t%d\tsynthetic protein %d\t0\n" % (pep_id, cvterms['product'], g))
+					for p in range(1, props):
+						properties.write("%d\t%d\tsynthetic note %d of protein %d\t%d\n" % (pep_id, cvterms['note'], p, g, p))
+
+					for e in range(exons):
+						exon_id = pep_id + 1 + e
+						features.write("%d\t%d\t\\N\t%s.1:exon:%d\t\\N\t\\N\t%d\n" % (exon_id, organism_id, gene_name, e + 1, cvterms['exon']))
+						locs.write("%d\t%d\t%d\t%d\t%d\n" % (exon_id, contig_id, fmin + 100 * e, fmin + 100 * e + 50, strand))
+						rels.write("%d\t%d\t%d\n" % (exon_id, mrna_id, cvterms['part_of']))
+
+			for (buf, table, columns) in [(features, 'feature', ('feature_id', 'organism_id', 'name', 'uniquename', 'residues', 'seqlen', 'type_id')),
+			                              (locs, 'featureloc', ('feature_id', 'srcfeature_id', 'fmin', 'fmax', 'strand')),
+			                              (properties, 'featureprop', ('feature_id', 'type_id', 'value', 'rank')),
+			                              (rels, 'feature_relationship', ('subject_id', 'object_id', 'type_id'))]:
+				buf.seek(0)
+				cur.copy_from(buf, table, columns=columns)
+
+			cur.execute("analyze;")
+			conn.commit()
+
+		finally:
+			conn.close()
+
+		return contigs * genes * features_per_gene
@@ -0,0 +1,123 @@
+--
+-- Minimal subset of the Chado schema used by the exporter.
+-- FOR UNIT TESTS ONLY.
+--
+
+create table db (
+	db_id serial primary key,
+	name varchar(255) not null unique
+);
+
+create table dbxref (
+	dbxref_id serial primary key,
+	db_id integer not null references db (db_id),
+	accession varchar(255) not null,
+	version varchar(255) not null default '',
+	unique (db_id, accession, version)
+);
+
+create table cv (
+	cv_id serial primary key,
+	name varchar(255) not null unique
+);
+
+create table cvterm (
+	cvterm_id serial primary key,
+	cv_id integer not null references cv (cv_id),
+	name varchar(1024) not null,
+	unique (cv_id, name)
+);
+
+create table organism (
+	organism_id serial primary key,
+	abbreviation varchar(255),
+	genus varchar(255) not null,
+	species varchar(255) not null,
+	common_name varchar(255)
+);
+
+create table organismprop (
+	organismprop_id serial primary key,
+	organism_id integer not null references organism (organism_id),
+	type_id integer not null references cvterm (cvterm_id),
+	value text,
+	rank integer not null default 0
+);
+
+create table feature (
+	feature_id serial primary key,
+	dbxref_id integer references dbxref (dbxref_id),
+	organism_id integer not null references organism (organism_id),
+	name varchar(255),
+	uniquename text not null,
+	residues text,
+	seqlen integer,
+	type_id integer not null references cvterm (cvterm_id),
+	is_analysis boolean not null default false,
+	is_obsolete boolean not null default false,
+	timeaccessioned timestamp not null default current_timestamp,
+	timelastmodified timestamp not null default current_timestamp
+);
+
+create index feature_idx1 on feature (organism_id);
+
+create table featureloc (
+	featureloc_id serial primary key,
+	feature_id integer not null references feature (feature_id),
+	srcfeature_id integer references feature (feature_id),
+	fmin integer,
+	fmax integer,
+	strand smallint,
+	phase integer,
+	locgroup integer not null default 0,
+	rank integer not null default 0
+);
+
+create index featureloc_idx1 on featureloc (srcfeature_id, fmin);
+create index featureloc_idx2 on featureloc (feature_id);
+
+create table featureprop (
+	featureprop_id serial primary key,
+	feature_id integer not null references feature (feature_id),
+	type_id integer not null references cvterm (cvterm_id),
+	value text,
+	rank integer not null default 0
+);
+
+create index featureprop_idx1 on featureprop (feature_id);
+
+create table feature_relationship (
+	feature_relationship_id serial primary key,
+	subject_id integer not null references feature (feature_id),
+	object_id integer not null references feature (feature_id),
+	type_id integer not null references cvterm (cvterm_id),
+	rank integer not null default 0
+);
+
+create index feature_relationship_idx1 on feature_relationship (subject_id);
+
+create table feature_dbxref (
+	feature_dbxref_id serial primary key,
+	feature_id integer not null references feature (feature_id),
+	dbxref_id integer not null references dbxref (dbxref_id),
+	is_current boolean not null default true
+);
+
+create index feature_dbxref_idx1 on feature_dbxref (feature_id);
+
+--
+-- Controlled vocabulary terms used by the exporter.
+--
+
+insert into cv (name) values ('sequence'), ('genedb_misc'), ('relationship'), ('feature_property');
+
+insert into cvterm (cv_id, name)
+	select cv.cv_id, t.name
+	from (values ('sequence', 'chromosome'), ('sequence', 'contig'), ('sequence', 'gene'), ('sequence', 'mRNA'),
+	             ('sequence', 'exon'), ('sequence', 'polypeptide'),
+	             ('genedb_misc', 'top_level_seq'), ('genedb_misc', 'genedb_public'),
+	             ('relationship', 'part_of'), ('relationship', 'derives_from'),
+	             ('feature_property', 'product'), ('feature_property', 'note')) as t (cv, name)
+	join cv on cv.name = t.cv;
+
+insert into db (name) values ('GeneDB');
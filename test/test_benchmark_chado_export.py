@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import json
+import shutil
+import tempfile
+
+from benchmark_chado_export import *
+
+#
+# Tests for the export benchmark harness. The end to end
+# run needs a PostgreSQL server, see chado_fixture.py.
+#
+class TestBenchmarkChadoExport:
+
+	def setup(self):
+		self.workdir = tempfile.mkdtemp()
+
+	def teardown(self):
+		shutil.rmtree(self.workdir)
+
+	def result(self, version, export_wall, derived_rss):
+		return { 'benchmark': 'tiny', 'version': version, 'finished': '2026-10-18T10:00:00', 'features': 2000, 'wall_secs': 1.0,
+				 'stages': { 'export': { 'runs': 1, 'wall_secs': export_wall, 'cpu_secs': 0.5, 'max_rss_mb': 30, 'mb_per_sec': 1.0, 'features_per_sec': 2000 / export_wall },
+							 'derived': { 'runs': 1, 'wall_secs': 0.2, 'cpu_secs': 0.2, 'max_rss_mb': derived_rss, 'mb_per_sec': 2.0 } } }
+
+	def test_01_stage_results(self):
+
+		# Given
+		records = [{ 'stage': 'export', 'organisms': ['Bench01'], 'exit_code': 0, 'wall_secs': 2.0, 'user_secs': 1.5, 'sys_secs': 0.5,
+					 'max_rss_mb': 40, 'bytes_in': 0, 'bytes_out': 1048576 },
+				   { 'stage': 'derived', 'organisms': ['Bench01'], 'exit_code': 0, 'wall_secs': 0.5, 'user_secs': 0.4, 'sys_secs': 0.1,
+					 'max_rss_mb': 20, 'bytes_in': 1048576, 'bytes_out': 2097152 }]
+
+		# When
+		results = stage_results(records, 10000)
+
+		# Then - features/s for the stages that read Chado, MB/s of output for all
+		assert results['export'] == { 'runs': 1, 'failed': 0, 'wall_secs': 2.0, 'cpu_secs': 2.0, 'max_rss_mb': 40,
+									  'mb_out': 1.0, 'mb_per_sec': 0.5, 'features_per_sec': 5000.0 }
+		assert results['derived']['mb_per_sec'] == 4.0
+		assert 'features_per_sec' not in results['derived']
+
+	def test_02_regressions(self):
+
+		# Given
+		resultsfile = os.path.join(self.workdir, 'results.jsonl')
+		with open(resultsfile, "w") as f:
+			f.write(json.dumps(self.result('v1.1.6', 1.0, 20)) + "\n")
+			f.write(json.dumps(dict(self.result('v1.1.6', 5.0, 20), benchmark='small')) + "\n")
+			f.write(json.dumps(self.result('v1.1.7', 1.0, 25)) + "\n")
+
+		# When
+		previous = previous_result(resultsfile, 'tiny')
+		regressions = find_regressions(previous, self.result('v1.1.8', 1.05, 40), 10.0)
+
+		# Then - the last result of the same benchmark is compared with
+		assert previous['version'] == 'v1.1.7'
+		assert regressions == [('derived', 'max_rss_mb', 25, 40, 60.0)]
+		assert previous_result(os.path.join(self.workdir, 'none.jsonl'), 'tiny') is None
+
+	def test_03_benchmark(self):
+
+		# Given
+		resultsfile = os.path.join(self.workdir, 'results.jsonl')
+
+		# When - a run failing to start the database is skipped
+		status = main(['benchmark_chado_export.py', '-p', 'tiny', '-c', '1', '-g', '50', '-r', resultsfile])
+		if status == 2:
+			raise SkipTest("No PostgreSQL server for the benchmark")
+
+		# Then - the result is stored under the name of its sizes
+		assert status == 0
+		with open(resultsfile) as f:
+			result = json.loads(f.readline())
+		assert result['benchmark'] == '1x1x50x2x1'
+		assert result['features'] == 250
+		assert result['stages']['export']['failed'] == 0
+		assert result['stages']['export']['features_per_sec'] > 0
+		assert result['stages']['derived']['max_rss_mb'] > 0
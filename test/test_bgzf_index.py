@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import os
+import gzip
+import struct
+import shutil
+import tempfile
+import subprocess
+
+from parallel_gzip import BgzfWriter
+from bgzf_index import *
+
+#
+# Unit tests for the tabix and faidx indexes of BGZF output.
+#
+class TestBgzfIndex:
+
+	def setup(self):
+		self.tmpdir = tempfile.mkdtemp()
+
+	def teardown(self):
+		shutil.rmtree(self.tmpdir)
+
+	#
+	# Sorted GFF3 with enough features on each sequence to fill several blocks.
+	#
+	@staticmethod
+	def gff_lines(sequences=('c1', 'c2'), features=3000):
+
+		lines = ["##gff-version 3\n"]
+		for seqid in sequences:
+			for i in range(features):
+				start = 1 + 100 * i
+				lines.append("%s\tchado\tgene\t%d\t%d\t.\t+\t.\tID=%s.g%d\n" % (seqid, start, start + 150 + (i % 7) * 10000, seqid, i))
+
+		return lines
+
+	#
+	# The text at a BGZF virtual offset of a file.
+	#
+	@staticmethod
+	def read_at(path, voffset, size=40):
+
+		with open(path, "rb") as f:
+			f.seek(voffset >> 16)
+			text = gzip.decompress(f.read())
+
+		return text[voffset & 0xffff:(voffset & 0xffff) + size]
+
+	#
+	# The sequence names and the (bins, linear index) of each sequence of a tbi index.
+	#
+	@staticmethod
+	def read_tbi(path):
+
+		with open(path, "rb") as f:
+			data = gzip.decompress(f.read())
+
+		assert data[:4] == b'TBI\1'
+		(n_ref, fmt, col_seq, col_beg, col_end, meta, skip, l_nm) = struct.unpack_from('<8i', data, 4)
+		assert (fmt, col_seq, col_beg, col_end, meta, skip) == TABIX_GFF_CONF
+		names = data[36:36 + l_nm].split(b'\0')[:-1]
+		offset = 36 + l_nm
+		sequences = []
+
+		for i in range(n_ref):
+			bins = {}
+			(n_bin,) = struct.unpack_from('<i', data, offset)
+			offset = offset + 4
+			for j in range(n_bin):
+				(bin, n_chunk) = struct.unpack_from('<Ii', data, offset)
+				bins[bin] = [struct.unpack_from('<QQ', data, offset + 8 + 16 * k) for k in range(n_chunk)]
+				offset = offset + 8 + 16 * n_chunk
+			(n_intv,) = struct.unpack_from('<i', data, offset)
+			sequences.append((bins, struct.unpack_from('<%dQ' % n_intv, data, offset + 4)))
+			offset = offset + 4 + 8 * n_intv
+
+		return ([name.decode('utf-8') for name in names], sequences)
+
+	def test_01_region_bin(self):
+
+		# Given/When/Then - as reg2bin in the SAM specification
+		assert region_bin(0, 1) == 4681
+		assert region_bin(16384, 16385) == 4682
+		assert region_bin(16000, 17000) == 585
+		assert region_bin(0, 1 << 29) == 0
+		assert region_bin(0, 1, depth=CSI_DEPTH) == 37449
+		assert bin_first_window(4682, TBI_DEPTH) == 1
+		assert bin_first_window(586, TBI_DEPTH) == 8
+		assert bin_first_window(0, TBI_DEPTH) == 0
+
+	def test_02_tabix_index(self):
+
+		# Given
+		path = os.path.join(self.tmpdir, 'Pf.gff3.gz')
+		lines = self.gff_lines()
+
+		# When - written with an embedded sequence, which is not indexed
+		with BgzfWriter(path, 1, 2, index=TabixIndex()) as out:
+			out.writelines(lines)
+			out.write("##FASTA\n>c1\nACGT\n")
+
+		# Then - every chunk and linear index entry points at a feature of its sequence
+		assert out.members > 2
+		(names, sequences) = self.read_tbi(path + ".tbi")
+		assert names == ['c1', 'c2']
+		for (name, (bins, linear)) in zip(names, sequences):
+			# Up to the end of the furthest feature, at 359751
+			assert len(linear) == 359751 // 16384 + 1
+			for chunks in bins.values():
+				for (start, end) in chunks:
+					assert self.read_at(path, start).startswith((name + "\t").encode('utf-8'))
+			for voffset in linear:
+				assert self.read_at(path, voffset).startswith((name + "\t").encode('utf-8'))
+
+		# The first feature is found through the first leaf bin
+		assert self.read_at(path, sequences[0][0][4681][0][0], 100).startswith(lines[1].encode('utf-8'))
+
+		if shutil.which('tabix') is not None:
+			region = subprocess.check_output(['tabix', path, 'c2:1001-1100']).decode('utf-8')
+			assert region == ''.join(line for line in lines[1:] if line.startswith("c2\t") and int(line.split("\t")[3]) <= 1100 and int(line.split("\t")[4]) >= 1001)
+
+	def test_03_csi_index(self):
+
+		# Given
+		path = os.path.join(self.tmpdir, 'Pf.gff3.gz')
+
+		# When
+		with BgzfWriter(path, 1, 1, index=TabixIndex(True)) as out:
+			out.writelines(self.gff_lines(['c1'], 100))
+			out.write("c1\tchado\tgene\t800000000\t800000100\t.\t+\t.\tID=long\n")
+
+		# Then - a feature beyond the reach of a tbi index is indexed
+		with open(path + ".csi", "rb") as f:
+			data = gzip.decompress(f.read())
+		assert data[:4] == b'CSI\1'
+		assert struct.unpack_from('<iii', data, 4)[:2] == (TABIX_MIN_SHIFT, CSI_DEPTH)
+		assert not os.path.exists(path + ".tbi")
+
+	def test_04_unindexable_features(self):
+
+		# Given
+		cases = [([b"c1\tchado\tgene\t800000000\t800000100\t.\t+\t.\tID=long"], '512 Mb'),
+		         ([b"c1\tchado\tgene\t500\t600\t.\t+\t.\tID=g2", b"c1\tchado\tgene\t100\t200\t.\t+\t.\tID=g1"], 'not sorted'),
+		         ([b"c1\tchado\tgene\t100\t200\t.\t+\t.\tID=g1", b"c2\tchado\tgene\t100\t200\t.\t+\t.\tID=g2",
+		           b"c1\tchado\tgene\t300\t400\t.\t+\t.\tID=g3"], 'not together')]
+
+		for (lines, message) in cases:
+			index = TabixIndex()
+
+			# When/Then
+			try:
+				for (i, line) in enumerate(lines):
+					index.add_line(line, 60 * i, 60 * (i + 1))
+				assert False, "Expected an exception for " + message
+			except ValueError as err:
+				assert message in str(err)
+
+	def test_05_fasta_index(self):
+
+		# Given
+		path = os.path.join(self.tmpdir, 'Pf.genome.fasta.gz')
+		sequences = [('c1', 'ACGT' * 40000), ('c2 plasmid', 'TTGA' * 15), ('c3', 'A')]
+
+		# When
+		with BgzfWriter(path, 1, 2, index=FastaIndex()) as out:
+			for (name, sequence) in sequences:
+				out.write(">" + name + "\n")
+				for i in range(0, len(sequence), 60):
+					out.write(sequence[i:i + 60] + "\n")
+
+		# Then - the records of samtools faidx, and a gzi entry for each block after the first
+		with open(path + ".fai", "r") as f:
+			records = [line.rstrip('\n').split('\t') for line in f]
+		assert records == [['c1', '160000', '4', '60', '61'],
+		                   ['c2', '60', str(4 + 160000 + 2667 + 12), '60', '61'],
+		                   ['c3', '1', str(4 + 160000 + 2667 + 12 + 61 + 4), '1', '2']]
+		with gzip.open(path, "rb") as f:
+			f.seek(int(records[1][2]))
+			assert f.read(10) == b'TTGATTGATT'
+
+		with open(path + ".gzi", "rb") as f:
+			data = f.read()
+		(count,) = struct.unpack_from('<Q', data)
+		assert count == out.members - 1
+		assert len(data) == 8 + 16 * count
+		assert struct.unpack_from('<QQ', data, 8) == (out.block_offsets[1], 0xff00)
+
+		if shutil.which('samtools') is not None:
+			assert subprocess.check_output(['samtools', 'faidx', path, 'c2:5-8']).decode('utf-8') == ">c2:5-8\nTTGA\n"
+
+	def test_06_fasta_uneven_lines(self):
+
+		# Given
+		index = FastaIndex()
+		index.add_line(b">c1", 0, 4)
+		index.add_line(b"ACGT", 4, 9)
+		index.add_line(b"AC", 9, 12)
+
+		# When/Then
+		try:
+			index.add_line(b"ACGT", 12, 17)
+			assert False, "Expected an exception for a line after a short line"
+		except ValueError as err:
+			assert 'c1' in str(err)
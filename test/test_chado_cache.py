@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from chado_cache import *
+
+#
+# Unit tests for the bulk extraction cache.
+# Extraction from Chado itself is tested in test_chado_db.py.
+#
+class TestChadoCache:
+
+	def setup(self):
+		self.tmpdir = tempfile.mkdtemp()
+
+	def teardown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def test_01_cache_file_name(self):
+
+		# Given/When/Then
+		assert cache_file_name('Pfalciparum') == 'Pfalciparum.cache.sqlite'
+		assert cache_file_name('Pfalciparum', 2, 3) == 'Pfalciparum.shard2.cache.sqlite'
+
+	def test_02_copy_field(self):
+
+		# Given/When/Then
+		assert copy_field('\\N') is None
+		assert copy_field('plain') == 'plain'
+		assert copy_field('a\\tb\\\\N\\nc') == 'a\tb\\N\nc'
+
+	def test_03_copy_table_sink(self):
+
+		# Given
+		cache = sqlite3.connect(':memory:')
+		cache.execute("create table featureprop (srcfeature_id integer, fmin integer, fmax integer, feature_id integer, type text, value text)")
+		sink = CopyTableSink(cache, 'featureprop', 6)
+
+		# When - rows arrive split at arbitrary points, multi-byte characters included
+		data = "1\t10\t20\t5\tproduct\tkinase\\, putative\n1\t10\t20\t5\tnote\t\\N\n1\t30\t40\t6\tcomment\tcafé\n".encode('utf-8')
+		for i in range(0, len(data), 7):
+			sink.write(data[i:i + 7])
+		sink.flush()
+
+		# Then - values are typed by the column affinity
+		assert sink.count == 3
+		assert cache.execute("select * from featureprop order by rowid").fetchall() == \
+				[(1, 10, 20, 5, 'product', 'kinase, putative'), (1, 10, 20, 5, 'note', None), (1, 30, 40, 6, 'comment', 'café')]
+
+	def test_04_cached_feature_source(self):
+
+		# Given - a cache with rows stored out of name order
+		cachefile = os.path.join(self.tmpdir, cache_file_name('Pfalciparum'))
+		cache = sqlite3.connect(cachefile)
+		for statement in CACHE_SCHEMA:
+			cache.execute(statement)
+		cache.execute("insert into organism values (7, 'Pfalciparum')")
+		cache.execute("insert into sequence values (11, 'Pf3D7_02', 8, 'chromosome')")
+		cache.execute("insert into sequence values (10, 'Pf3D7_01', 8, 'chromosome')")
+		cache.execute("insert into feature values (10, 21, 'gene_b', null, 'gene', 0, 8, 1, null)")
+		cache.execute("insert into feature values (10, 20, 'gene_a', 'A', 'gene', 0, 8, -1, null)")
+		cache.execute("insert into residues values (10, 5, 'TTTT')")
+		cache.execute("insert into residues values (10, 1, 'ACGT')")
+		cache.commit()
+		cache.close()
+
+		# When
+		source = CachedFeatureSource(cachefile)
+
+		try:
+			# Then - rows come back in the order they were copied, chunks in sequence order
+			assert source.get_organism_id('Pfalciparum') == 7
+			assert source.get_organism_id('Missing') is None
+			assert [row[1] for row in source.get_top_level_sequences(7)] == ['Pf3D7_02', 'Pf3D7_01']
+			assert [row[1] for row in source.get_features(10)] == ['gene_b', 'gene_a']
+			assert list(source.get_features(11)) == []
+			assert ''.join(source.get_residues(10)) == 'ACGTTTTT'
+		finally:
+			source.close()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import subprocess
+import configparser
+import psycopg2
+import io
+import gzip
+import shutil
+import tempfile
+
+from chado_db import *
+from chado_job_planner import query_organism_sizes
+from chado_fingerprint import query_organism_fingerprints
+from chado_gff_writer import export_organism
+from gff3_merge import merge_gff3_files, find_input_files
+from generate_gff_from_chado import ChadoGffExporter
+from nose import SkipTest
+
+from chado_fixture import ChadoTestDatabase
+
+#
+# Child process used to measure the peak RSS growth of a native
+# export of one organism, independent of the test process itself.
+#
+MEMORY_PROBE = """
+import sys, configparser
+from chado_db import open_connection
+from chado_gff_writer import ChadoGffWriter, ChadoFeatureSource
+
+# Peak RSS in KB. ru_maxrss is inherited from the parent process, VmHWM is not.
+def peak_rss():
+	with open('/proc/self/status') as f:
+		for line in f:
+			if line.startswith('VmHWM:'):
+				return int(line.split()[1])
+
+class NullStream:
+	def write(self, text):
+		pass
+
+config = configparser.ConfigParser()
+config.read(sys.argv[1])
+conn = open_connection(config)
+before = peak_rss()
+writer = ChadoGffWriter(ChadoFeatureSource(conn, 500), NullStream())
+writer.write_organism(sys.argv[2])
+after = peak_rss()
+print("%d %d" % (writer.feature_count, after - before))
+"""
+
+#
+# Tests for the server-side cursor query layer.
+# These need a PostgreSQL server, see chado_fixture.py.
+#
+class TestChadoDb:
+
+	database = None
+	configfile = None
+
+	@classmethod
+	def setup_class(cls):
+		cls.database = ChadoTestDatabase()
+		cls.database.start()
+		cls.database.create_synthetic_organism('Small', contigs=1, genes=2000)
+		cls.database.create_synthetic_organism('Large', contigs=1, genes=40000)
+		cls.database.create_synthetic_organism('Contigs', contigs=5, genes=20, public=False)
+		cls.configfile = tempfile.NamedTemporaryFile(suffix='.ini', delete=False).name
+		cls.database.write_config(cls.configfile)
+
+	@classmethod
+	def teardown_class(cls):
+		if cls.configfile is not None:
+			os.unlink(cls.configfile)
+		if cls.database is not None:
+			cls.database.stop()
+
+	def read_config(self):
+		config = configparser.ConfigParser()
+		config.read(TestChadoDb.configfile)
+		return config
+
+	def measure_export(self, organism):
+		if not os.path.exists('/proc/self/status'):
+			raise SkipTest("Peak RSS measurement needs /proc")
+		output = subprocess.check_output([sys.executable, '-c', MEMORY_PROBE, TestChadoDb.configfile, organism],
+		                                 env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+		(features, rss_growth) = output.decode().split()
+		return (int(features), int(rss_growth))
+
+	def test_01_get_itersize(self):
+
+		# Given
+		config = self.read_config()
+
+		# When/Then
+		assert get_itersize(config) == DEFAULT_ITERSIZE
+
+		config.set('Connection', 'itersize', '250')
+		assert get_itersize(config) == 250
+
+	def test_02_iter_query(self):
+
+		# Given
+		conn = open_connection(self.read_config())
+
+		try:
+			# When
+			rows = list(iter_query(conn, "select uniquename from feature where organism_id = " +
+			                             "(select organism_id from organism where common_name = %s) order by feature_id;", ('Small',), 100))
+
+			# Then
+			assert len(rows) == 1 + 2000 * 5
+			assert rows[0][0] == 'Small_01'
+			assert conn.readonly == True
+			assert conn.autocommit == False
+
+		finally:
+			conn.close()
+
+	def test_03_iter_query_early_exit_closes_cursor(self):
+
+		# Given
+		conn = open_connection(self.read_config())
+
+		try:
+			# When
+			rows = iter_query(conn, "select feature_id from feature;", None, 10)
+			first = next(rows)
+			rows.close()
+
+			# Then - no server-side cursors should be left open
+			cur = conn.cursor()
+			cur.execute("select count(*) from pg_cursors;")
+			assert first is not None
+			assert cur.fetchone()[0] == 0
+
+		finally:
+			conn.close()
+
+	def test_04_export_memory_is_flat(self):
+
+		# Given - two organisms, the second twenty times the size of the first
+
+		# When
+		(small_features, small_growth) = self.measure_export('Small')
+		(large_features, large_growth) = self.measure_export('Large')
+
+		# Then - peak RSS (KB) must not grow with the genome size
+		print("small: %d features, %d KB; large: %d features, %d KB" % (small_features, small_growth, large_features, large_growth))
+		assert small_features == 1 + 2000 * 5
+		assert large_features == 1 + 40000 * 5
+		assert large_growth - small_growth < 16 * 1024
+
+	def test_05_get_organism_list_all(self):
+
+		# Given
+		TestChadoDb.database.create_synthetic_organism('Private', genes=1, public=False)
+		exporter = ChadoGffExporter(['program_name'])
+		exporter.read_program_arguments(['program_name', '-a', '-i', TestChadoDb.configfile])
+		exporter.read_configuration()
+
+		# When
+		slices = list(exporter.get_organism_list(1))
+
+		# Then - all public organisms, one per slice
+		assert slices == [['Large'], ['Small']]
+
+	def test_06_query_organism_sizes(self):
+
+		# Given
+		conn = open_connection(self.read_config())
+
+		try:
+			# When
+			sizes = query_organism_sizes(conn, ['Small', 'Large', 'Missing'])
+
+			# Then - contig plus five features per gene, and the contig length
+			assert sizes == { 'Small': (1 + 2000 * 5, 2001 * 200), 'Large': (1 + 40000 * 5, 40001 * 200) }
+
+		finally:
+			conn.close()
+
+	def test_07_query_organism_fingerprints(self):
+
+		# Given
+		conn = open_connection(self.read_config())
+		dbconn = TestChadoDb.database.connect()
+
+		try:
+			before = query_organism_fingerprints(conn, ['Small', 'Large'])
+			conn.rollback()
+
+			# When - a feature of one organism is edited
+			cur = dbconn.cursor()
+			cur.execute("update feature set timelastmodified = now() + interval '1 day' where uniquename = 'Small_01_000001';")
+			dbconn.commit()
+			after = query_organism_fingerprints(conn, ['Small', 'Large'])
+
+			# Then
+			assert before['Small']['features'] == 1 + 2000 * 5
+			assert before['Small'] != after['Small']
+			assert before['Large'] == after['Large']
+
+		finally:
+			dbconn.close()
+			conn.close()
+
+	def test_08_sharded_export_matches_whole(self):
+
+		# Given
+		conn = open_connection(self.read_config())
+		wholedir = tempfile.mkdtemp()
+		sharddir = tempfile.mkdtemp()
+
+		try:
+			# When - exported whole and as three shards stitched together
+			count = export_organism(conn, 'Contigs', wholedir)
+			shardcounts = [export_organism(conn, 'Contigs', sharddir, shard=shard, shard_count=3) for shard in (1, 2, 3)]
+
+			whole = io.StringIO()
+			merge_gff3_files(find_input_files([wholedir]), whole)
+			stitched = io.StringIO()
+			merge_gff3_files(find_input_files([sharddir]), stitched)
+
+			# Then
+			assert sorted(os.listdir(sharddir)) == ['Contigs.shard1.gff3.gz', 'Contigs.shard2.gff3.gz', 'Contigs.shard3.gff3.gz']
+			assert sum(shardcounts) == count
+			assert min(shardcounts) > 0
+			assert stitched.getvalue() == whole.getvalue()
+
+		finally:
+			conn.close()
+			shutil.rmtree(wholedir)
+			shutil.rmtree(sharddir)
+
+	def test_09_connection_pool_reuses_connections(self):
+
+		# Given
+		pool = ChadoConnectionPool(self.read_config(), 1)
+
+		try:
+			# When - a connection is checked out twice, the first time left mid-transaction
+			with pool.connection() as conn:
+				list(iter_query(conn, "select organism_id from organism;"))
+				first_pid = conn.get_backend_pid()
+			with pool.connection() as conn:
+				second_pid = conn.get_backend_pid()
+				status = conn.info.transaction_status
+				readonly = conn.readonly
+
+			# Then - the same session, in a fresh read-only transaction
+			assert first_pid == second_pid
+			assert status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+			assert readonly == True
+
+		finally:
+			pool.close()
+
+	def test_10_query_prepared(self):
+
+		# Given
+		config = self.read_config()
+		conn = open_connection(config)
+		sql = "select organism_id from organism where common_name = %s;"
+
+		try:
+			# When - run prepared twice across transactions, and unprepared
+			first = query_prepared(conn, "test_organism_id", sql, ('Small',))
+			conn.rollback()
+			second = query_prepared(conn, "test_organism_id", sql, ('Large',))
+			unprepared = query_prepared(conn, "test_organism_id_plain", sql, ('Small',), False)
+
+			cur = conn.cursor()
+			cur.execute("select name from pg_prepared_statements;")
+			names = [row[0] for row in cur.fetchall()]
+
+			# Then
+			assert len(first) == 1 and len(second) == 1 and first != second
+			assert unprepared == first
+			assert names == ['test_organism_id']
+			assert get_prepared_statements(config) == True
+			config.set('Connection', 'prepared_statements', 'False')
+			assert get_prepared_statements(config) == False
+
+		finally:
+			conn.close()
+
+	def test_11_exporter_stages_share_a_connection(self):
+
+		# Given
+		exporter = ChadoGffExporter(['program_name'])
+		exporter.read_program_arguments(['program_name', '-a', '-i', TestChadoDb.configfile])
+		exporter.read_configuration()
+		pids = []
+
+		try:
+			# When - stages query one after the other
+			for stage in range(2):
+				exporter.open_database_connection()
+				pids.append(exporter.conn.get_backend_pid())
+				exporter.close_database_connection()
+				list(exporter.get_organism_list(1))
+
+			# Then
+			assert pids[0] == pids[1]
+			assert exporter.conn is None
+
+		finally:
+			exporter.close_connection_pool()
+
+	def test_12_cached_export_matches_direct(self):
+
+		# Given
+		conn = open_connection(self.read_config())
+		directdir = tempfile.mkdtemp()
+		cacheddir = tempfile.mkdtemp()
+		cachedir = tempfile.mkdtemp()
+
+		try:
+			# When - exported straight from Chado and through the bulk copy cache, whole and as a shard
+			counts = [export_organism(conn, 'Contigs', directdir), export_organism(conn, 'Contigs', directdir, shard=2, shard_count=3)]
+			cachedcounts = [export_organism(conn, 'Contigs', cacheddir, cachedir=cachedir),
+			                export_organism(conn, 'Contigs', cacheddir, shard=2, shard_count=3, cachedir=cachedir)]
+
+			# Then - identical files, and the caches are gone
+			assert cachedcounts == counts
+			for name in ['Contigs.gff3.gz', 'Contigs.shard2.gff3.gz']:
+				with gzip.open(os.path.join(directdir, name), "rt") as f:
+					direct = f.read()
+				with gzip.open(os.path.join(cacheddir, name), "rt") as f:
+					assert f.read() == direct
+			assert os.listdir(cachedir) == []
+
+		finally:
+			conn.close()
+			for directory in [directdir, cacheddir, cachedir]:
+				shutil.rmtree(directory)
+
+	def test_13_export_attached_to_snapshot(self):
+
+		# Given - a snapshot exported before a curator edit
+		snapshotconn = open_connection(self.read_config())
+		conn = open_connection(self.read_config())
+		dbconn = TestChadoDb.database.connect()
+		before = tempfile.mkdtemp()
+		after = tempfile.mkdtemp()
+		edit = "update feature set name = %s where uniquename = 'Contigs_01_000001';"
+
+		try:
+			snapshot = export_snapshot(snapshotconn)
+			cur = dbconn.cursor()
+			cur.execute(edit, ('Edited',))
+			dbconn.commit()
+
+			# When
+			export_organism(conn, 'Contigs', before, snapshot=snapshot)
+			export_organism(conn, 'Contigs', after)
+
+			# Then - only the export outside the snapshot sees the edit
+			with gzip.open(os.path.join(before, 'Contigs.gff3.gz'), "rt") as f:
+				assert 'Name=Edited' not in f.read()
+			with gzip.open(os.path.join(after, 'Contigs.gff3.gz'), "rt") as f:
+				assert 'Name=Edited' in f.read()
+
+		finally:
+			cur = dbconn.cursor()
+			cur.execute(edit, (None,))
+			dbconn.commit()
+			dbconn.close()
+			conn.close()
+			snapshotconn.close()
+			shutil.rmtree(before)
+			shutil.rmtree(after)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+from chado_executor import *
+
+#
+# Unit tests for the job execution backends.
+#
+class TestChadoExecutor:
+
+	def setup(self):
+		self.workdir = tempfile.mkdtemp()
+
+	def teardown(self):
+		shutil.rmtree(self.workdir)
+
+	def write_script(self, name, body):
+		path = os.path.join(self.workdir, name)
+		with open(path, "w") as f:
+			f.write("#!/bin/bash\n" + body + "\n")
+		return JobSpec(name, path, 3500, 1, path + ".o", path + ".e")
+
+	def test_01_lsf_job_cmd(self):
+
+		# Given
+		executor = LsfExecutor("normal", "/tmp/logs", "chadoexp")
+		job = JobSpec("chadoexp2", "/tmp/scripts/2__Pberghei", 5000, 8, "/tmp/logs/2__Pberghei.o", "/tmp/logs/2__Pberghei.e")
+
+		# When
+		cmd = executor.job_cmd(job)
+
+		# Then
+		assert cmd == "source /etc/bashrc; bsub -J chadoexp2 -q normal -n8  -R 'select[mem>5000] rusage[mem=5000] span[hosts=1]' -M 5000 " + \
+						"-o /tmp/logs/2__Pberghei.o -e /tmp/logs/2__Pberghei.e /tmp/scripts/2__Pberghei"
+		assert executor.finish() == []
+
+	def test_02_local_executor_runs_jobs(self):
+
+		# Given
+		jobs = [self.write_script("ok", "echo exported"),
+				self.write_script("failed", "echo broken 1>&2; exit 3"),
+				self.write_script("slow", "sleep 0.2")]
+		checkerflag = os.path.join(self.workdir, "checked")
+		checker = self.write_script("checker", "touch " + checkerflag)
+		executor = LocalExecutor(2)
+
+		# When
+		for job in jobs:
+			executor.submit(job)
+		executor.submit_checker(checker.script, checker.name)
+		results = executor.finish()
+
+		# Then
+		assert [r.name for r in results] == ["ok", "failed", "slow"]
+		assert [r.exit_code for r in results] == [0, 3, 0]
+		assert results[2].elapsed_secs >= 0.2
+		with open(jobs[0].outlog) as f:
+			assert f.read() == "exported\n"
+		with open(jobs[1].errlog) as f:
+			assert f.read() == "broken\n"
+		assert os.path.isfile(checkerflag)
+
+	def test_03_local_executor_run_jobs_off(self):
+
+		# Given
+		job = self.write_script("ok", "echo exported")
+		executor = LocalExecutor(2, run_jobs=False)
+
+		# When
+		executor.submit(job)
+		results = executor.finish()
+
+		# Then
+		assert results == []
+		assert not os.path.exists(job.outlog)
+
+	def test_04_parse_bsub_job_id(self):
+
+		# Given/When/Then
+		assert parse_bsub_job_id("Job <4711> is submitted to queue <normal>.\n") == '4711'
+		assert parse_bsub_job_id("Request aborted by esub. Job not submitted.\n") is None
+		assert parse_bsub_job_id(None) is None
+
+	def test_05_lsf_checker_cmd_job_ids(self):
+
+		# Given
+		executor = LsfExecutor("normal", "/tmp/logs", "chadoexp")
+
+		# When
+		cmd = executor.checker_cmd("/tmp/checker.sh", "chk-chadoexp", ['101', '102'])
+
+		# Then - the checker depends on exactly these jobs
+		assert cmd == "source /etc/bashrc; bsub -J chk-chadoexp -q normal -R 'select[mem>3500] rusage[mem=3500] span[hosts=1]' -M 3500 " + \
+						"-o /tmp/logs/chk-chadoexp.o -e /tmp/logs/chk-chadoexp.e -w 'ended(101) && ended(102)' /tmp/checker.sh"
+
+	def test_06_lsf_submit_records_job_ids(self):
+
+		# Given
+		import chado_executor
+		commands = []
+		outputs = iter(["Job <101> is submitted to queue <normal>.\n", "Job <102> is submitted to queue <normal>.\n"])
+		def bsub(cmd):
+			commands.append(cmd)
+			return next(outputs)
+		original = chado_executor.run_bash_output
+		chado_executor.run_bash_output = bsub
+		executor = LsfExecutor("normal", "/tmp/logs", "chadoexp")
+
+		# When
+		try:
+			executor.submit(JobSpec("chadoexp1", "/tmp/1__Pf", 3500, 4, "/tmp/1__Pf.o", "/tmp/1__Pf.e"))
+			executor.submit(JobSpec("chadoexp2", "/tmp/2__Pb", 3500, 4, "/tmp/2__Pb.o", "/tmp/2__Pb.e"))
+		finally:
+			chado_executor.run_bash_output = original
+
+		# Then
+		assert len(commands) == 2
+		assert executor.job_ids == { '101': 'chadoexp1', '102': 'chadoexp2' }
+		assert not executor.missing_job_ids
+
+	def test_07_local_executor_peak_memory(self):
+
+		# Given
+		job = self.write_script("alloc", "python3 -c 'x = bytearray(64 * 1024 * 1024)'")
+		executor = LocalExecutor(1)
+
+		# When
+		executor.submit(job)
+		results = executor.finish()
+
+		# Then
+		assert results[0].exit_code == 0
+		assert results[0].max_memory_mb >= 64
+
+	def test_08_lsf_job_cmd_depends(self):
+
+		# Given
+		executor = LsfExecutor("normal", "/tmp/logs", "chadoexp")
+		executor.job_ids = { '101': 'chadoexp1' }
+		job = JobSpec("chadoexp3", "/tmp/scripts/3__Pf.stitch", 3500, 4, "/tmp/logs/3.o", "/tmp/logs/3.e", ['chadoexp1', 'chadoexp2'])
+
+		# When
+		cmd = executor.job_cmd(job)
+
+		# Then - by job ID where known, otherwise by name
+		assert cmd == "source /etc/bashrc; bsub -J chadoexp3 -q normal -n4  -R 'select[mem>3500] rusage[mem=3500] span[hosts=1]' -M 3500 " + \
+						"-o /tmp/logs/3.o -e /tmp/logs/3.e -w 'ended(101) && ended(chadoexp2)' /tmp/scripts/3__Pf.stitch"
+
+	def test_09_local_executor_runs_dependent_jobs_last(self):
+
+		# Given
+		order = os.path.join(self.workdir, "order")
+		shards = [self.write_script("shard%d" % i, "sleep 0.2; echo shard%d >> %s" % (i, order)) for i in (1, 2)]
+		stitch = self.write_script("stitch", "echo stitch >> " + order)
+		stitch.depends = ["shard1", "shard2"]
+		executor = LocalExecutor(3)
+
+		# When
+		executor.submit(shards[0])
+		executor.submit(stitch)
+		executor.submit(shards[1])
+		results = executor.finish()
+
+		# Then
+		assert [r.name for r in results] == ["shard1", "shard2", "stitch"]
+		with open(order) as f:
+			assert f.read().split()[-1] == "stitch"
+
+	def test_10_lsf_job_arrays(self):
+
+		# Given
+		import chado_executor
+		commands = []
+		outputs = iter(["Job <201> is submitted to queue <normal>.\n", "Job <202> is submitted to queue <normal>.\n",
+						"Job <203> is submitted to queue <normal>.\n", ""])
+		def bsub(cmd):
+			commands.append(cmd)
+			return next(outputs)
+		original = (chado_executor.run_bash_output, chado_executor.run_bash)
+		chado_executor.run_bash_output = bsub
+		chado_executor.run_bash = commands.append
+		executor = LsfExecutor("normal", self.workdir, "chadoexp", job_arrays=True, max_running=5)
+		jobs = [self.write_script("%d__Org%d" % (i, i), "echo job%d; echo warning%d 1>&2" % (i, i)) for i in (1, 2, 3)]
+		big = self.write_script("4__Big", "true")
+		big.memory = 7000
+		stitch = self.write_script("5__Big.stitch", "true")
+		stitch.depends = ["2__Org2", "4__Big"]
+
+		# When
+		try:
+			for job in jobs[:2] + [big, stitch, jobs[2]]:
+				executor.submit(job)
+			held = len(commands)
+			executor.submit_checker("/tmp/checker.sh", "chk-chadoexp")
+		finally:
+			(chado_executor.run_bash_output, chado_executor.run_bash) = original
+
+		# Then - nothing is submitted until the checker, then one array per memory request
+		assert held == 0
+		assert commands[0] == "source /etc/bashrc; bsub -J 'chadoexp_array1[1-3]%5' -q normal -n1  " + \
+						"-R 'select[mem>3500] rusage[mem=3500] span[hosts=1]' -M 3500 " + \
+						"-o " + self.workdir + "/chadoexp_array1.%I.o -e " + self.workdir + "/chadoexp_array1.%I.e " + \
+						self.workdir + "/chadoexp_array1.dispatch"
+		assert commands[1].startswith("source /etc/bashrc; bsub -J 4__Big ")
+		assert "-w 'ended(201[2]) && ended(202)' " + stitch.script in commands[2]
+		assert "-w 'ended(201) && ended(202) && ended(203)' /tmp/checker.sh" in commands[3]
+		assert executor.job_ids == { '201[1]': '1__Org1', '201[2]': '2__Org2', '201[3]': '3__Org3', '202': '4__Big', '203': '5__Big.stitch' }
+
+		# When - the dispatcher runs the second element
+		status = subprocess.call([self.workdir + "/chadoexp_array1.dispatch"], env={ 'LSB_JOBINDEX': '2', 'PATH': '/usr/bin:/bin' })
+
+		# Then - its job script runs with output to the job's logs
+		assert status == 0
+		with open(jobs[1].outlog) as f:
+			assert f.read() == "job2\n"
+		with open(jobs[1].errlog) as f:
+			assert f.read() == "warning2\n"
+		assert not os.path.exists(jobs[0].outlog)
+		assert subprocess.call([self.workdir + "/chadoexp_array1.dispatch"], env={ 'LSB_JOBINDEX': '4', 'PATH': '/usr/bin:/bin' }, stderr=subprocess.DEVNULL) == 1
+
+	def test_11_local_executor_killed_job(self):
+
+		# Given - a job killed by a signal
+		job = self.write_script("killed", "kill -TERM $$")
+		executor = LocalExecutor(1)
+
+		# When
+		executor.submit(job)
+		results = executor.finish()
+
+		# Then - the exit code is the negative signal, as from Popen
+		assert results[0].exit_code == -15
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import shutil
+import tempfile
+
+from chado_fixture import ChadoTestDatabase
+from chado_run_manifest import RunManifest, QUEUED, EXPORTING, PUBLISHED
+from chado_stage_metrics import read_metrics
+from chado_export_worker import *
+
+#
+# Unit tests of the memory limit on concurrent organisms.
+#
+class TestMemoryBudget:
+
+	def test_01_next_organism(self):
+
+		# Given - a 10GB job with two large genomes and a small one
+		needs = { 'Large1': 6000, 'Large2': 7000, 'Small': 1000 }
+		budget = MemoryBudget(10000)
+
+		# When/Then - anything can start in an empty job
+		assert next_organism(['Large1', 'Large2', 'Small'], needs, budget) == 'Large1'
+		budget.reserve(needs['Large1'])
+
+		# The other large genome waits, but the small one fits alongside
+		assert next_organism(['Large2', 'Small'], needs, budget) == 'Small'
+		budget.reserve(needs['Small'])
+		assert next_organism(['Large2'], needs, budget) is None
+
+		budget.release(needs['Large1'])
+		assert next_organism(['Large2'], needs, budget) == 'Large2'
+
+		# Without a budget, everything fits
+		assert MemoryBudget(0).fits(100000)
+
+		# Once everything has been released, anything can start again, whatever the rounding of the estimates
+		budget = MemoryBudget(1000)
+		for need in [0.1, 0.2]:
+			budget.reserve(need)
+		for need in [0.1, 0.2]:
+			budget.release(need)
+		assert budget.used_mb != 0
+		assert budget.fits(12000)
+
+	def test_02_publish_file(self):
+
+		# Given
+		workdir = tempfile.mkdtemp()
+		(scratch, results) = (os.path.join(workdir, 'scratch'), os.path.join(workdir, 'results'))
+		os.makedirs(scratch)
+		os.makedirs(results)
+		with open(os.path.join(scratch, 'Pf.gff3.gz'), "w") as f:
+			f.write("gff")
+
+		# When
+		publish_file(os.path.join(scratch, 'Pf.gff3.gz'), os.path.join(results, 'Pf.gff3.gz'))
+
+		# Then - moved, with no temporary file left behind
+		assert os.listdir(scratch) == []
+		assert os.listdir(results) == ['Pf.gff3.gz']
+		assert os.stat(os.path.join(results, 'Pf.gff3.gz')).st_mode & 0o777 == 0o777
+
+		# The scratch path defaults to the job's $TMPDIR
+		original = os.environ.get('TMPDIR')
+		os.environ['TMPDIR'] = scratch
+		try:
+			assert scratch_base({ 'scratch': '' }) == scratch
+			assert scratch_base({ 'scratch': results }) == results
+			assert scratch_base({}) is None
+		finally:
+			if original is None:
+				del os.environ['TMPDIR']
+			else:
+				os.environ['TMPDIR'] = original
+
+		shutil.rmtree(workdir)
+
+
+#
+# Tests of the export worker against a synthetic Chado database.
+# These need a PostgreSQL server, see chado_fixture.py.
+#
+class TestChadoExportWorker:
+
+	database = None
+	configfile = None
+
+	@classmethod
+	def setup_class(cls):
+		cls.database = ChadoTestDatabase()
+		cls.database.start()
+		cls.database.create_synthetic_organism('Worker1', contigs=2, genes=20)
+		cls.database.create_synthetic_organism('Worker2', contigs=1, genes=10, seed=2)
+		cls.database.create_synthetic_organism('Worker3', contigs=1, genes=5, seed=3)
+		cls.configfile = tempfile.NamedTemporaryFile(suffix='.ini', delete=False).name
+		cls.database.write_config(cls.configfile)
+
+	@classmethod
+	def teardown_class(cls):
+		if cls.configfile is not None:
+			os.unlink(cls.configfile)
+		if cls.database is not None:
+			cls.database.stop()
+
+	def setup(self):
+		self.workdir = tempfile.mkdtemp()
+
+	def teardown(self):
+		shutil.rmtree(self.workdir)
+
+	def write_manifest(self, organisms, steps=True, concurrency=1, memory_mb=0, scratch=None, bgzf=None):
+
+		runmanifest = RunManifest(os.path.join(self.workdir, 'run_manifest.json'))
+		runmanifest.reset('chadoexp')
+		for org in organisms:
+			runmanifest.add(org)
+		runmanifest.save()
+
+		path = os.path.join(self.workdir, '1__slice.json')
+		with open(path, "w") as f:
+			json.dump({ 'jobtitle': 'chadoexp',
+			            'configfile': TestChadoExportWorker.configfile,
+			            'organisms': organisms,
+			            'outputdir': self.workdir,
+			            'level': 1,
+			            'threads': 2,
+			            'steps': steps,
+			            'concurrency': concurrency,
+			            'scratch': scratch,
+			            'bgzf': bgzf,
+			            'memory_mb': memory_mb,
+			            'runmanifest': runmanifest.path,
+			            'markers': dict((org, os.path.join(self.workdir, org + '.exporting')) for org in organisms),
+			            'fingerprints': { 'Worker1': [os.path.join(self.workdir, 'Worker1.fingerprint'), os.path.join(self.workdir, 'Worker1.stored')] },
+			            'stagemetrics': os.path.join(self.workdir, 'chadoexp.metrics.jsonl') }, f)
+
+		return (path, runmanifest)
+
+	def test_01_run_slice(self):
+
+		# Given
+		(path, runmanifest) = self.write_manifest(['Worker1', 'Worker2'])
+		with open(os.path.join(self.workdir, 'Worker1.fingerprint'), "w") as f:
+			f.write("fingerprint\n")
+
+		# When
+		status = main(['chado_export_worker.py', '--manifest', path])
+
+		# Then - both organisms are exported and published in the one process
+		assert status == EXIT_OK
+		for org in ['Worker1', 'Worker2']:
+			for suffix in ['.gff3.gz', '.noseq.gff3.gz', '.genome.fasta.gz', '.prot.fasta.gz', '.cdna.fasta.gz']:
+				assert os.path.getsize(os.path.join(self.workdir, org + suffix)) > 0
+		runmanifest.load()
+		assert runmanifest.organisms_in([PUBLISHED]) == ['Worker1', 'Worker2']
+		assert os.path.exists(os.path.join(self.workdir, 'Worker1.stored'))
+		assert not os.path.exists(os.path.join(self.workdir, 'Worker1.fingerprint'))
+
+		# Each in-process stage is measured
+		records = read_metrics(os.path.join(self.workdir, 'chadoexp.metrics.jsonl'))
+		assert [(r['stage'], r['organisms']) for r in records] == [('export', ['Worker1']), ('derived', ['Worker1']), ('publish', ['Worker1']),
+		                                                           ('export', ['Worker2']), ('derived', ['Worker2']), ('publish', ['Worker2'])]
+		assert records[0]['bytes_out'] == os.path.getsize(os.path.join(self.workdir, 'Worker1.gff3.gz'))
+
+	def test_02_run_slice_fails_fast(self):
+
+		# Given - an organism that is not in Chado
+		(path, runmanifest) = self.write_manifest(['Missing', 'Worker2'])
+
+		# When
+		status = main(['chado_export_worker.py', '--manifest', path])
+
+		# Then - the slice stops, leaving the rest for a retry or resumed run
+		assert status == EXIT_STAGE_FAILED
+		assert not os.path.exists(os.path.join(self.workdir, 'Worker2.gff3.gz'))
+		runmanifest.load()
+		assert runmanifest.organisms_in([EXPORTING]) == ['Missing', 'Worker2']
+		records = read_metrics(os.path.join(self.workdir, 'chadoexp.metrics.jsonl'))
+		assert [(r['stage'], r['exit_code']) for r in records] == [('export', 1)]
+
+	def test_03_run_slice_export_only(self):
+
+		# Given - the organism steps are separate jobs
+		(path, runmanifest) = self.write_manifest(['Worker2'], steps=False)
+
+		# When
+		status = run_slice(path)
+
+		# Then
+		assert status == EXIT_OK
+		assert os.path.getsize(os.path.join(self.workdir, 'Worker2.gff3.gz')) > 0
+		assert not os.path.exists(os.path.join(self.workdir, 'Worker2.noseq.gff3.gz'))
+		assert os.path.exists(os.path.join(self.workdir, 'Worker2.exporting'))
+		runmanifest.load()
+		assert runmanifest.state('Worker2') == EXPORTING
+
+	def test_04_bad_manifest(self):
+
+		# Given
+		path = os.path.join(self.workdir, 'bad.json')
+		with open(path, "w") as f:
+			f.write("{ \"organisms\": [] }")
+
+		# When/Then
+		assert run_slice(path) == EXIT_BAD_MANIFEST
+		assert run_slice(os.path.join(self.workdir, 'missing.json')) == EXIT_BAD_MANIFEST
+
+	def test_05_run_slice_concurrently(self):
+
+		# Given
+		(path, runmanifest) = self.write_manifest(['Worker1', 'Worker2'], concurrency=2, memory_mb=8000)
+
+		# When
+		status = run_slice(path)
+
+		# Then
+		assert status == EXIT_OK
+		for org in ['Worker1', 'Worker2']:
+			assert os.path.getsize(os.path.join(self.workdir, org + '.cdna.fasta.gz')) > 0
+		runmanifest.load()
+		assert runmanifest.organisms_in([PUBLISHED]) == ['Worker1', 'Worker2']
+		records = read_metrics(os.path.join(self.workdir, 'chadoexp.metrics.jsonl'))
+		assert sorted((r['stage'], r['organisms'][0]) for r in records if r['stage'] != 'publish') == [('derived', 'Worker1'), ('derived', 'Worker2'),
+		                                                                                              ('export', 'Worker1'), ('export', 'Worker2')]
+
+	def test_05b_run_concurrently_over_budget(self):
+
+		# Given - two small organisms packed before one that needs more than the whole job,
+		# with estimates that do not add back up to exactly 0 MB once both are released
+		(path, runmanifest) = self.write_manifest(['Worker1', 'Worker2', 'Worker3'], concurrency=2, memory_mb=3500)
+		sizes = { 'Worker1': (1234, 999), 'Worker2': (999, 1234), 'Worker3': (10000000, 100000000) }
+
+		# When - the large one runs alone once the small ones have finished
+		status = run_concurrently(read_slice_manifest(path), sizes)
+
+		# Then
+		assert status == EXIT_OK
+		runmanifest.load()
+		assert runmanifest.organisms_in([PUBLISHED]) == ['Worker1', 'Worker2', 'Worker3']
+
+	def test_06_run_slice_concurrently_fails(self):
+
+		# Given
+		(path, runmanifest) = self.write_manifest(['Missing', 'Worker2'], concurrency=2)
+
+		# When/Then - the organisms that could be exported still are
+		assert run_slice(path) == EXIT_STAGE_FAILED
+		runmanifest.load()
+		assert runmanifest.state('Missing') == EXPORTING
+		assert runmanifest.state('Worker2') == PUBLISHED
+
+	def test_07_run_slice_on_scratch(self):
+
+		# Given
+		scratch = tempfile.mkdtemp()
+		(path, runmanifest) = self.write_manifest(['Worker1', 'Missing'], scratch=scratch)
+
+		# When
+		status = run_slice(path)
+
+		# Then - the finished files are published, and scratch is left empty even after the failure
+		assert status == EXIT_STAGE_FAILED
+		for suffix in ['.gff3.gz', '.noseq.gff3.gz', '.genome.fasta.gz', '.prot.fasta.gz', '.cdna.fasta.gz']:
+			assert os.path.getsize(os.path.join(self.workdir, 'Worker1' + suffix)) > 0
+		assert [name for name in os.listdir(self.workdir) if name.endswith('.part')] == []
+		assert os.listdir(scratch) == []
+		runmanifest.load()
+		assert runmanifest.state('Worker1') == PUBLISHED
+		records = read_metrics(os.path.join(self.workdir, 'chadoexp.metrics.jsonl'))
+		assert records[0]['stage'] == 'export' and records[0]['bytes_out'] > 0
+		assert records[2]['stage'] == 'publish' and records[2]['bytes_out'] == records[2]['bytes_in']
+
+		shutil.rmtree(scratch)
+
+	def test_08_run_slice_without_scratch_space(self):
+
+		# Given - a scratch path that cannot be used
+		(path, runmanifest) = self.write_manifest(['Worker2'], scratch=os.path.join(self.workdir, 'missing'))
+
+		# When/Then - the organism is written to the results directory instead
+		assert run_slice(path) == EXIT_OK
+		assert os.path.getsize(os.path.join(self.workdir, 'Worker2.cdna.fasta.gz')) > 0
+
+	def test_09_run_slice_bgzf(self):
+
+		# Given
+		scratch = tempfile.mkdtemp()
+		(path, runmanifest) = self.write_manifest(['Worker1'], scratch=scratch, bgzf='tbi')
+
+		# When
+		status = run_slice(path)
+
+		# Then - the indexes are published with their files
+		assert status == EXIT_OK
+		for name in ['Worker1.gff3.gz.tbi', 'Worker1.noseq.gff3.gz.tbi', 'Worker1.genome.fasta.gz.fai']:
+			assert os.path.getsize(os.path.join(self.workdir, name)) > 0
+		for name in ['Worker1.genome.fasta.gz.gzi', 'Worker1.prot.fasta.gz.fai', 'Worker1.cdna.fasta.gz.fai']:
+			assert os.path.exists(os.path.join(self.workdir, name))
+		assert os.listdir(scratch) == []
+
+		shutil.rmtree(scratch)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+
+from chado_fingerprint import *
+
+#
+# Unit tests for the incremental export fingerprint store.
+#
+class TestChadoFingerprint:
+
+	FINGERPRINT = { 'timelastmodified': '2026-10-01T12:00:00', 'features': 5000, 'organismprops': 'd41d8cd98f00b204e9800998ecf8427e' }
+
+	def setup(self):
+		self.storedir = tempfile.mkdtemp()
+
+	def teardown(self):
+		shutil.rmtree(self.storedir)
+
+	def test_01_unknown_organism_has_changed(self):
+
+		# Given
+		store = FingerprintStore(self.storedir)
+
+		# When/Then
+		assert store.load('Pfalciparum') is None
+		assert store.has_changed('Pfalciparum', TestChadoFingerprint.FINGERPRINT) == True
+
+	def test_02_recorded_fingerprint(self):
+
+		# Given
+		store = FingerprintStore(self.storedir)
+		write_fingerprint(store.fingerprint_file('Pfalciparum'), TestChadoFingerprint.FINGERPRINT)
+
+		modified = dict(TestChadoFingerprint.FINGERPRINT)
+		modified['features'] = 5001
+
+		# When/Then
+		assert store.load('Pfalciparum') == TestChadoFingerprint.FINGERPRINT
+		assert store.has_changed('Pfalciparum', dict(TestChadoFingerprint.FINGERPRINT)) == False
+		assert store.has_changed('Pfalciparum', modified) == True
+
+	def test_03_organism_missing_from_chado_has_changed(self):
+
+		# Given - an organism that Chado returned no fingerprint for
+		store = FingerprintStore(self.storedir)
+		write_fingerprint(store.fingerprint_file('Pfalciparum'), TestChadoFingerprint.FINGERPRINT)
+
+		# When/Then - still exported, so that the failure is reported
+		assert store.has_changed('Pfalciparum', None) == True
+
+	def test_04_corrupt_fingerprint_file(self):
+
+		# Given
+		store = FingerprintStore(self.storedir)
+		with open(store.fingerprint_file('Pfalciparum'), "w") as f:
+			f.write("{ not json")
+
+		# When/Then
+		assert store.load('Pfalciparum') is None
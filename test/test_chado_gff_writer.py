@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import io
+
+from chado_gff_writer import *
+
+#
+# Fake Chado query layer holding one organism with a
+# single gene model on one contig.
+#
+class FakeFeatureSource:
+
+	def __init__(self, residues):
+		self.residues = residues
+
+	def get_organism_id(self, common_name):
+		return 7 if common_name == 'Pfalciparum' else None
+
+	def get_top_level_sequences(self, organism_id):
+		return [(1, 'Pf3D7_01', len(self.residues), 'chromosome')]
+
+	def get_features(self, srcfeature_id):
+		return [(10, 'PF3D7_0100100', 'VAR', 'gene', 9, 90, 1, None),
+				(11, 'PF3D7_0100100.1', None, 'mRNA', 9, 90, 1, None),
+				(12, 'PF3D7_0100100.1:exon:1', None, 'exon', 9, 90, 1, None),
+				(13, 'PF3D7_0100100.1:CDS:1', None, 'CDS', 19, 80, -1, None)]
+
+	def get_feature_properties(self, srcfeature_id):
+		return [(9, 90, 11, 'product', 'erythrocyte membrane protein 1; PfEMP1'),
+				(9, 90, 11, 'product', 'var gene'),
+				(9, 90, 12, 'note', None),
+				(15, 30, 99, 'note', 'property of an obsolete feature')]
+
+	def get_feature_relationships(self, srcfeature_id):
+		return [(9, 90, 11, 'part_of', 'PF3D7_0100100'),
+				(9, 90, 12, 'part_of', 'PF3D7_0100100.1'),
+				(19, 80, 13, 'derives_from', 'PF3D7_0100100.1')]
+
+	def get_feature_dbxrefs(self, srcfeature_id):
+		return [(9, 90, 10, 'PlasmoDB', 'PF3D7_0100100')]
+
+	def get_residues(self, feature_id):
+		yield self.residues[0:70]
+		yield self.residues[70:]
+
+
+#
+# Unit tests for the native Chado GFF3 writer.
+#
+class TestChadoGffWriter:
+
+	def test_01_escape_gff_value(self):
+
+		# Given/When/Then
+		assert escape_gff_value('a;b=c,d&e%f') == 'a%3Bb%3Dc%2Cd%26e%25f'
+		assert escape_gff_value('plain text') == 'plain text'
+
+	def test_02_gff_strand(self):
+
+		# Given/When/Then
+		assert gff_strand(1) == '+'
+		assert gff_strand(-1) == '-'
+		assert gff_strand(0) == '.'
+		assert gff_strand(None) == '.'
+
+	def test_03_write_organism(self):
+
+		# Given
+		residues = 'ACGT' * 25
+		stream = io.StringIO()
+		writer = ChadoGffWriter(FakeFeatureSource(residues), stream)
+
+		expected_output = "##gff-version 3\n" + \
+						"##sequence-region Pf3D7_01 1 100\n" + \
+						"Pf3D7_01\tchado\tchromosome\t1\t100\t.\t+\t.\tID=Pf3D7_01\n" + \
+						"Pf3D7_01\tchado\tgene\t10\t90\t.\t+\t.\tID=PF3D7_0100100;Name=VAR;Dbxref=PlasmoDB:PF3D7_0100100\n" + \
+						"Pf3D7_01\tchado\tmRNA\t10\t90\t.\t+\t.\tID=PF3D7_0100100.1;Parent=PF3D7_0100100;" + \
+						"product=erythrocyte membrane protein 1%3B PfEMP1,var gene\n" + \
+						"Pf3D7_01\tchado\texon\t10\t90\t.\t+\t.\tID=PF3D7_0100100.1:exon:1;Parent=PF3D7_0100100.1\n" + \
+						"Pf3D7_01\tchado\tCDS\t20\t80\t.\t-\t0\tID=PF3D7_0100100.1:CDS:1;Derives_from=PF3D7_0100100.1\n" + \
+						"##FASTA\n" + \
+						">Pf3D7_01\n" + \
+						residues[0:60] + "\n" + \
+						residues[60:] + "\n"
+
+		# When
+		writer.write_organism('Pfalciparum')
+		contents = stream.getvalue()
+
+		# Then
+		assert contents == expected_output, "Assertion failed: \n" + expected_output + "\n\n" + contents
+		assert writer.feature_count == 5
+
+	def test_04_write_unknown_organism(self):
+
+		# Given
+		writer = ChadoGffWriter(FakeFeatureSource('ACGT'), io.StringIO())
+
+		# When/Then
+		try:
+			writer.write_organism('Unknown')
+			assert False, "Expected an exception for an unknown organism"
+		except Exception as err:
+			assert 'Unknown' in str(err)
+
+	def test_05_shard_sequences(self):
+
+		# Given
+		sequences = [(1, 'chr1', 5000, 'chromosome'), (2, 'chr2', 4000, 'chromosome'),
+					 (3, 'chr3', 3000, 'chromosome'), (4, 'contig1', 1000, 'contig'),
+					 (5, 'contig2', None, 'contig')]
+
+		# When
+		shards = shard_sequences(sequences, 2)
+
+		# Then - balanced by length, each shard in name order
+		assert [[s[1] for s in shard] for shard in shards] == [['chr2', 'chr3'], ['chr1', 'contig1', 'contig2']]
+		assert shard_sequences(sequences, 7)[5:] == [[], []]
+		assert shard_file_name('Pfalciparum', 2) == 'Pfalciparum.shard2.gff3.gz'
+
+	def test_06_write_empty_shard(self):
+
+		# Given
+		stream = io.StringIO()
+		writer = ChadoGffWriter(FakeFeatureSource('ACGT'), stream)
+
+		# When - the only sequence belongs to the first shard
+		writer.write_organism('Pfalciparum', 2, 2)
+
+		# Then
+		assert stream.getvalue() == "##gff-version 3\n"
+		assert writer.feature_count == 0
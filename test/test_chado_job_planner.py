@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+
+from chado_job_planner import *
+
+#
+# Unit tests for size-aware job planning.
+#
+class TestChadoJobPlanner:
+
+	# organism -> (features, residues)
+	SIZES = { 'Pfalciparum': (90000, 23000000),
+			  'Pberghei': (80000, 18000000),
+			  'Pknowlesi': (70000, 24000000),
+			  'Plasmid1': (10, 6000),
+			  'Plasmid2': (12, 5000),
+			  'Plasmid3': (8, 7000),
+			  'Tbrucei': (60000, 26000000) }
+
+	def test_01_organism_cost(self):
+
+		# Given/When/Then
+		assert organism_cost(1000, 0) == 1000
+		assert organism_cost(0, 100000) == 1000
+		assert organism_cost(10, 6000) < organism_cost(90000, 23000000)
+
+	def test_02_pack_jobs_balances_cost(self):
+
+		# Given
+		organisms = sorted(TestChadoJobPlanner.SIZES.keys())
+
+		# When
+		jobs = pack_jobs(organisms, TestChadoJobPlanner.SIZES, 3)
+
+		# Then - every organism is packed exactly once
+		assert sorted(org for job in jobs for org in job) == organisms
+		assert len(jobs) == 3
+
+		# and no two large genomes share a job while another job holds only plasmids
+		for job in jobs:
+			large = [org for org in job if not org.startswith('Plasmid')]
+			assert len(large) <= 2
+
+		costs = [sum(organism_cost(*TestChadoJobPlanner.SIZES[org]) for org in job) for job in jobs]
+		assert costs == sorted(costs, reverse=True)
+		assert max(costs) < 2 * min(costs)
+
+	def test_03_pack_jobs_more_jobs_than_organisms(self):
+
+		# Given/When
+		jobs = pack_jobs(['Pfalciparum', 'Plasmid1'], TestChadoJobPlanner.SIZES, 10)
+
+		# Then
+		assert jobs == [['Pfalciparum'], ['Plasmid1']]
+
+	def test_04_pack_jobs_unknown_sizes(self):
+
+		# Given/When
+		jobs = pack_jobs(['Unknown1', 'Pfalciparum', 'Unknown2'], TestChadoJobPlanner.SIZES, 2)
+
+		# Then - organisms missing from Chado cost nothing but are still exported
+		assert jobs == [['Pfalciparum'], ['Unknown1', 'Unknown2']]
+
+	def test_05_job_memory_mb(self):
+
+		# Given/When/Then - small organisms get the minimum request
+		assert job_memory_mb(['Plasmid1', 'Plasmid2'], TestChadoJobPlanner.SIZES) == DEFAULT_MIN_MEMORY_MB
+
+		# Large genomes need more, rounded to 500MB and capped
+		assert job_memory_mb(['Big'], { 'Big': (2000000, 200000000) }) == 7000
+		assert job_memory_mb(['Big'], { 'Big': (2000000, 200000000) }, 1000, 5000) == 5000
+
+	def test_06_organism_size_cache(self):
+
+		# Given
+		cachefile = os.path.join(tempfile.mkdtemp(), 'organism_sizes.json')
+		cache = OrganismSizeCache(cachefile, 1)
+
+		# When
+		cache.load()
+		cache.put('Pfalciparum', 90000, 23000000, now=1000)
+		cache.save()
+
+		reloaded = OrganismSizeCache(cachefile, 1)
+		reloaded.load()
+
+		# Then
+		assert reloaded.get('Pfalciparum', now=1000 + 60) == (90000, 23000000)
+		assert reloaded.get('Pfalciparum', now=1000 + 7200) is None
+		assert reloaded.get('Pberghei', now=1000) is None
+
+		os.unlink(cachefile)
+
+	def test_07_estimate_job(self):
+
+		# Given/When
+		job = estimate_job(['Pfalciparum', 'Plasmid1'], TestChadoJobPlanner.SIZES, 4000, 4)
+		shard = estimate_job(['Pfalciparum'], TestChadoJobPlanner.SIZES, 3500, 4, 0.5)
+
+		# Then - organisms of a job are exported one after another
+		assert (job['features'], job['residues']) == (90010, 23006000)
+		assert job['runtime_secs'] == int(organism_runtime_secs(90000, 23000000) + organism_runtime_secs(10, 6000))
+		assert job['core_hours'] == round(job['runtime_secs'] * 4 / 3600.0, 2)
+		assert job['output_mb'] == round(organism_output_bytes(90010, 23006000) / 1048576.0, 1)
+		assert (shard['features'], shard['residues']) == (45000, 11500000)
+
+		# The longest job bounds the run time of the plan
+		totals = summarise_plan([job, shard])
+		assert (totals['jobs'], totals['organisms'], totals['max_memory_mb']) == (2, 2, 4000)
+		assert totals['longest_job_secs'] == job['runtime_secs']
+		assert format_duration(3725) == "1:02:05"
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import shutil
+import tempfile
+
+from chado_monitor import *
+
+#
+# Unit tests for LSF job tracking.
+#
+class TestChadoMonitor:
+
+	def test_01_parse_lsf_values(self):
+
+		# Given/When/Then
+		assert parse_lsf_memory_mb("512 Mbytes") == 512
+		assert parse_lsf_memory_mb("1.5 Gbytes") == 1536
+		assert parse_lsf_memory_mb("2048 Kbytes") == 2
+		assert parse_lsf_memory_mb("-") is None
+		assert parse_lsf_seconds("45 second(s)") == 45
+		assert parse_lsf_seconds("-") is None
+
+	def test_02_poll(self):
+
+		# Given
+		commands = []
+		def bjobs(cmd):
+			commands.append(cmd)
+			return "101,0,DONE,-,812 Mbytes,3600 second(s),-\n" + \
+				"102,0,EXIT,2,1.2 Gbytes,60 second(s),TERM_MEMLIMIT: job killed after reaching LSF memory usage limit\n" + \
+				"103,0,RUN,-,100 Mbytes,10 second(s),-\n" + \
+				"Job <104> is not found\n"
+		monitor = LsfJobMonitor(run_cmd=bjobs)
+
+		# When
+		states = monitor.poll(['101', '102', '103', '104'])
+
+		# Then - one bjobs call for all jobs
+		assert commands == ["source /etc/bashrc; bjobs -noheader -o 'jobid jobindex stat exit_code max_mem run_time exit_reason delimiter=\",\"' 101 102 103 104"]
+		assert states == { '101': ('DONE', 0, 812, 3600, None),
+						   '102': ('EXIT', 2, 1229, 60, 'TERM_MEMLIMIT: job killed after reaching LSF memory usage limit'),
+						   '103': ('RUN', None, 100, 10, None) }
+
+	def test_03_wait(self):
+
+		# Given
+		outputs = iter(["101,0,RUN,-,10 Mbytes,5 second(s),-\n102,0,PEND,-,-,-,-\n",
+						"101,0,DONE,-,20 Mbytes,8 second(s),-\n102,0,RUN,-,-,1 second(s),-\n",
+						"102,0,EXIT,-,40 Mbytes,3 second(s),TERM_RUNLIMIT: job killed after reaching LSF run time limit\n"])
+		polled = []
+		sleeps = []
+		def bjobs(cmd):
+			polled.append(cmd.split("' ")[1])
+			return next(outputs)
+		monitor = LsfJobMonitor(30, run_cmd=bjobs, sleep=sleeps.append)
+
+		# When
+		results = monitor.wait({ '102': 'chadoexp2', '101': 'chadoexp1' })
+
+		# Then - finished jobs are no longer polled
+		assert polled == ['101 102', '101 102', '102']
+		assert sleeps == [30, 30]
+		assert [(r.name, r.job_id, r.exit_code, r.max_memory_mb) for r in results] == \
+				[('chadoexp1', '101', 0, 20), ('chadoexp2', '102', 1, 40)]
+		assert int(results[0].elapsed_secs) == 8
+		assert [r.exit_reason for r in results] == [None, 'TERM_RUNLIMIT: job killed after reaching LSF run time limit']
+
+	def test_04_wait_forgotten_job(self):
+
+		# Given
+		monitor = LsfJobMonitor(run_cmd=lambda cmd: "Job <101> is not found\n", sleep=lambda secs: None)
+
+		# When
+		results = monitor.wait({ '101': 'chadoexp1' })
+
+		# Then
+		assert results[0].exit_code is None
+
+	def test_04b_wait_job_array(self):
+
+		# Given - elements of job array 201 and a plain job
+		outputs = iter(["201,1,DONE,-,20 Mbytes,8 second(s),-\n201,2,RUN,-,10 Mbytes,5 second(s),-\n202,0,DONE,-,30 Mbytes,4 second(s),-\n",
+						"201,1,DONE,-,20 Mbytes,8 second(s),-\n201,2,EXIT,3,12 Mbytes,9 second(s),-\n"])
+		polled = []
+		def bjobs(cmd):
+			polled.append(cmd.split("' ")[1])
+			return next(outputs)
+		monitor = LsfJobMonitor(run_cmd=bjobs, sleep=lambda secs: None)
+
+		# When
+		results = monitor.wait({ '201[2]': 'chadoexp2', '202': 'chadoexp3', '201[1]': 'chadoexp1' })
+
+		# Then - the array is polled by its job ID
+		assert polled == ['201 202', '201']
+		assert [(r.name, r.job_id, r.exit_code) for r in results] == \
+				[('chadoexp1', '201[1]', 0), ('chadoexp2', '201[2]', 3), ('chadoexp3', '202', 0)]
+
+	def test_05_write_run_summary(self):
+
+		# Given
+		tmpdir = tempfile.mkdtemp()
+		path = os.path.join(tmpdir, 'chadoexp.summary.json')
+		results = [JobResult('chadoexp1', 0, 100.0, 160.0, '101', 812),
+				   JobResult('chadoexp2', 3, 100.0, 110.0, '102', None, 'TERM_RUNLIMIT')]
+		results[0].retries = [('memory', 3500, 4)]
+
+		# When
+		write_run_summary(path, 'chadoexp', 'lsf', results)
+
+		# Then
+		with open(path) as f:
+			summary = json.load(f)
+		assert summary['jobtitle'] == 'chadoexp'
+		assert summary['failed'] == 1
+		assert summary['retried'] == 1
+		assert summary['jobs'] == [{ 'name': 'chadoexp1', 'job_id': '101', 'exit_code': 0, 'exit_reason': None, 'elapsed_secs': 60.0,
+									 'max_memory_mb': 812, 'attempts': 2, 'retries': [{ 'cause': 'memory', 'memory_mb': 3500, 'cores': 4 }] },
+								   { 'name': 'chadoexp2', 'job_id': '102', 'exit_code': 3, 'exit_reason': 'TERM_RUNLIMIT', 'elapsed_secs': 10.0,
+									 'max_memory_mb': None, 'attempts': 1, 'retries': [] }]
+
+		shutil.rmtree(tmpdir)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import shutil
+import asyncio
+import tempfile
+
+from chado_orchestrator import *
+from chado_executor import LsfExecutor
+from chado_monitor import LsfJobMonitor
+
+#
+# Runner that pretends to run jobs, recording
+# how many of each resource class overlap.
+#
+class FakeRunner:
+
+	def __init__(self, duration=0.05):
+		self.duration = duration
+		self.running = {}
+		self.peak = {}
+		self.order = []
+		# job name -> [(exit code, exit reason)] of attempts to fail
+		self.failures = {}
+		self.resources = []
+
+	def open(self):
+		pass
+
+	def close(self):
+		pass
+
+	def checker_job(self, jobscriptpath, name):
+		return JobSpec(name, jobscriptpath, 0, 1, os.devnull, os.devnull)
+
+	async def run(self, job):
+		start = time.time()
+		for key in [None, job.resource]:
+			self.running[key] = self.running.get(key, 0) + 1
+			self.peak[key] = max(self.peak.get(key, 0), self.running[key])
+		self.order.append(job.name)
+		self.resources.append((job.name, job.memory, job.cores))
+		await asyncio.sleep(self.duration)
+		for key in [None, job.resource]:
+			self.running[key] = self.running[key] - 1
+		failures = self.failures.get(job.name, [])
+		(exit_code, exit_reason) = failures.pop(0) if len(failures) > 0 else (0, None)
+		return JobResult(job.name, exit_code, start, time.time(), None, None, exit_reason)
+
+#
+# Unit tests for the asyncio job orchestrator.
+#
+class TestChadoOrchestrator:
+
+	def setup(self):
+		self.workdir = tempfile.mkdtemp()
+
+	def teardown(self):
+		shutil.rmtree(self.workdir)
+
+	def write_script(self, name, body, resource=None):
+		path = os.path.join(self.workdir, name)
+		with open(path, "w") as f:
+			f.write("#!/bin/bash\n" + body + "\n")
+		return JobSpec(name, path, 3500, 1, path + ".o", path + ".e", None, resource)
+
+	def test_01_slot_limits(self):
+
+		# Given
+		runner = FakeRunner()
+		executor = AsyncExecutor(runner, 3, { DB_RESOURCE: 2, IO_RESOURCE: 1 })
+
+		# When
+		for i in range(6):
+			executor.submit(JobSpec("export%d" % i, "export", 0, 1, None, None, None, DB_RESOURCE))
+			executor.submit(JobSpec("steps%d" % i, "steps", 0, 1, None, None, None, IO_RESOURCE))
+		results = executor.finish()
+
+		# Then - results in order of submission, never more than the limits running
+		assert [r.name for r in results][0:4] == ["export0", "steps0", "export1", "steps1"]
+		assert runner.peak == { None: 3, DB_RESOURCE: 2, IO_RESOURCE: 1 }
+
+	def test_02_dependencies(self):
+
+		# Given - the steps are submitted before the exports they depend on
+		runner = FakeRunner()
+		executor = AsyncExecutor(runner)
+		steps = JobSpec("steps", "steps", 0, 1, None, None, ["export1", "export2"], IO_RESOURCE)
+		exports = [JobSpec(name, name, 0, 1, None, None, None, DB_RESOURCE) for name in ["export1", "export2"]]
+
+		# When
+		executor.submit(exports[0])
+		executor.submit(exports[1])
+		executor.submit(steps)
+		executor.submit_checker("checker", "checker")
+		results = executor.finish()
+
+		# Then
+		assert runner.order == ["export1", "export2", "steps", "checker"]
+		assert len(results) == 3
+
+	def test_03_local_job_runner(self):
+
+		# Given
+		jobs = [self.write_script("ok", "echo exported", DB_RESOURCE),
+				self.write_script("failed", "exit 3", IO_RESOURCE)]
+		checkerflag = os.path.join(self.workdir, "checked")
+		checker = self.write_script("checker", "touch " + checkerflag)
+		executor = AsyncExecutor(LocalJobRunner(2), 0, { DB_RESOURCE: 1 })
+
+		# When
+		for job in jobs:
+			executor.submit(job)
+		executor.submit_checker(checker.script, checker.name)
+		results = executor.finish()
+
+		# Then
+		assert [(r.name, r.exit_code) for r in results] == [("ok", 0), ("failed", 3)]
+		assert results[0].max_memory_mb is not None
+		with open(jobs[0].outlog) as f:
+			assert f.read() == "exported\n"
+		assert os.path.exists(checkerflag)
+
+	def test_04_lsf_job_runner(self):
+
+		# Given - LSF reports the first job running once, then both ended
+		cmds = []
+		bjobs = ["101,0,RUN,,10 Mbytes,5 second(s),-\n102,0,DONE,,20 Mbytes,6 second(s),-\n",
+		         "101,0,EXIT,2,30 Mbytes,9 second(s),-\n"]
+
+		def run_cmd(cmd):
+			cmds.append(cmd)
+			if 'bsub' in cmd:
+				return "Job <%d> is submitted to queue <normal>." % (100 + len([c for c in cmds if 'bsub' in c]))
+			return bjobs.pop(0)
+
+		monitor = LsfJobMonitor(0.2, run_cmd)
+		runner = LsfJobRunner(LsfExecutor("normal", "/tmp/logs", "chadoexp"), monitor, run_cmd)
+		executor = AsyncExecutor(runner, 2)
+
+		# When
+		executor.submit(JobSpec("chadoexp1", "/tmp/scripts/1__Pf", 3500, 4, "/tmp/logs/1.o", "/tmp/logs/1.e", None, DB_RESOURCE))
+		executor.submit(JobSpec("chadoexp2", "/tmp/scripts/2__Pb", 3500, 4, "/tmp/logs/2.o", "/tmp/logs/2.e", None, DB_RESOURCE))
+		results = executor.finish()
+
+		# Then - both jobs were polled with a single bjobs call per interval
+		assert [(r.name, r.job_id, r.exit_code, r.max_memory_mb) for r in results] == \
+				[("chadoexp1", "101", 2, 30), ("chadoexp2", "102", 0, 20)]
+		assert len([c for c in cmds if 'bjobs' in c]) == 2
+		assert cmds[2].endswith("' 101 102")
+
+	def test_05_failure_cause(self):
+
+		# Given
+		job = JobSpec("chadoexp1", "1__Pf", 3500, 4, None, None)
+
+		# Then
+		assert failure_cause(job, JobResult("chadoexp1", 0, 0, 1)) is None
+		assert failure_cause(job, JobResult("chadoexp1", None, 0, 1)) == LOST_FAILURE
+		assert failure_cause(job, JobResult("chadoexp1", 130, 0, 1, "101", 3600, "TERM_MEMLIMIT: job killed")) == MEMORY_FAILURE
+		assert failure_cause(job, JobResult("chadoexp1", -9, 0, 1)) == MEMORY_FAILURE
+		assert failure_cause(job, JobResult("chadoexp1", 1, 0, 1, "101", 3500)) == MEMORY_FAILURE
+		assert failure_cause(job, JobResult("chadoexp1", 140, 0, 1, "101", 100, "TERM_RUNLIMIT: job killed")) == RUNTIME_FAILURE
+		assert failure_cause(job, JobResult("chadoexp1", 1, 0, 1, "101", 100)) == EXIT_FAILURE
+
+	def test_06_retry_escalation(self):
+
+		# Given - the export runs out of memory twice and the steps out of time once
+		runner = FakeRunner(0.01)
+		runner.failures = { "export": [(1, "TERM_MEMLIMIT"), (1, "TERM_MEMLIMIT")],
+		                    "steps": [(1, "TERM_RUNLIMIT")],
+		                    "broken": [(2, None), (2, None), (2, None), (2, None)] }
+		executor = AsyncExecutor(runner, retry=RetryPolicy(3, 2, 10000, 8))
+
+		# When
+		executor.submit(JobSpec("export", "export", 3500, 4, None, None, None, DB_RESOURCE))
+		executor.submit(JobSpec("steps", "steps", 3500, 4, None, None, ["export"], IO_RESOURCE))
+		executor.submit(JobSpec("broken", "broken", 3500, 4, None, None, None, DB_RESOURCE))
+		results = executor.finish()
+
+		# Then - memory is doubled up to the limit, cores for time, and attempts are limited
+		assert [(r.name, r.exit_code, r.retries) for r in results] == \
+				[("export", 0, [("memory", 3500, 4), ("memory", 7000, 4)]),
+				 ("steps", 0, [("runtime", 3500, 4)]),
+				 ("broken", 2, [("exit", 3500, 4), ("exit", 3500, 4)])]
+		assert [r for r in runner.resources if r[0] == "export"] == [("export", 3500, 4), ("export", 7000, 4), ("export", 10000, 4)]
+		assert [r for r in runner.resources if r[0] == "steps"] == [("steps", 3500, 4), ("steps", 3500, 8)]
+		assert runner.order.index("steps") > len(runner.order) - 1 - runner.order[::-1].index("export")
+
+	def test_07_retry_resubmit(self):
+
+		# Given - a resubmit callback that finds nothing left to retry
+		calls = []
+		def resubmit(job, result, cause, attempt, memory, cores):
+			calls.append((job.name, cause, attempt, memory, cores))
+			return None
+		runner = FakeRunner(0.01)
+		runner.failures = { "export": [(1, "TERM_MEMLIMIT")] }
+		executor = AsyncExecutor(runner, retry=RetryPolicy(3, 1.5, 0, 0, resubmit))
+
+		# When
+		executor.submit(JobSpec("export", "export", 4000, 4, None, None))
+		results = executor.finish()
+
+		# Then
+		assert calls == [("export", "memory", 2, 6000, 4)]
+		assert [(r.exit_code, r.retries) for r in results] == [(1, [])]
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import shutil
+import tempfile
+
+from chado_run_manifest import *
+
+#
+# Unit tests for the export run manifest.
+#
+class TestChadoRunManifest:
+
+	def setup(self):
+		self.workdir = tempfile.mkdtemp()
+		self.path = os.path.join(self.workdir, MANIFEST_FILE_NAME)
+
+	def teardown(self):
+		shutil.rmtree(self.workdir)
+
+	def test_01_missing_manifest(self):
+
+		# Given
+		manifest = RunManifest(self.path)
+
+		# When/Then
+		assert manifest.load() == False
+		assert manifest.state('Pfalciparum') is None
+
+	def test_02_save_and_load(self):
+
+		# Given
+		manifest = RunManifest(self.path)
+		manifest.reset('chadoexp')
+		for org in ['Pfalciparum', 'Pberghei', 'Lmajor']:
+			manifest.add(org)
+
+		# When
+		manifest.save()
+		loaded = RunManifest(self.path)
+
+		# Then - organisms keep their order
+		assert loaded.load() == True
+		assert loaded.jobtitle == 'chadoexp'
+		assert loaded.organisms_in([QUEUED]) == ['Pfalciparum', 'Pberghei', 'Lmajor']
+		assert not os.path.exists(self.path + ".part")
+
+	def test_03_update_states(self):
+
+		# Given
+		manifest = RunManifest(self.path)
+		manifest.reset('chadoexp')
+		for org in ['Pfalciparum', 'Pberghei', 'Lmajor']:
+			manifest.add(org)
+		manifest.save()
+
+		# When - as the job scripts do
+		main(['chado_run_manifest.py', '-m', self.path, '-s', EXPORTING, 'Pfalciparum', 'Pberghei'])
+		update_states(self.path, ['Pberghei'], MERGED)
+		manifest.load()
+
+		# Then
+		assert [manifest.state(org) for org in ['Pfalciparum', 'Pberghei', 'Lmajor']] == [EXPORTING, MERGED, QUEUED]
+		assert manifest.organisms_in([QUEUED, EXPORTING]) == ['Pfalciparum', 'Lmajor']
+		with open(self.path) as f:
+			assert json.load(f)['organisms'][1] == { 'organism': 'Pberghei', 'state': MERGED }
+
+	def test_04_has_reached(self):
+
+		# When/Then
+		assert has_reached(DERIVED, MERGED) == True
+		assert has_reached(MERGED, MERGED) == True
+		assert has_reached(EXPORTING, MERGED) == False
+		assert has_reached(PUBLISHED, CONVERTED) == True
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import json
+import shutil
+import tempfile
+
+from chado_stage_metrics import *
+
+#
+# Unit tests for the job script stage instrumentation.
+#
+class TestChadoStageMetrics:
+
+	def setup(self):
+		self.workdir = tempfile.mkdtemp()
+		self.metricsfile = os.path.join(self.workdir, "chadoexp.metrics.jsonl")
+
+	def teardown(self):
+		shutil.rmtree(self.workdir)
+
+	def write_file(self, name, size):
+		path = os.path.join(self.workdir, name)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, "w") as f:
+			f.write("x" * size)
+		return path
+
+	def test_01_path_bytes(self):
+
+		# Given
+		self.write_file("Pf/chr1.gff.gz", 100)
+		self.write_file("Pf/sub/chr2.gff.gz", 50)
+		self.write_file("Pb.gff3.gz", 10)
+
+		# When/Then - directories are counted recursively, patterns expanded and missing files ignored
+		assert path_bytes([os.path.join(self.workdir, "Pf")]) == 150
+		assert path_bytes([os.path.join(self.workdir, "*.gff3.gz"), os.path.join(self.workdir, "missing")]) == 10
+
+	def test_02_run_stage(self):
+
+		# Given
+		infile = self.write_file("Pf.gff3", 1000)
+		outfile = os.path.join(self.workdir, "Pf.gff3.gz")
+
+		# When
+		status = main(['chado_stage_metrics.py', 'run', '-m', self.metricsfile, '-s', 'gzip', '-t', 'chadoexp', '-g', 'Pfalciparum',
+					   '-i', infile, '-o', outfile, 'gzip -c ' + infile + ' > ' + outfile])
+		failed = main(['chado_stage_metrics.py', 'run', '-m', self.metricsfile, '-s', 'derived', 'exit 3'])
+
+		# Then - a record is appended per stage and the stage exit status is passed on
+		assert (status, failed) == (0, 3)
+		records = read_metrics(self.metricsfile)
+		assert [(r['stage'], r['organisms'], r['exit_code']) for r in records] == [('gzip', ['Pfalciparum'], 0), ('derived', [], 3)]
+		assert records[0]['bytes_in'] == 1000
+		assert 0 < records[0]['bytes_out'] == os.path.getsize(outfile)
+		assert records[0]['jobtitle'] == 'chadoexp'
+		assert records[0]['wall_secs'] >= 0 and records[0]['max_rss_mb'] >= 0
+
+	def test_03_summarise_metrics(self):
+
+		# Given
+		records = [{ 'stage': 'export', 'organisms': ['Pf', 'Pb'], 'exit_code': 0, 'wall_secs': 100.0, 'user_secs': 150.0, 'sys_secs': 10.0,
+					 'max_rss_mb': 900, 'bytes_in': 0, 'bytes_out': 2048 },
+				   { 'stage': 'derived', 'organisms': ['Pf'], 'exit_code': 1, 'wall_secs': 20.0, 'user_secs': 15.0, 'sys_secs': 1.0,
+					 'max_rss_mb': 300, 'bytes_in': 1024, 'bytes_out': 4096 },
+				   { 'stage': 'derived', 'organisms': ['Pb'], 'exit_code': 0, 'wall_secs': 40.0, 'user_secs': 30.0, 'sys_secs': 2.0,
+					 'max_rss_mb': 500, 'bytes_in': 1024, 'bytes_out': 4096 }]
+
+		# When
+		bystage = summarise_metrics(records)
+		byorganism = dict(summarise_metrics(records, 'organisms'))
+
+		# Then - the stages that take the most time come first
+		assert [name for (name, total) in bystage] == ['export', 'derived']
+		assert bystage[1][1] == { 'count': 2, 'failed': 1, 'wall_secs': 60.0, 'max_wall_secs': 40.0, 'cpu_secs': 48.0,
+								  'max_rss_mb': 500, 'bytes_in': 2048, 'bytes_out': 8192 }
+		assert byorganism['Pf']['wall_secs'] == 120.0 and byorganism['Pb']['wall_secs'] == 140.0
+
+		# When
+		out = io.StringIO()
+		print_summary(bystage, 'stage', out)
+
+		# Then
+		lines = out.getvalue().splitlines()
+		assert lines[0].split()[0:3] == ['stage', 'runs', 'failed']
+		assert lines[1].split() == ['export', '1', '0', '100.0', '62.5', '100.0', '160.0', '1.60', '900', '0.0', '0.0']
@@ -2,11 +2,16 @@
 
 import stat
 import io
+import contextlib
 import tempfile
+import shutil
+import json
+import subprocess
 
 from nose import SkipTest
 
 from generate_gff_from_chado import * 
+from chado_executor import JobResult
 
 #
 # NOTE: This test class relies on the contents of the test orglist file.
@@ -497,3 +502,769 @@ class TestChadoGffExporter:
 		assert self.chadoGffExporter.escape_gt_wildcards(r'/folder1/*/*.gff.gz') == r'/folder1/\*/\*.gff.gz'
 		assert self.chadoGffExporter.escape_gt_wildcards(r'/folder1/file1') == r'/folder1/file1'
 		assert self.chadoGffExporter.escape_gt_wildcards(r'') == r''
+
+	def test_19a_construct_export_cmd_writedb(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+
+		# When
+		cmd = self.chadoGffExporter.construct_export_cmd(['Pfalciparum', 'Pberghei'])
+
+		# Then
+		assert self.chadoGffExporter.exportmethod_property == 'writedb'
+		assert cmd == "writedb_entries.py -v -w /applications/writedb_entry  -o Pfalciparum  -o Pberghei  -x /tmp/chado-export -d " + \
+						TestChadoGffExporter.INI_FILE + " -f 3000"
+
+	def test_19b_construct_export_cmd_native(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.exportmethod_property = 'native'
+		self.chadoGffExporter.nativewriterpath_property = '/applications/chado_gff_writer.py'
+
+		# When
+		cmd = self.chadoGffExporter.construct_export_cmd(['Pfalciparum', 'Pberghei'])
+
+		# Then
+		assert cmd == "/applications/chado_gff_writer.py -i " + TestChadoGffExporter.INI_FILE + \
+						" -o Pfalciparum -o Pberghei -x /tmp/chado-export/results -t 4 -l 6"
+
+	def test_20_get_organism_list_all_sliced(self):
+
+		# Given
+		args = ['program_name', '-a', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+
+		organisms = ['Org%02d' % i for i in range(25)]
+		self.chadoGffExporter.read_public_organisms_from_chado = lambda: iter(organisms)
+
+		# When
+		slices = list(self.chadoGffExporter.get_organism_list(10))
+
+		# Then - every organism is delivered, in slices of organism names
+		assert slices == [organisms[0:10], organisms[10:20], organisms[20:25]]
+
+	def test_21a_construct_job_invoker_cmd(self):
+
+		# Given
+		self.chadoGffExporter.queue_property = "normal"
+		self.chadoGffExporter.logpath_property = "/tmp/alogpath"
+		self.chadoGffExporter.scriptpath_property = "/tmp/ascriptpath"
+
+		expected_output = "source /etc/bashrc; bsub -J chadoexp1 -q normal -n4  " + \
+						"-R 'select[mem>7000] rusage[mem=7000] span[hosts=1]' -M 7000 " + \
+						"-o /tmp/alogpath/1__Pfalciparum.o -e /tmp/alogpath/1__Pfalciparum.e /tmp/ascriptpath/1__Pfalciparum"
+
+		# When
+		cmd = self.chadoGffExporter.construct_job_invoker_cmd("1__Pfalciparum", "chadoexp1", 7000)
+
+		# Then
+		assert cmd == expected_output
+
+	def test_21b_get_job_slices_fixed(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE, '-f', 'test/'+TestChadoGffExporter.ORGLIST_FILE2]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.slice_size_property = 3
+
+		# When
+		slices = self.chadoGffExporter.get_job_slices()
+
+		# Then
+		assert self.chadoGffExporter.packing_property == 'fixed'
+		assert slices == [(sl, 3500) for sl in TestChadoGffExporter.ORG_FILE2_CHUNKS]
+
+	def test_21c_get_job_slices_cost(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE, '-f', 'test/'+TestChadoGffExporter.ORGLIST_FILE2]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.slice_size_property = 5
+		self.chadoGffExporter.packing_property = 'cost'
+
+		sizes = dict((org, (100, 10000)) for org in TestChadoGffExporter.ORG_FILE2_CHUNKS[0])
+		sizes['Epraecox'] = (2000000, 200000000)
+		self.chadoGffExporter.read_organism_sizes = lambda organisms: sizes
+
+		# When
+		slices = self.chadoGffExporter.get_job_slices()
+
+		# Then - the big genome gets a job and a memory request of its own
+		assert len(slices) == 2
+		assert slices[0] == (['Epraecox'], 7000)
+		assert len(slices[1][0]) == 9
+		assert slices[1][1] == 3500
+
+	def test_22_create_executor(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+
+		# When/Then
+		assert self.chadoGffExporter.executor_property == 'lsf'
+		assert isinstance(self.chadoGffExporter.create_executor(), LsfExecutor)
+
+		self.chadoGffExporter.executor_property = 'local'
+		self.chadoGffExporter.localworkers_property = 3
+		executor = self.chadoGffExporter.create_executor()
+		assert isinstance(executor, LocalExecutor)
+		assert executor.workers == 3
+
+	def test_23_get_job_slices_incremental(self):
+
+		# Given
+		args = ['program_name', '-u', '-i', TestChadoGffExporter.INI_FILE, '-f', 'test/'+TestChadoGffExporter.ORGLIST_FILE2]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.slice_size_property = 3
+		self.chadoGffExporter.select_changed_organisms = lambda organisms: [org for org in organisms if org.startswith('E')]
+
+		# When
+		slices = self.chadoGffExporter.get_job_slices()
+
+		# Then - unchanged organisms are dropped and the rest re-sliced
+		assert self.chadoGffExporter.incremental_property == True
+		assert self.chadoGffExporter.fingerprintpath_property == TestChadoGffExporter.BASE_DIR + '/fingerprints'
+		assert slices == [(['Eacervulina', 'Ebrunetti', 'Egranulosus'], 3500),
+						  (['Emaxima', 'Emitis', 'Emultilocularis'], 3500),
+						  (['Enecatrix', 'Epraecox'], 3500)]
+
+	def test_24_construct_merge_cmd(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.gffmergepath_property = '/applications/gff3_merge.py'
+
+		# When
+		cmd = self.chadoGffExporter.construct_merge_cmd('Pfalciparum')
+
+		# Then
+		assert self.chadoGffExporter.mergemethod_property == 'gt'
+		assert cmd == "/applications/gff3_merge.py -t 4 -l 6 -o /tmp/chado-export/results/Pfalciparum.gff3.gz " + \
+						"/tmp/chado-export/artemis/GFF/Pfalciparum 2> /tmp/chado-export/results/Pfalciparum.tidylog"
+
+	def test_25_construct_derived_files_cmd(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.gffderivedpath_property = '/applications/gff3_derived.py'
+
+		# When
+		cmd = self.chadoGffExporter.construct_derived_files_cmd('Pfalciparum')
+
+		# Then
+		assert self.chadoGffExporter.productsmethod_property == 'gt'
+		assert cmd == "/applications/gff3_derived.py -t 4 -l 6 /tmp/chado-export/results/Pfalciparum.gff3.gz"
+
+	def test_26_construct_gzip_cmd(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+
+		# When/Then
+		assert self.chadoGffExporter.compressionlevel_property == 6
+		assert self.chadoGffExporter.construct_gzip_cmd() == "gzip -f"
+
+		self.chadoGffExporter.pigzpath_property = '/usr/bin/pigz'
+		self.chadoGffExporter.compressionlevel_property = 4
+		assert self.chadoGffExporter.construct_gzip_cmd() == "/usr/bin/pigz -p 4 -4 -f"
+		assert self.chadoGffExporter.construct_compression_args() == " -t 4 -l 4"
+
+		# BGZF output for the final files, never for the export shards
+		assert self.chadoGffExporter.bgzfoutput_property == False
+		self.chadoGffExporter.bgzfoutput_property = True
+		self.chadoGffExporter.gffindex_property = 'csi'
+		assert self.chadoGffExporter.construct_compression_args() == " -t 4 -l 4 -b csi"
+		assert self.chadoGffExporter.construct_compression_args(False) == " -t 4 -l 4"
+		self.chadoGffExporter.nativewriterpath_property = '/applications/chado_gff_writer.py'
+		assert " -b " not in self.chadoGffExporter.construct_shard_export_cmd('Pfalciparum', 1, 2)
+
+	def test_27_job_monitoring(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+
+		# When/Then - LSF jobs are not waited for by default
+		assert self.chadoGffExporter.waitforjobs_property == False
+		assert self.chadoGffExporter.create_executor().monitor is None
+		assert self.chadoGffExporter.get_run_summary_file() == self.chadoGffExporter.logpath_property + '/chadoexp.summary.json'
+
+		self.chadoGffExporter.waitforjobs_property = True
+		self.chadoGffExporter.pollinterval_property = 15
+		self.chadoGffExporter.runsummaryfile_property = '/tmp/summary.json'
+		executor = self.chadoGffExporter.create_executor()
+		assert isinstance(executor.monitor, LsfJobMonitor)
+		assert executor.monitor.poll_interval == 15
+		assert self.chadoGffExporter.get_run_summary_file() == '/tmp/summary.json'
+
+	def test_28_get_job_slices_sharded(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE, '-f', 'test/'+TestChadoGffExporter.ORGLIST_FILE2]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.slice_size_property = 4
+		self.chadoGffExporter.shards_property = 3
+		self.chadoGffExporter.shardminresidues_property = 1000000
+		self.chadoGffExporter.read_organism_sizes = lambda organisms: { 'Epraecox': (300000, 60000000) }
+
+		# When
+		slices = self.chadoGffExporter.get_job_slices()
+
+		# Then - the large organism is set aside and the rest re-sliced
+		assert self.chadoGffExporter.shardedorganisms_property == [('Epraecox', 3, 3500)]
+		assert [org for (sl, memory) in slices for org in sl if org == 'Epraecox'] == []
+		assert [len(sl) for (sl, memory) in slices] == [4, 4, 1]
+
+	def test_29_construct_shard_cmds(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.nativewriterpath_property = '/applications/chado_gff_writer.py'
+		self.chadoGffExporter.gffmergepath_property = '/applications/gff3_merge.py'
+		shardpath = '/tmp/chado-export/artemis/GFF/Pfalciparum'
+
+		# When
+		exportcmd = self.chadoGffExporter.construct_shard_export_cmd('Pfalciparum', 2, 3)
+		stitchcmds = self.chadoGffExporter.construct_stitch_cmds('Pfalciparum', [shardpath + '/Pfalciparum.shard1.gff3.gz'])
+
+		# Then
+		assert exportcmd == "/applications/chado_gff_writer.py -i " + TestChadoGffExporter.INI_FILE + " -o Pfalciparum -x " + shardpath + " -t 4 -l 6 -s 2 -n 3"
+		assert stitchcmds == "if [[ ! -s \"" + shardpath + "/Pfalciparum.shard1.gff3.gz\" ]]; then echo \"ERROR: Missing export shard " + \
+							shardpath + "/Pfalciparum.shard1.gff3.gz\" 1>&2; JOB_ERROR_STATUS=1; fi\n" + \
+							"if [[ $JOB_ERROR_STATUS -eq 0 ]]; then\n" + \
+							"   /applications/gff3_merge.py -t 4 -l 6 -o /tmp/chado-export/results/Pfalciparum.gff3.gz " + shardpath + \
+							" 2> /tmp/chado-export/results/Pfalciparum.tidylog\n" + \
+							"fi\n" + \
+							"rm -rf \"" + shardpath + "\"\n"
+
+	def test_30_construct_export_cmd_cached(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.exportmethod_property = 'native'
+		self.chadoGffExporter.nativewriterpath_property = '/applications/chado_gff_writer.py'
+		self.chadoGffExporter.cachepath_property = '/scratch/chado-cache'
+
+		# When
+		cmd = self.chadoGffExporter.construct_export_cmd(['Pfalciparum'])
+		shardcmd = self.chadoGffExporter.construct_shard_export_cmd('Pfalciparum', 1, 2)
+
+		# Then
+		assert cmd == "/applications/chado_gff_writer.py -i " + TestChadoGffExporter.INI_FILE + \
+						" -o Pfalciparum -x /tmp/chado-export/results -t 4 -l 6 -c /scratch/chado-cache"
+		assert shardcmd.endswith(" -s 1 -n 2 -c /scratch/chado-cache")
+
+	def test_31_construct_export_cmd_snapshot(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.exportmethod_property = 'native'
+		self.chadoGffExporter.nativewriterpath_property = '/applications/chado_gff_writer.py'
+
+		# When
+		cmd = self.chadoGffExporter.construct_export_cmd(['Pfalciparum'])
+		self.chadoGffExporter.snapshotid_property = '00000003-0000001B-1'
+		snapshotcmd = self.chadoGffExporter.construct_export_cmd(['Pfalciparum'])
+		shardcmd = self.chadoGffExporter.construct_shard_export_cmd('Pfalciparum', 1, 2)
+
+		# Then - jobs attach to the snapshot only once one has been exported
+		assert self.chadoGffExporter.consistentsnapshot_property == False
+		assert cmd.endswith(" -t 4 -l 6")
+		assert snapshotcmd == cmd + " -S 00000003-0000001B-1"
+		assert shardcmd.endswith(" -s 1 -n 2 -S 00000003-0000001B-1")
+
+	def test_32_execute_export_async_stages(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE, '-f', 'test/'+TestChadoGffExporter.ORGLIST_FILE1]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.orchestrator_property = 'async'
+		self.chadoGffExporter.maxdbjobs_property = 2
+		self.chadoGffExporter.run_jobs = False
+		submitted = []
+
+		class RecordingExecutor:
+			def submit(self, job):
+				submitted.append(job)
+			def finish(self):
+				return []
+
+		tmpdir = tempfile.mkdtemp()
+		self.chadoGffExporter.scriptpath_property = tmpdir
+		self.chadoGffExporter.statuspath_property = tmpdir
+		self.chadoGffExporter.create_executor = lambda: RecordingExecutor()
+
+		# When
+		self.chadoGffExporter.execute_export()
+
+		# Then - each slice's export is a db job, followed by an io job per organism
+		exports = [job for job in submitted if job.resource == DB_RESOURCE]
+		steps = [job for job in submitted if job.resource == IO_RESOURCE]
+		organisms = self.chadoGffExporter.read_organism_list_from_file()
+		assert len(exports) == len(list(self.chadoGffExporter.get_organism_list(self.chadoGffExporter.slice_size)))
+		assert len(steps) == len(organisms) == len(submitted) - len(exports)
+		assert all(len(job.depends) == 1 and job.depends[0] in [export.name for export in exports] for job in steps)
+		assert [os.path.basename(job.script).split('__')[1] for job in steps] == [org + ".steps" for org in organisms]
+
+		shutil.rmtree(tmpdir)
+
+	def test_33_retry_job(self):
+
+		# Given - a native export job of two organisms that ran out of memory after exporting one
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.exportmethod_property = 'native'
+		self.chadoGffExporter.maxattempts_property = 3
+
+		tmpdir = tempfile.mkdtemp()
+		for path in ['scriptpath_property', 'statuspath_property', 'logpath_property', 'finalresultpath_property']:
+			setattr(self.chadoGffExporter, path, tmpdir)
+
+		job = self.chadoGffExporter.create_job_spec("1__PfalciparumPberghei", "chadoexp1", 3500)
+		job.organisms = ['Pfalciparum', 'Pberghei']
+		with open(job.errlog, "w") as f:
+			f.write("MemoryError\n")
+		result = JobResult("chadoexp1", 1, time.time() - 10, time.time(), "101", 3500, "TERM_MEMLIMIT: job killed")
+		with open(tmpdir + "/Pfalciparum.gff3.gz", "w") as f:
+			f.write("exported")
+
+		# When
+		retry = self.chadoGffExporter.retry_job(job, result, 'memory', 2, 7000, 4)
+
+		# Then - only the organism left is exported again, with the escalated memory
+		assert retry.organisms == ['Pberghei']
+		assert (retry.name, retry.memory, retry.cores, retry.errlog) == ("chadoexp1", 7000, 4, job.errlog)
+		assert retry.script == tmpdir + "/1__PfalciparumPberghei.retry2"
+		with open(retry.script) as f:
+			script = f.read()
+		assert " -o Pberghei " in script and "Pfalciparum " not in script
+		assert "touch " + tmpdir + "/1__PfalciparumPberghei.done\n" in script
+		assert os.path.exists(job.errlog + ".attempt1") and not os.path.exists(job.errlog)
+		with open(self.chadoGffExporter.get_retry_log_file()) as f:
+			assert f.read() == "chadoexp1 attempt 1 failed (memory, exit code 1, TERM_MEMLIMIT: job killed): retrying Pberghei with 7000 MB and 4 cores\n"
+
+		# When - the other organism was exported too
+		with open(tmpdir + "/Pberghei.gff3.gz", "w") as f:
+			f.write("exported")
+		retry = self.chadoGffExporter.retry_job(retry, result, 'memory', 3, 10000, 4)
+
+		# Then - there is nothing left to retry
+		assert retry is None
+
+		# When - the job was run by the worker
+		self.chadoGffExporter.jobrunner_property = 'worker'
+		os.remove(tmpdir + "/Pberghei.gff3.gz")
+		retry = self.chadoGffExporter.retry_job(job, result, 'memory', 2, 7000, 4)
+
+		# Then - the worker exports the organism left, within the escalated memory
+		with open(retry.script) as f:
+			script = f.read()
+		assert self.chadoGffExporter.exporterpath + " worker --manifest " + retry.script + ".json || JOB_ERROR_STATUS=$?\n" in script
+		with open(retry.script + ".json") as f:
+			manifest = json.load(f)
+		assert (manifest['organisms'], manifest['memory_mb'], manifest['steps']) == (['Pberghei'], 7000, False)
+
+		shutil.rmtree(tmpdir)
+
+	def test_34_write_checker_job_script_retries(self):
+
+		# Given
+		self.chadoGffExporter.jobtitle_property = 'chadoexp'
+		self.chadoGffExporter.logpath_property = '/tmp/logs'
+		self.chadoGffExporter.maxattempts_property = 2
+		self.chadoGffExporter.reportemailaddress_property = 'someone@somewhere.com'
+		output = io.StringIO()
+
+		# When
+		self.chadoGffExporter.write_checker_job_script(output, ['/tmp/status/1__Pf.done'], ['/tmp/logs/1__Pf.e'])
+
+		# Then - the retried jobs are reported whether or not there were errors
+		script = output.getvalue()
+		assert "if [[ -s /tmp/logs/chadoexp.retries.log ]]; then RETRIES=\"\\nRetried jobs:\\n$(cat /tmp/logs/chadoexp.retries.log)\"; fi\n" in script
+		assert "echo -e \"Organism data has been exported to gff files.$RETRIES\"" in script
+		assert "echo -e \"$MAILMSG$RETRIES\"" in script
+
+	def test_35_resume(self):
+
+		# Given - a run in which one organism was published, one derived and one not exported
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE, '-r']
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.exportmethod_property = 'native'
+		self.chadoGffExporter.run_jobs = False
+
+		tmpdir = tempfile.mkdtemp()
+		for path in ['scriptpath_property', 'statuspath_property', 'logpath_property', 'finalresultpath_property']:
+			setattr(self.chadoGffExporter, path, tmpdir)
+		self.chadoGffExporter.runmanifestfile_property = tmpdir + "/" + MANIFEST_FILE_NAME
+
+		manifest = RunManifest(self.chadoGffExporter.runmanifestfile_property)
+		manifest.reset('chadoexp')
+		manifest.states = { 'Pfalciparum': PUBLISHED, 'Pberghei': DERIVED, 'Lmajor': EXPORTING }
+		manifest.save()
+
+		submitted = []
+
+		class RecordingExecutor:
+			def submit(self, job):
+				submitted.append(job)
+			def finish(self):
+				return []
+
+		self.chadoGffExporter.create_executor = lambda: RecordingExecutor()
+		err = io.StringIO()
+
+		# When
+		with contextlib.redirect_stderr(err):
+			self.chadoGffExporter.execute_export()
+
+		# Then - the unexported organism is exported, the other only published
+		assert err.getvalue().startswith("resuming run chadoexp of ")
+		assert [os.path.basename(job.script) for job in submitted] == ['1__Lmajor', '2__Pberghei.steps']
+		with open(submitted[0].script) as f:
+			script = f.read()
+		assert " -o Lmajor " in script
+		assert self.chadoGffExporter.runmanifestpath + " -m " + tmpdir + "/run_manifest.json -s exporting Lmajor\n" in script
+		assert "-s merged Lmajor" in script and "-s published Lmajor" in script
+		with open(submitted[1].script) as f:
+			script = f.read()
+		assert "gff3_derived.py" not in script and "inlineseq_split" not in script
+		assert "-s merged" not in script and "-s derived" not in script and "-s published Pberghei" in script
+
+		shutil.rmtree(tmpdir)
+
+	def test_36_resume_keeps_files(self):
+
+		# Given
+		tmpdir = tempfile.mkdtemp()
+		self.chadoGffExporter.targetpath_property = tmpdir
+		for (prop, folder) in [('statuspath_property', 'status'), ('logpath_property', 'logs'), ('scriptpath_property', 'scripts'),
+							   ('finalresultpath_property', 'results'), ('fingerprintpath_property', 'fingerprints')]:
+			setattr(self.chadoGffExporter, prop, tmpdir + "/" + folder)
+		os.makedirs(tmpdir + "/logs")
+		with open(tmpdir + "/logs/1__Lmajor.e", "w") as f:
+			f.write("error")
+
+		# When
+		self.chadoGffExporter.resume_property = True
+		self.chadoGffExporter.create_folder_structure()
+
+		# Then
+		assert os.path.exists(tmpdir + "/logs/1__Lmajor.e")
+
+		# When
+		self.chadoGffExporter.resume_property = False
+		self.chadoGffExporter.create_folder_structure()
+
+		# Then
+		assert not os.path.exists(tmpdir + "/logs/1__Lmajor.e")
+
+		shutil.rmtree(tmpdir)
+
+	def test_37_construct_stage_cmd(self):
+
+		# Given
+		tmpdir = tempfile.mkdtemp()
+		self.chadoGffExporter.jobtitle_property = 'chadoexp'
+		self.chadoGffExporter.logpath_property = tmpdir
+		outfile = tmpdir + "/Pfalciparum.genome.fasta.gz"
+
+		# When - disabled
+		cmd = self.chadoGffExporter.construct_stage_cmd('gzip', ['Pfalciparum'], "echo 'ACGT' | gzip > " + outfile, None, [outfile])
+
+		# Then
+		assert cmd == "echo 'ACGT' | gzip > " + outfile
+
+		# When - enabled
+		self.chadoGffExporter.stagemetrics_property = True
+		cmd = self.chadoGffExporter.construct_stage_cmd('gzip', ['Pfalciparum'], "echo 'ACGT' | gzip > " + outfile, None, [outfile])
+		# (test_18 leaves PATH pointing at a removed directory)
+		status = subprocess.call(['/bin/bash', '-c', cmd], env=dict(os.environ, PATH=os.path.dirname(sys.executable) + ":/usr/bin:/bin"))
+
+		# Then - the stage runs and its metrics are recorded
+		assert cmd.startswith(self.chadoGffExporter.stagemetricspath + " run -m " + tmpdir + "/chadoexp.metrics.jsonl -s gzip -t chadoexp -g Pfalciparum -o ")
+		assert status == 0 and os.path.getsize(outfile) > 0
+		with open(tmpdir + "/chadoexp.metrics.jsonl") as f:
+			record = json.loads(f.readline())
+		assert (record['stage'], record['organisms'], record['bytes_out']) == ('gzip', ['Pfalciparum'], os.path.getsize(outfile))
+
+		shutil.rmtree(tmpdir)
+
+	def test_38_plan_export(self):
+
+		# Given - organism sizes in the size cache, and one large enough to shard
+		tmpdir = tempfile.mkdtemp()
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE, '-f', 'test/'+TestChadoGffExporter.ORGLIST_FILE2, '--plan', 'json']
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.slice_size_property = 5
+		self.chadoGffExporter.shards_property = 2
+		self.chadoGffExporter.shardminresidues_property = 1000000
+		self.chadoGffExporter.sizecachefile_property = tmpdir + "/organism_sizes.json"
+		self.chadoGffExporter.runmanifestfile_property = tmpdir + "/" + MANIFEST_FILE_NAME
+
+		cache = OrganismSizeCache(self.chadoGffExporter.sizecachefile_property, 24)
+		for org in [org for sl in TestChadoGffExporter.ORG_FILE2_CHUNKS for org in sl]:
+			cache.put(org, 1000, 100000)
+		cache.put('Epraecox', 300000, 60000000)
+		cache.save()
+
+		# When
+		plan = self.chadoGffExporter.plan_export()
+		out = io.StringIO()
+		self.chadoGffExporter.print_job_plan(plan, self.chadoGffExporter.plan_property, out)
+
+		# Then - the jobs are planned without writing any files
+		assert [(job['kind'], len(job['organisms'])) for job in plan['jobs']] == [('export', 5), ('export', 4), ('shard', 1), ('shard', 1)]
+		assert plan['jobs'][2]['features'] == 150000
+		assert plan['totals']['organisms'] == 10
+		assert plan['totals']['core_hours'] == round(sum(job['core_hours'] for job in plan['jobs']), 2)
+		assert json.loads(out.getvalue())['totals'] == plan['totals']
+		assert os.listdir(tmpdir) == ['organism_sizes.json']
+
+		# When - as a table
+		out = io.StringIO()
+		self.chadoGffExporter.print_job_plan(plan, 'text', out)
+
+		# Then
+		lines = out.getvalue().splitlines()
+		assert len(lines) == 6
+		assert lines[3].endswith("Epraecox (shard 1)")
+		assert lines[5].startswith("4 jobs exporting 10 organisms")
+
+		shutil.rmtree(tmpdir)
+
+	def test_39_create_executor_job_arrays(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.jobarrays_property = True
+		self.chadoGffExporter.maxjobs_property = 20
+
+		# When
+		executor = self.chadoGffExporter.create_executor()
+
+		# Then
+		assert isinstance(executor, LsfExecutor)
+		assert executor.job_arrays and executor.max_running == 20
+
+	def test_40_worker_job_runner(self):
+
+		# Given
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE, '-f', 'test/'+TestChadoGffExporter.ORGLIST_FILE2]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.exportmethod_property = 'native'
+		self.chadoGffExporter.productsmethod_property = 'native'
+		self.chadoGffExporter.jobrunner_property = 'worker'
+		self.chadoGffExporter.slice_size_property = 10
+
+		tmpdir = tempfile.mkdtemp()
+		for path in ['scriptpath_property', 'statuspath_property', 'logpath_property', 'finalresultpath_property']:
+			setattr(self.chadoGffExporter, path, tmpdir)
+		self.chadoGffExporter.runmanifestfile_property = tmpdir + "/" + MANIFEST_FILE_NAME
+
+		submitted = []
+
+		class RecordingExecutor:
+			def submit(self, job):
+				submitted.append(job)
+			def finish(self):
+				return []
+
+		self.chadoGffExporter.create_executor = lambda: RecordingExecutor()
+
+		# When
+		self.chadoGffExporter.execute_export()
+
+		# Then - the slice job runs the worker on its slice manifest
+		assert len(submitted) == 1
+		with open(submitted[0].script) as f:
+			script = f.read()
+		manifestfile = submitted[0].script + ".json"
+		assert self.chadoGffExporter.exporterpath + " worker --manifest " + manifestfile + " || JOB_ERROR_STATUS=$?\n" in script
+		assert "chado_gff_writer.py" not in script and "gff3_derived.py" not in script
+		with open(manifestfile) as f:
+			manifest = json.load(f)
+		assert manifest['organisms'] == [org for sl in TestChadoGffExporter.ORG_FILE2_CHUNKS for org in sl]
+		assert (manifest['outputdir'], manifest['steps'], manifest['threads']) == (tmpdir, True, 4)
+		assert manifest['markers']['Epraecox'] == tmpdir + "/Epraecox.exporting"
+		assert (manifest['concurrency'], manifest['memory_mb']) == (1, 3500)
+		assert manifest['scratch'] is None
+		assert manifest['bgzf'] is None
+
+		# The worker subcommand exits with an error for a bad slice manifest
+		status = subprocess.call([sys.executable, self.chadoGffExporter.exporterpath, 'worker', '--manifest', tmpdir + "/missing.json"],
+		                         stderr=subprocess.DEVNULL, env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+		assert status == 2
+
+		shutil.rmtree(tmpdir)
+
+	def test_41_organism_steps_status(self):
+
+		# Given - a slice whose export failed for its first organism only
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.exportmethod_property = 'native'
+		self.chadoGffExporter.productsmethod_property = 'native'
+		self.chadoGffExporter.gffderivedpath_property = 'true'
+		self.chadoGffExporter.stagemetrics_property = False
+
+		tmpdir = tempfile.mkdtemp()
+		for path in ['scriptpath_property', 'statuspath_property', 'finalresultpath_property']:
+			setattr(self.chadoGffExporter, path, tmpdir)
+		self.chadoGffExporter.runmanifestfile_property = tmpdir + "/" + MANIFEST_FILE_NAME
+
+		manifest = RunManifest(self.chadoGffExporter.runmanifestfile_property)
+		manifest.reset('chadoexp')
+		manifest.states = { 'Pfalciparum': EXPORTING, 'Pberghei': EXPORTING }
+		manifest.save()
+
+		for org in ['Pfalciparum', 'Pberghei']:
+			with open(self.chadoGffExporter.export_marker_file(org), "w") as f:
+				pass
+			os.utime(self.chadoGffExporter.export_marker_file(org), (1000000000, 1000000000))
+		with open(tmpdir + "/Pberghei.gff3.gz", "w") as f:
+			f.write("exported")
+
+		tf = self.chadoGffExporter.open_job_script("1__PfalciparumPberghei")
+		tf.write("JOB_ERROR_STATUS=1\n")
+		for org in ['Pfalciparum', 'Pberghei']:
+			self.chadoGffExporter.write_organism_steps(tf, org)
+		tf.write("exit $JOB_ERROR_STATUS\n")
+		tf.close()
+
+		# When
+		status = subprocess.call(['/bin/bash', tmpdir + "/1__PfalciparumPberghei"], stderr=subprocess.DEVNULL,
+		                         env=dict(os.environ, PATH=os.path.dirname(sys.executable) + ":/usr/bin:/bin", PYTHONPATH=os.pathsep.join(sys.path)))
+
+		# Then - the job fails, but the exported organism is still published
+		assert status == 1
+		manifest.load()
+		assert manifest.states == { 'Pfalciparum': EXPORTING, 'Pberghei': PUBLISHED }
+
+		shutil.rmtree(tmpdir)
+
+	def test_42_organism_steps_failed_step(self):
+
+		# Given - an exported organism whose derived files cannot be written
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.exportmethod_property = 'native'
+		self.chadoGffExporter.productsmethod_property = 'native'
+		self.chadoGffExporter.gffderivedpath_property = 'false'
+		self.chadoGffExporter.stagemetrics_property = False
+
+		tmpdir = tempfile.mkdtemp()
+		for path in ['scriptpath_property', 'statuspath_property', 'finalresultpath_property']:
+			setattr(self.chadoGffExporter, path, tmpdir)
+		self.chadoGffExporter.runmanifestfile_property = tmpdir + "/" + MANIFEST_FILE_NAME
+
+		manifest = RunManifest(self.chadoGffExporter.runmanifestfile_property)
+		manifest.reset('chadoexp')
+		manifest.states = { 'Pberghei': EXPORTING }
+		manifest.save()
+
+		with open(self.chadoGffExporter.export_marker_file('Pberghei'), "w") as f:
+			pass
+		os.utime(self.chadoGffExporter.export_marker_file('Pberghei'), (1000000000, 1000000000))
+		with open(tmpdir + "/Pberghei.gff3.gz", "w") as f:
+			f.write("exported")
+
+		tf = self.chadoGffExporter.open_job_script("1__Pberghei.steps")
+		self.chadoGffExporter.write_organism_steps(tf, 'Pberghei')
+		tf.write("exit $JOB_ERROR_STATUS\n")
+		tf.close()
+
+		# When
+		status = subprocess.call(['/bin/bash', tmpdir + "/1__Pberghei.steps"], stderr=subprocess.DEVNULL,
+		                         env=dict(os.environ, PATH=os.path.dirname(sys.executable) + ":/usr/bin:/bin", PYTHONPATH=os.pathsep.join(sys.path)))
+
+		# Then - the job fails and the organism is left merged, for a resumed run to derive
+		assert status == 1
+		manifest.load()
+		assert manifest.states == { 'Pberghei': MERGED }
+
+		shutil.rmtree(tmpdir)
+
+	def test_43_organism_steps_fingerprint(self):
+
+		# Given - an incremental export of an organism
+		args = ['program_name', '-i', TestChadoGffExporter.INI_FILE]
+		self.chadoGffExporter.read_program_arguments(args)
+		self.chadoGffExporter.read_configuration()
+		self.chadoGffExporter.exportmethod_property = 'native'
+		self.chadoGffExporter.productsmethod_property = 'native'
+		self.chadoGffExporter.incremental_property = True
+		self.chadoGffExporter.stagemetrics_property = False
+
+		tmpdir = tempfile.mkdtemp()
+		for path in ['scriptpath_property', 'statuspath_property', 'finalresultpath_property']:
+			setattr(self.chadoGffExporter, path, tmpdir)
+		self.chadoGffExporter.fingerprintpath_property = tmpdir + "/fingerprints"
+		os.makedirs(tmpdir + "/fingerprints")
+		self.chadoGffExporter.runmanifestfile_property = tmpdir + "/" + MANIFEST_FILE_NAME
+		pending = self.chadoGffExporter.pending_fingerprint_file('Pberghei')
+		stored = FingerprintStore(tmpdir + "/fingerprints").fingerprint_file('Pberghei')
+
+		for (derivedpath, expected) in [('false', False), ('true', True)]:
+
+			manifest = RunManifest(self.chadoGffExporter.runmanifestfile_property)
+			manifest.reset('chadoexp')
+			manifest.states = { 'Pberghei': EXPORTING }
+			manifest.save()
+
+			for path in [self.chadoGffExporter.export_marker_file('Pberghei'), pending]:
+				with open(path, "w") as f:
+					f.write("{}")
+				os.utime(path, (1000000000, 1000000000))
+			with open(tmpdir + "/Pberghei.gff3.gz", "w") as f:
+				f.write("exported")
+
+			self.chadoGffExporter.gffderivedpath_property = derivedpath
+			tf = self.chadoGffExporter.open_job_script("1__Pberghei.steps")
+			self.chadoGffExporter.write_organism_steps(tf, 'Pberghei')
+			tf.write("exit $JOB_ERROR_STATUS\n")
+			tf.close()
+
+			# When
+			subprocess.call(['/bin/bash', tmpdir + "/1__Pberghei.steps"], stderr=subprocess.DEVNULL,
+			                env=dict(os.environ, PATH=os.path.dirname(sys.executable) + ":/usr/bin:/bin", PYTHONPATH=os.pathsep.join(sys.path)))
+
+			# Then - the fingerprint is only recorded once every step has succeeded
+			assert os.path.exists(stored) == expected
+			assert os.path.exists(pending) != expected
+
+		shutil.rmtree(tmpdir)
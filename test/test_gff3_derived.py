@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import os
+import gzip
+import shutil
+import tempfile
+
+from gff3_derived import *
+
+#
+# Unit tests for the single pass derived file writer.
+#
+class TestGff3Derived:
+
+	SEQUENCE = "ATGAAAGTAAGTCCCTAANNNNNNCTACCACATGG"
+
+	ANNOTATION = "##gff-version 3\n" + \
+				"##sequence-region   c1 1 35\n" + \
+				"##sequence-region   c2 1 8\n" + \
+				"c1\tchado\tgene\t1\t18\t.\t+\t.\tID=g1\n" + \
+				"c1\tchado\tmRNA\t1\t18\t.\t+\t.\tID=t1;Parent=g1\n" + \
+				"c1\tchado\tCDS\t1\t6\t.\t+\t0\tID=t1:CDS:1;Parent=t1\n" + \
+				"c1\tchado\tCDS\t13\t18\t.\t+\t0\tID=t1:CDS:2;Parent=t1\n" + \
+				"c1\tchado\tgene\t25\t33\t.\t-\t.\tID=g2\n" + \
+				"c1\tchado\tmRNA\t25\t33\t.\t-\t.\tID=t2;Parent=g2\n" + \
+				"c1\tchado\tCDS\t25\t33\t.\t-\t.\tID=t2:CDS:1;Derives_from=t2\n"
+
+	FASTA = ">c1\n" + \
+			SEQUENCE[0:20] + "\n" + \
+			SEQUENCE[20:] + "\n" + \
+			">c2\n" + \
+			"ACGTACGT\n"
+
+	def test_01_reverse_complement(self):
+
+		# Given/When/Then
+		assert reverse_complement('ATGCn') == 'nGCAT'
+
+	def test_02_translate(self):
+
+		# Given/When/Then
+		assert translate('ATGAAACCCTAA') == 'MKP*'
+		assert translate('atgNNNtg') == 'MX'
+
+	def test_03_write_derived_files(self):
+
+		# Given
+		tmpdir = tempfile.mkdtemp()
+		inputfile = os.path.join(tmpdir, 'Pfalciparum.gff3.gz')
+		with gzip.open(inputfile, "wt") as f:
+			f.write(TestGff3Derived.ANNOTATION + "##FASTA\n" + TestGff3Derived.FASTA)
+
+		# When
+		status = main(['gff3_derived.py', inputfile])
+
+		# Then
+		assert status == 0
+
+		def read(suffix):
+			with gzip.open(os.path.join(tmpdir, 'Pfalciparum' + suffix), "rt") as f:
+				return f.read()
+
+		assert read('.noseq.gff3.gz') == TestGff3Derived.ANNOTATION
+		assert read('.genome.fasta.gz') == TestGff3Derived.FASTA
+		assert read('.prot.fasta.gz') == ">t1\nMKP*\n>t2\nMW*\n"
+		assert read('.cdna.fasta.gz') == ">t1\nATGAAAGTAAGTCCCTAA\n>t2\nATGTGGTAG\n"
+		assert not [name for name in os.listdir(tmpdir) if name.endswith('.part')]
+
+		shutil.rmtree(tmpdir)
+
+	def test_04_write_derived_files_missing_input(self):
+
+		# Given
+		tmpdir = tempfile.mkdtemp()
+
+		# When
+		status = main(['gff3_derived.py', '-o', os.path.join(tmpdir, 'Missing'), os.path.join(tmpdir, 'Missing.gff3.gz')])
+
+		# Then - nothing is left behind
+		assert status == 1
+		assert os.listdir(tmpdir) == []
+
+		shutil.rmtree(tmpdir)
+
+	def test_05_write_derived_files_bgzf(self):
+
+		# Given
+		tmpdir = tempfile.mkdtemp()
+		inputfile = os.path.join(tmpdir, 'Pfalciparum.gff3.gz')
+		with gzip.open(inputfile, "wt") as f:
+			f.write(TestGff3Derived.ANNOTATION + "##FASTA\n" + TestGff3Derived.FASTA)
+
+		# When
+		status = main(['gff3_derived.py', '-b', 'tbi', inputfile])
+
+		# Then - still read by gzip, and indexed
+		assert status == 0
+		with gzip.open(os.path.join(tmpdir, 'Pfalciparum.noseq.gff3.gz'), "rt") as f:
+			assert f.read() == TestGff3Derived.ANNOTATION
+		assert sorted(os.listdir(tmpdir)) == ['Pfalciparum.cdna.fasta.gz', 'Pfalciparum.cdna.fasta.gz.fai', 'Pfalciparum.cdna.fasta.gz.gzi',
+		                                      'Pfalciparum.genome.fasta.gz', 'Pfalciparum.genome.fasta.gz.fai', 'Pfalciparum.genome.fasta.gz.gzi',
+		                                      'Pfalciparum.gff3.gz',
+		                                      'Pfalciparum.noseq.gff3.gz', 'Pfalciparum.noseq.gff3.gz.tbi',
+		                                      'Pfalciparum.prot.fasta.gz', 'Pfalciparum.prot.fasta.gz.fai', 'Pfalciparum.prot.fasta.gz.gzi']
+		with open(os.path.join(tmpdir, 'Pfalciparum.genome.fasta.gz.fai'), "r") as f:
+			assert f.read() == "c1\t35\t4\t20\t21\nc2\t8\t45\t8\t9\n"
+
+		shutil.rmtree(tmpdir)
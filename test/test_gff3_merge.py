@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import gzip
+import shutil
+import tempfile
+import subprocess
+
+from nose import SkipTest
+
+from gff3_merge import *
+
+#
+# Unit tests for the streaming GFF3 merge.
+#
+class TestGff3Merge:
+
+	INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources', 'gff3_merge')
+
+	EXPECTED_OUTPUT = "##gff-version 3\n" + \
+					"##sequence-region   Pf3D7_01 1 60\n" + \
+					"##sequence-region   Pf3D7_02 1 120\n" + \
+					"Pf3D7_01\tchado\tgene\t10\t30\t.\t+\t.\tID=PF3D7_0100100\n" + \
+					"Pf3D7_01\tchado\tmRNA\t10\t30\t.\t+\t.\tID=PF3D7_0100100.1;Parent=PF3D7_0100100\n" + \
+					"Pf3D7_01\tchado\tncRNA_gene\t20\t25\t.\t-\t.\tID=PF3D7_0100200\n" + \
+					"Pf3D7_01\tchado\tncRNA\t20\t25\t.\t-\t.\tID=PF3D7_0100200.1;Parent=PF3D7_0100200\n" + \
+					"Pf3D7_01\tchado\tgene\t40\t55\t.\t+\t.\tID=PF3D7_0100300\n" + \
+					"Pf3D7_01\tchado\tmisc_feature\t45\t50\t.\t+\t.\t.\n" + \
+					"Pf3D7_02\tchado\tgene\t5\t60\t.\t+\t.\tID=PF3D7_0200100\n" + \
+					"Pf3D7_02\tchado\tmRNA\t5\t60\t.\t+\t.\tID=PF3D7_0200100.1;Parent=PF3D7_0200100\n" + \
+					"Pf3D7_02\tchado\tCDS\t5\t60\t.\t+\t0\tID=PF3D7_0200100.1:CDS:1;Parent=PF3D7_0200100.1\n" + \
+					"Pf3D7_02\tchado\tgene\t70\t90\t.\t-\t.\tID=PF3D7_0200200\n" + \
+					"##FASTA\n" + \
+					">Pf3D7_01\n" + \
+					"T" * 60 + "\n" + \
+					">Pf3D7_02\n" + \
+					"ACGT" * 15 + "\n" + \
+					"ACGT" * 15 + "\n"
+
+	#
+	# Parse GFF3 text into comparable parts: sequence regions,
+	# feature lines in file order with their attributes sorted,
+	# and FASTA records.
+	#
+	@staticmethod
+	def normalise(contents):
+
+		regions = set()
+		features = []
+		fasta = {}
+		seqid = None
+
+		lines = iter(contents.splitlines())
+		for line in lines:
+			if line.startswith('##sequence-region'):
+				regions.add(tuple(line.split()[1:]))
+			elif line.startswith('##FASTA'):
+				break
+			elif line.startswith('#') or line.strip() == '':
+				continue
+			else:
+				cols = line.split('\t')
+				cols[8] = ';'.join(sorted(cols[8].split(';')))
+				features.append(tuple(cols))
+
+		for line in lines:
+			if line.startswith('>'):
+				seqid = line[1:].split()[0]
+				fasta[seqid] = ''
+			else:
+				fasta[seqid] = fasta[seqid] + line.strip()
+
+		return (regions, features, fasta)
+
+	def test_01_find_input_files(self):
+
+		# Given/When
+		files = find_input_files([TestGff3Merge.INPUT_DIR])
+
+		# Then - the writedb_entry output tree is searched without flattening
+		assert [os.path.basename(f) for f in files] == ['Pf3D7_02.gff', 'Pf3D7_01.gff', 'Pf3D7_01_ncRNA.gff']
+
+	def test_02_tidy_feature_line(self):
+
+		# Given/When/Then
+		assert tidy_feature_line("c1\tchado\tgene\t20\t10\t.\t+\t.\tID=g1\n", "test") == \
+				('c1', 10, 20, False, "c1\tchado\tgene\t10\t20\t.\t+\t.\tID=g1\n")
+		assert tidy_feature_line("c1\tchado\tCDS\t10\t20\t.\t+\t.\tID=c1;Parent=m1\n", "test") == \
+				('c1', 10, 20, True, "c1\tchado\tCDS\t10\t20\t.\t+\t0\tID=c1;Parent=m1\n")
+		assert tidy_feature_line("c1\tchado\tgene\t10\n", "test") is None
+		assert tidy_feature_line("c1\tchado\tgene\tten\t20\t.\t+\t.\tID=g1\n", "test") is None
+
+	def test_03_merge_gff3_files(self):
+
+		# Given
+		stream = io.StringIO()
+
+		# When
+		count = merge_gff3_files(find_input_files([TestGff3Merge.INPUT_DIR]), stream)
+		contents = stream.getvalue()
+
+		# Then
+		assert contents == TestGff3Merge.EXPECTED_OUTPUT, "Assertion failed: \n" + TestGff3Merge.EXPECTED_OUTPUT + "\n\n" + contents
+		assert count == 10
+
+	def test_04_merge_to_file_gzipped_inputs(self):
+
+		# Given
+		tmpdir = tempfile.mkdtemp()
+		inputs = []
+		for path in find_input_files([TestGff3Merge.INPUT_DIR]):
+			gzfile = os.path.join(tmpdir, os.path.basename(path) + ".gz")
+			with open(path, "rb") as f, gzip.open(gzfile, "wb") as out:
+				shutil.copyfileobj(f, out)
+			inputs.append(gzfile)
+		outfile = os.path.join(tmpdir, 'Pfalciparum.gff3.gz')
+
+		# When
+		status = main(['gff3_merge.py', '-o', outfile] + inputs)
+
+		# Then
+		assert status == 0
+		assert not os.path.exists(outfile + ".part")
+		with gzip.open(outfile, "rt") as f:
+			assert f.read() == TestGff3Merge.EXPECTED_OUTPUT
+
+		shutil.rmtree(tmpdir)
+
+	def test_04b_merge_to_file_bgzf(self):
+
+		# Given - a stale index of an earlier export
+		tmpdir = tempfile.mkdtemp()
+		outfile = os.path.join(tmpdir, 'Pfalciparum.gff3.gz')
+		with open(outfile + ".tbi", "w") as f:
+			f.write("stale")
+
+		# When
+		count = merge_to_file(find_input_files([TestGff3Merge.INPUT_DIR]), outfile, bgzf='csi')
+
+		# Then
+		assert count == 10
+		assert sorted(os.listdir(tmpdir)) == ['Pfalciparum.gff3.gz', 'Pfalciparum.gff3.gz.csi']
+		with gzip.open(outfile, "rt") as f:
+			assert f.read() == TestGff3Merge.EXPECTED_OUTPUT
+
+		shutil.rmtree(tmpdir)
+
+	def test_05_equivalent_to_gt(self):
+
+		# Given
+		gtbin = shutil.which('gt')
+		if gtbin is None:
+			raise SkipTest("genometools gt is not available")
+
+		# gt rejects some of the problems tidied here, so both merge pre-tidied inputs
+		tmpdir = tempfile.mkdtemp()
+		gtfile = os.path.join(tmpdir, 'gt.gff3')
+		inputs = []
+		for path in find_input_files([TestGff3Merge.INPUT_DIR]):
+			tidyfile = os.path.join(tmpdir, os.path.basename(path))
+			with open(path, "r") as f, open(tidyfile, "w") as out:
+				for line in f:
+					if line.startswith('#') or line.startswith('>') or '\t' not in line:
+						out.write(line)
+					else:
+						out.write(tidy_feature_line(line, path)[4])
+			inputs.append(tidyfile)
+
+		# When
+		subprocess.check_call([gtbin, 'gff3', '-sort', '-tidy', '-force', '-retainids', '-o', gtfile] + inputs,
+		                      env=dict(os.environ, GT_RETAINIDS='yes'), stderr=subprocess.DEVNULL)
+		stream = io.StringIO()
+		merge_gff3_files(inputs, stream)
+
+		# Then
+		with open(gtfile, "r") as f:
+			expected = TestGff3Merge.normalise(f.read())
+		assert TestGff3Merge.normalise(stream.getvalue()) == expected
+
+		shutil.rmtree(tmpdir)
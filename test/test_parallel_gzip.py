@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import os
+import gzip
+import shutil
+import struct
+import tempfile
+import subprocess
+import concurrent.futures
+
+from parallel_gzip import *
+
+#
+# Unit tests for the block parallel gzip writer.
+#
+class TestParallelGzip:
+
+	def setup(self):
+		self.tmpdir = tempfile.mkdtemp()
+
+	def teardown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def test_01_compress_member(self):
+
+		# Given/When/Then
+		assert gzip.decompress(compress_member(b'ACGT' * 100, 1)) == b'ACGT' * 100
+
+	def test_02_write_multiple_members(self):
+
+		# Given
+		path = os.path.join(self.tmpdir, 'genome.fasta.gz')
+		lines = [">chr%d\n" % i + "ACGT" * 15 + "\n" for i in range(500)]
+
+		# When
+		with ParallelGzipWriter(path, level=1, threads=4, blocksize=1000) as out:
+			out.writelines(lines)
+			out.write("é\n")
+
+		# Then - many members, read back as one stream by gzip and zcat
+		assert out.members > 4
+		with gzip.open(path, "rt") as f:
+			assert f.read() == ''.join(lines) + "é\n"
+
+		if shutil.which('gzip') is not None:
+			assert subprocess.check_output(['gzip', '-dc', path]).decode('utf-8') == ''.join(lines) + "é\n"
+
+	def test_03_write_empty_file(self):
+
+		# Given
+		path = os.path.join(self.tmpdir, 'empty.gz')
+
+		# When
+		ParallelGzipWriter(path).close()
+
+		# Then
+		with gzip.open(path, "rt") as f:
+			assert f.read() == ''
+
+	def test_04_shared_pool(self):
+
+		# Given
+		pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+		paths = [os.path.join(self.tmpdir, name) for name in ('a.gz', 'b.gz')]
+
+		# When
+		with ParallelGzipWriter(paths[0], pool=pool, threads=2, blocksize=10) as a, \
+			 ParallelGzipWriter(paths[1], pool=pool, threads=2, blocksize=10) as b:
+			for i in range(100):
+				a.write("a%d\n" % i)
+				b.write("b%d\n" % i)
+
+		# Then - the shared pool is left running for its owner
+		assert pool.submit(len, 'abc').result() == 3
+		pool.shutdown()
+
+		for (path, prefix) in zip(paths, ('a', 'b')):
+			with gzip.open(path, "rt") as f:
+				assert f.read() == ''.join("%s%d\n" % (prefix, i) for i in range(100))
+
+	def test_05_write_bgzf(self):
+
+		# Given
+		path = os.path.join(self.tmpdir, 'genome.fasta.gz')
+		text = ''.join(">chr%d\n" % i + "ACGT" * 15 + "\n" for i in range(5000))
+
+		# When
+		with BgzfWriter(path, level=1, threads=4) as out:
+			out.write(text)
+
+		# Then - full BGZF blocks, each one member recording its size, and the end of file marker
+		with gzip.open(path, "rt") as f:
+			assert f.read() == text
+		with open(path, "rb") as f:
+			data = f.read()
+		assert data.endswith(BGZF_EOF)
+		assert len(out.block_offsets) == out.members + 1 == len(text) // BGZF_BLOCK_SIZE + 2
+		for (start, end) in zip(out.block_offsets, out.block_offsets[1:]):
+			assert data[start:start + 4] == b'\x1f\x8b\x08\x04'
+			assert struct.unpack_from('<H', data, start + 16)[0] == end - start - 1
+
+		# A virtual offset is the compressed offset of a block and the offset within it
+		position = 3 * BGZF_BLOCK_SIZE + 10
+		assert out.virtual_offset(position) == (out.block_offsets[3] << 16) | 10
+		with open(path, "rb") as f:
+			f.seek(out.block_offsets[3])
+			assert gzip.decompress(f.read())[10:30] == text[position:position + 20].encode('utf-8')
+
+	def test_06_write_empty_bgzf(self):
+
+		# Given
+		path = os.path.join(self.tmpdir, 'empty.gz')
+
+		# When
+		BgzfWriter(path).close()
+
+		# Then
+		with gzip.open(path, "rt") as f:
+			assert f.read() == ''
+
+	def test_07_rename_output(self):
+
+		# Given - a new file with a tbi index, replacing one with a csi index
+		(partfile, outfile) = (os.path.join(self.tmpdir, 'Pf.gff3.gz.part'), os.path.join(self.tmpdir, 'Pf.gff3.gz'))
+		for path in [partfile, partfile + ".tbi", outfile, outfile + ".csi"]:
+			with open(path, "w") as f:
+				f.write(path)
+
+		# When
+		rename_output(partfile, outfile)
+
+		# Then
+		assert sorted(os.listdir(self.tmpdir)) == ['Pf.gff3.gz', 'Pf.gff3.gz.tbi']
+		with open(outfile + ".tbi", "r") as f:
+			assert f.read() == partfile + ".tbi"
+
+		remove_output(outfile)
+		assert os.listdir(self.tmpdir) == []